@@ -23,6 +23,23 @@ class Config:
     AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
     AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-01-preview")
     AZURE_OPENAI_DEPLOYMENT_ID = os.getenv("AZURE_OPENAI_DEPLOYMENT_ID")
+    # Optional pool of endpoints to route requests across, as a JSON list of
+    # {"endpoint", "api_key", "deployments", "api_version"} objects, where "deployments" maps
+    # each model the endpoint serves to its deployment name
+    AZURE_OPENAI_ENDPOINTS = os.getenv("AZURE_OPENAI_ENDPOINTS")
+
+    # Local table pre-classifier: trained model, confidence needed to skip the LLM, and LLM label log
+    TABLE_CLASSIFIER_PATH = os.getenv("TABLE_CLASSIFIER_PATH", "./models/table_classifier.pkl")
+    TABLE_CLASSIFIER_THRESHOLD = float(os.getenv("TABLE_CLASSIFIER_THRESHOLD", "0.9"))
+    TABLE_CLASSIFICATION_LOG = os.getenv("TABLE_CLASSIFICATION_LOG", "./cache/table_classifications.jsonl")
+
+    # Maximum tokens of retrieved context packed into a RAG prompt
+    RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET") or "6000")
+
+    # RAG conversation memory: optional SQLite database, tokens kept per session and idle eviction time
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH")
+    SESSION_TOKEN_LIMIT = int(os.getenv("SESSION_TOKEN_LIMIT") or "2000")
+    SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS") or "1800")
 
     # Azure Blob Storage Configuration
     AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
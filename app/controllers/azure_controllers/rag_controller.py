@@ -1,9 +1,105 @@
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from app.config import Config
+from app.controllers.document_processing.utils.context_utils import pack_context, result_score
+from app.core.memory.session_store import SessionStore
 from app.services.azure_services.cog_search_service import AzureCogSearchService
 from app.services.azure_services.openai_service import AzureOpenAIService
 
 logger = logging.getLogger(__name__)
 
+RAG_SYSTEM_PROMPT = "You are a helpful assistant that provides detailed and factual answers based on the provided context."
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You summarize conversations between a user and a financial data assistant. Keep the companies, "
+    "fiscal years, figures and conclusions discussed, and anything the user asked to remember. "
+    "Answer with the summary only, in at most 150 words."
+)
+
+# Search result fields reported to the client as the sources of a streamed answer
+SOURCE_FIELDS = ["id", "blob_name", "company_name", "fiscal_year", "is_table"]
+# Fields retrieved from the index: the prompt text and the sources, leaving out large fields such as bounding_regions
+SELECT_FIELDS = ["text"] + SOURCE_FIELDS
+
+# Concurrent searches and completions of a batch
+BATCH_MAX_WORKERS = 8
+# Questions answered by one prompt in grouped batches, and the overlap of retrieved segments
+# (Jaccard similarity of their ids) from which a question joins a group
+BATCH_GROUP_SIZE = 5
+BATCH_GROUP_OVERLAP = 0.3
+
+GROUPED_QUESTIONS_INSTRUCTIONS = (
+    "Answer each of the numbered questions below from the context, as accurately and concisely as possible. "
+    'Return a JSON object: {"answers": [{"id": <question number>, "answer": <answer>}]}'
+)
+
+
+def _odata_string(value: Any) -> str:
+    """
+    Quotes a value as an OData string literal.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _odata_any_of(field: str, values: List[str]) -> str:
+    """
+    Builds an OData clause matching a field equal to any of the values.
+    """
+    if len(values) == 1:
+        return f"{field} eq {_odata_string(values[0])}"
+    # search.in needs a delimiter that no value contains
+    if not any("|" in value for value in values):
+        return f"search.in({field}, {_odata_string('|'.join(values))}, '|')"
+    return "(" + " or ".join(f"{field} eq {_odata_string(value)}" for value in values) + ")"
+
+
+def build_search_filter(
+    company_name: Optional[Union[str, List[str]]] = None,
+    fiscal_year: Optional[Union[str, int, List[Union[str, int]]]] = None,
+    blob_names: Optional[List[str]] = None,
+    is_table: Optional[bool] = None
+) -> Optional[str]:
+    """
+    Builds the OData $filter restricting a search to the segments of given companies, fiscal years
+    and documents.
+
+    Args:
+        company_name (Optional[Union[str, List[str]]]): The company name, or any of several names.
+        fiscal_year (Optional[Union[str, int, List[Union[str, int]]]]): The fiscal year end as indexed
+            (e.g. "September 30, 2023"), or a bare year (e.g. 2023) matched against the words of the
+            fiscal year end; or any of several of these.
+        blob_names (Optional[List[str]]): The documents to search.
+        is_table (Optional[bool]): Whether to search only tables (True) or only paragraphs (False).
+
+    Returns:
+        Optional[str]: The filter expression, or None if no filter is given.
+    """
+    clauses = []
+    if company_name:
+        names = [company_name] if isinstance(company_name, str) else list(company_name)
+        clauses.append(_odata_any_of("company_name", names))
+
+    if fiscal_year:
+        years = [str(year) for year in (fiscal_year if isinstance(fiscal_year, list) else [fiscal_year])]
+        year_clauses = [
+            f"search.ismatch({_odata_string(year)}, 'fiscal_year')" if year.isdigit()
+            else f"fiscal_year eq {_odata_string(year)}"
+            for year in years
+        ]
+        clauses.append(year_clauses[0] if len(year_clauses) == 1 else "(" + " or ".join(year_clauses) + ")")
+
+    if blob_names:
+        clauses.append(_odata_any_of("blob_name", list(blob_names)))
+
+    if is_table is not None:
+        # Stored as '0' or '1'
+        clauses.append(f"is_table eq '{int(is_table)}'")
+
+    return " and ".join(clauses) if clauses else None
+
 class RAGController:
     """
     A controller class to handle Retrieval-Augmented Generation (RAG) flows.
@@ -15,9 +111,137 @@ class RAGController:
         """
         self.search_service = AzureCogSearchService()
         self.openai_service = AzureOpenAIService(deployment="gpt-4o")
+        self.sessions = SessionStore(
+            db_path=Config.SESSION_DB_PATH,
+            summarizer=self.summarize_turns,
+            token_limit=Config.SESSION_TOKEN_LIMIT,
+            idle_seconds=Config.SESSION_IDLE_SECONDS
+        )
         logger.info("RAGController initialized.")
 
-    def execute_rag_flow(self, user_query: str, top: int = 3, semantic_config: str = "test") -> str:
+    def summarize_turns(self, summary: str, messages: List[dict]) -> str:
+        """
+        Folds turns of a conversation into its running summary.
+
+        Args:
+            summary (str): The summary of the turns before, if any.
+            messages (List[dict]): The messages of the turns to fold in.
+
+        Returns:
+            str: The new summary.
+        """
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        user_prompt = (f"Summary so far:\n{summary}\n\n" if summary else "") + f"Conversation:\n{transcript}"
+        return self.openai_service.query(system_prompt=SUMMARY_SYSTEM_PROMPT, user_prompt=user_prompt)
+
+    def history(self, session_id: Optional[str]) -> List[dict]:
+        """
+        Returns the earlier messages of a session, or none without a session.
+
+        Args:
+            session_id (Optional[str]): The session id.
+
+        Returns:
+            List[dict]: The summary of the older turns and the recent messages.
+        """
+        return self.sessions.get_messages(session_id) if session_id else []
+
+    def retrieve(
+        self,
+        user_query: str,
+        top: int = 3,
+        semantic_config: str = "test",
+        search_filter: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the documents relevant to a query with a semantic search, returning only SELECT_FIELDS.
+
+        Args:
+            user_query (str): The user's query.
+            top (int): Number of top documents to retrieve. Defaults to 3.
+            semantic_config (str): The semantic configuration name. Defaults to "test".
+            search_filter (Optional[str]): An OData filter restricting the search (see `build_search_filter`).
+
+        Returns:
+            List[Dict[str, Any]]: The search results.
+        """
+        return self.search_service.search_documents(
+            search_text=user_query,
+            query_type="semantic",
+            semantic_configuration_name=semantic_config,
+            query_caption="extractive",
+            query_answer="extractive",
+            query_answer_count=5,
+            top=top,
+            filter=search_filter,
+            select=SELECT_FIELDS
+        )
+
+    @staticmethod
+    def sources(search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Describes the search results to the client: their SOURCE_FIELDS and score.
+
+        Args:
+            search_results (List[Dict[str, Any]]): The search results.
+
+        Returns:
+            List[Dict[str, Any]]: The sources.
+        """
+        return [
+            {field: result[field] for field in SOURCE_FIELDS if field in result}
+            | {"score": result.get("@search.reranker_score", result.get("@search.score"))}
+            for result in search_results
+        ]
+
+    @staticmethod
+    def pack(search_results: List[Dict[str, Any]], token_budget: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+        """
+        Packs the text of the search results into the context of a prompt (see `pack_context`).
+
+        Args:
+            search_results (List[Dict[str, Any]]): The search results.
+            token_budget (Optional[int]): Maximum tokens of the context. Defaults to RAG_CONTEXT_TOKEN_BUDGET.
+
+        Returns:
+            Tuple[str, Dict[str, int]]: The context and the packing report.
+        """
+        context, report = pack_context(search_results, token_budget or Config.RAG_CONTEXT_TOKEN_BUDGET)
+        logger.info(
+            f"Packed {report['packed']} of {report['results']} search results into {report['tokens']} of "
+            f"{report['budget']} context tokens ({report['duplicates']} near-duplicates dropped, "
+            f"{report['skipped']} over budget)."
+        )
+        return context, report
+
+    @staticmethod
+    def build_prompt(user_query: str, context: str) -> str:
+        """
+        Builds the user prompt from the query and the packed context.
+
+        Args:
+            user_query (str): The user's query.
+            context (str): The context packed from the search results.
+
+        Returns:
+            str: The prompt.
+        """
+        context = context or "No relevant information found."
+        return (
+            f"Below is the user query:\n\n{user_query}\n\n"
+            f"Below is the relevant context retrieved from the documents:\n\n{context}\n\n"
+            "Based on the above context, please answer the user's query as accurately and comprehensively as possible."
+        )
+
+    def execute_rag_flow(
+        self,
+        user_query: str,
+        top: int = 3,
+        semantic_config: str = "test",
+        search_filter: Optional[str] = None,
+        token_budget: Optional[int] = None,
+        session_id: Optional[str] = None
+    ) -> str:
         """
         Executes the RAG flow: Retrieve relevant documents, construct context, and generate an answer.
 
@@ -25,45 +249,253 @@ class RAGController:
             user_query (str): The user's query.
             top (int): Number of top documents to retrieve. Defaults to 3.
             semantic_config (str): The semantic configuration name. Defaults to "test".
+            search_filter (Optional[str]): An OData filter restricting the search (see `build_search_filter`).
+            token_budget (Optional[int]): Maximum tokens of retrieved context. Defaults to RAG_CONTEXT_TOKEN_BUDGET.
+            session_id (Optional[str]): The conversation the query belongs to; its earlier turns are sent
+                with the query and the new turn is added to it. Defaults to a standalone query.
 
         Returns:
             str: The generated answer from OpenAI.
         """
         try:
             # Perform a semantic search with Azure Cognitive Search
-            search_results = self.search_service.search_documents(
-                search_text=user_query,
-                query_type="semantic",
-                semantic_configuration_name=semantic_config,
-                query_caption="extractive",
-                query_answer="extractive",
-                query_answer_count=5,
-                top=top
+            search_results = self.retrieve(
+                user_query, top=top, semantic_config=semantic_config, search_filter=search_filter
             )
 
-            # Use a set to ensure no repeated paragraphs or answers
-            unique_texts = set()
-            for result in search_results:
-                if "text" in result:
-                    unique_texts.add(result["text"])
-
-            # Combine unique texts into a single context
-            context = "\n\n".join(unique_texts) if unique_texts else "No relevant information found."
-            # Construct the prompt for OpenAI
-            prompt = (
-                f"Below is the user query:\n\n{user_query}\n\n"
-                f"Below is the relevant context retrieved from the documents:\n\n{context}\n\n"
-                "Based on the above context, please answer the user's query as accurately and comprehensively as possible."
-            )
+            context, _ = self.pack(search_results, token_budget)
 
-            # Query OpenAI
-            response = self.openai_service.query(
-                system_prompt="You are a helpful assistant that provides detailed and factual answers based on the provided context.",
-                user_prompt=prompt
+            # Query OpenAI, after the earlier turns of the session
+            response = self.openai_service.query_messages(
+                [{"role": "system", "content": RAG_SYSTEM_PROMPT}]
+                + self.history(session_id)
+                + [{"role": "user", "content": self.build_prompt(user_query, context)}]
             )
 
+            # Only the query is kept in the session, not the retrieved context
+            if session_id:
+                self.sessions.append_turn(session_id, user_query, response)
             return response
 
         except Exception as e:
             logger.exception("An error occurred during the RAG flow.")
-            return f"An error occurred: {str(e)}"
\ No newline at end of file
+            return f"An error occurred: {str(e)}"
+
+    def execute_rag_flow_stream(
+        self,
+        user_query: str,
+        top: int = 3,
+        semantic_config: str = "test",
+        search_filter: Optional[str] = None,
+        token_budget: Optional[int] = None,
+        session_id: Optional[str] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Executes the RAG flow, yielding events as soon as they are available: the sources retrieved,
+        then the answer as it is generated.
+
+        Args:
+            user_query (str): The user's query.
+            top (int): Number of top documents to retrieve. Defaults to 3.
+            semantic_config (str): The semantic configuration name. Defaults to "test".
+            search_filter (Optional[str]): An OData filter restricting the search (see `build_search_filter`).
+            token_budget (Optional[int]): Maximum tokens of retrieved context. Defaults to RAG_CONTEXT_TOKEN_BUDGET.
+            session_id (Optional[str]): The conversation the query belongs to; its earlier turns are sent
+                with the query and the new turn is added to it. Defaults to a standalone query.
+
+        Yields:
+            Tuple[str, Dict[str, Any]]: The event name and its data: a 'retrieval' event with the
+            sources, 'token' events with the answer text, and a final 'done' event with the timings,
+            or an 'error' event.
+        """
+        start = time.perf_counter()
+        try:
+            search_results = self.retrieve(
+                user_query, top=top, semantic_config=semantic_config, search_filter=search_filter
+            )
+            sources = self.sources(search_results)
+            context, packing = self.pack(search_results, token_budget)
+            retrieval_time = time.perf_counter() - start
+            yield "retrieval", {"sources": sources, "retrieval_time": retrieval_time, "context": packing}
+
+            answer, stream_stats = [], {}
+            for text in self.openai_service.query_stream(
+                system_prompt=RAG_SYSTEM_PROMPT,
+                user_prompt=self.build_prompt(user_query, context),
+                history=self.history(session_id),
+                stats=stream_stats
+            ):
+                answer.append(text)
+                yield "token", {"text": text}
+
+            if session_id:
+                self.sessions.append_turn(session_id, user_query, "".join(answer))
+
+            ttft = stream_stats.get("ttft")
+            total_time = time.perf_counter() - start
+            logger.info(
+                f"Streamed RAG answer: retrieval {retrieval_time:.3f}s, "
+                f"time to first token {ttft if ttft is not None else float('nan'):.3f}s, total {total_time:.3f}s."
+            )
+            yield "done", {"retrieval_time": retrieval_time, "ttft": ttft, "total_time": total_time}
+
+        except Exception as e:
+            logger.exception("An error occurred during the streaming RAG flow.")
+            yield "error", {"error": f"An error occurred: {str(e)}"}
+
+    @staticmethod
+    def group_queries(
+        result_ids: List[set],
+        group_size: int = BATCH_GROUP_SIZE,
+        min_overlap: float = BATCH_GROUP_OVERLAP
+    ) -> List[List[int]]:
+        """
+        Groups the queries of a batch whose retrieved segments overlap, in query order.
+
+        Args:
+            result_ids (List[set]): The ids of the segments retrieved for each query.
+            group_size (int): Maximum queries per group. Defaults to BATCH_GROUP_SIZE.
+            min_overlap (float): Jaccard similarity of a query's segments with a group's segments from
+                which the query joins the group. Defaults to BATCH_GROUP_OVERLAP.
+
+        Returns:
+            List[List[int]]: The query indices of each group.
+        """
+        groups: List[Tuple[List[int], set]] = []
+        for i, ids in enumerate(result_ids):
+            best, best_overlap = None, min_overlap
+            for members, group_ids in groups:
+                union = ids | group_ids
+                overlap = len(ids & group_ids) / len(union) if union else 0.0
+                if len(members) < group_size and overlap >= best_overlap:
+                    best, best_overlap = (members, group_ids), overlap
+            if best is None:
+                groups.append(([i], set(ids)))
+            else:
+                best[0].append(i)
+                best[1].update(ids)
+        return [members for members, _ in groups]
+
+    def _answer_group(
+        self,
+        queries: List[str],
+        search_results: List[Dict[str, Any]],
+        token_budget: Optional[int]
+    ) -> List[Optional[str]]:
+        """
+        Answers several questions with one JSON prompt over their merged context.
+
+        Returns:
+            List[Optional[str]]: The answer to each question, None where the response has none.
+        """
+        context, _ = self.pack(search_results, token_budget)
+        questions = "\n".join(f"{i + 1}. {query}" for i, query in enumerate(queries))
+        prompt = (
+            f"{GROUPED_QUESTIONS_INSTRUCTIONS}\n\nQuestions:\n{questions}\n\n"
+            f"Context:\n\n{context or 'No relevant information found.'}"
+        )
+        answers: List[Optional[str]] = [None] * len(queries)
+        try:
+            response = json.loads(self.openai_service.query_json(prompt, use_memory=False))
+            items = response.get("answers", []) if isinstance(response, dict) else []
+        except Exception as e:
+            logger.warning(f"Grouped answer failed: {e}")
+            return answers
+
+        for item in items if isinstance(items, list) else []:
+            try:
+                index = int(item.get("id")) - 1
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if 0 <= index < len(queries) and item.get("answer") not in (None, ""):
+                answers[index] = str(item["answer"])
+        return answers
+
+    def execute_rag_batch(
+        self,
+        queries: List[str],
+        top: int = 3,
+        semantic_config: str = "test",
+        search_filter: Optional[str] = None,
+        token_budget: Optional[int] = None,
+        grouped: bool = False,
+        max_workers: int = BATCH_MAX_WORKERS
+    ) -> List[Dict[str, Any]]:
+        """
+        Executes the RAG flow for a batch of queries, typically a checklist against the same filings.
+
+        The searches run concurrently. Queries are then answered either with concurrent completions, or,
+        if `grouped`, by one JSON prompt per group of queries whose retrieved segments overlap (see
+        `group_queries`), over the merged and deduplicated segments of the group. Questions a grouped
+        response leaves unanswered are answered on their own.
+
+        Args:
+            queries (List[str]): The user's queries.
+            top (int): Number of top documents to retrieve per query. Defaults to 3.
+            semantic_config (str): The semantic configuration name. Defaults to "test".
+            search_filter (Optional[str]): An OData filter restricting the searches (see `build_search_filter`).
+            token_budget (Optional[int]): Maximum tokens of retrieved context per prompt. Defaults to RAG_CONTEXT_TOKEN_BUDGET.
+            grouped (bool): Whether to answer groups of queries with shared prompts. Defaults to False.
+            max_workers (int): Maximum concurrent searches and completions. Defaults to BATCH_MAX_WORKERS.
+
+        Returns:
+            List[Dict[str, Any]]: For each query, in order: the query, its answer (or error), its sources,
+            and its latency (seconds of its search and of the completion that answered it).
+        """
+        def timed(function, *args):
+            start = time.perf_counter()
+            try:
+                return function(*args), None, time.perf_counter() - start
+            except Exception as e:
+                logger.exception("An error occurred during a batched RAG query.")
+                return None, f"An error occurred: {str(e)}", time.perf_counter() - start
+
+        def answer_query(i: int) -> Optional[str]:
+            context, _ = self.pack(search_results[i], token_budget)
+            return self.openai_service.query_messages([
+                {"role": "system", "content": RAG_SYSTEM_PROMPT},
+                {"role": "user", "content": self.build_prompt(queries[i], context)}
+            ])
+
+        results = [{"query": query, "answer": None, "sources": [], "latency": 0.0} for query in queries]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as executor:
+            searches = list(executor.map(
+                lambda query: timed(self.retrieve, query, top, semantic_config, search_filter), queries
+            ))
+            search_results = [found or [] for found, _, _ in searches]
+            for result, (found, error, latency) in zip(results, searches):
+                result["sources"] = self.sources(found or [])
+                result["latency"] = latency
+                if error:
+                    result["answer"] = error
+
+            pending = [i for i, (_, error, _) in enumerate(searches) if error is None]
+            if grouped:
+                ids = [{r.get("id", r.get("text")) for r in search_results[i]} for i in pending]
+                groups = [[pending[j] for j in group] for group in self.group_queries(ids)]
+                logger.info(f"Answering {len(pending)} batched queries with {len(groups)} grouped prompts.")
+
+                def answer_group(group: List[int]) -> Tuple[List[int], Optional[List[Optional[str]]], float]:
+                    # Merge the group's segments, keeping each segment once
+                    merged = {}
+                    for i in group:
+                        for r in search_results[i]:
+                            key = r.get("id", r.get("text"))
+                            if key not in merged or result_score(r) > result_score(merged[key]):
+                                merged[key] = r
+                    answers, _, latency = timed(
+                        self._answer_group, [queries[i] for i in group], list(merged.values()), token_budget
+                    )
+                    return group, answers, latency
+
+                for group, answers, latency in executor.map(answer_group, groups):
+                    for i, answer in zip(group, answers or [None] * len(group)):
+                        results[i]["answer"] = answer
+                        results[i]["latency"] += latency
+                pending = [i for i in pending if results[i]["answer"] is None]
+
+            for i, (answer, error, latency) in zip(pending, executor.map(lambda i: timed(answer_query, i), pending)):
+                results[i]["answer"] = answer if error is None else error
+                results[i]["latency"] += latency
+        return results
+
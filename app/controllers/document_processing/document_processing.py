@@ -1,18 +1,46 @@
 import os
-from typing import List
-from app.controllers.document_processing.utils import doc_intel_utils, general_utils, openai_utils, cog_search_utils
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from app.controllers.document_processing.utils import (
+    doc_intel_utils, general_utils, openai_utils, cog_search_utils, prompt_utils, retrieval_utils, metadata_utils
+)
+from app.services.azure_services import usage_tracker
 from app.services.azure_services.openai_service import AzureOpenAIService
 from app.services.azure_services.blob_storage_service import AzureBlobStorageService
 from app.controllers.azure_controllers.cog_search_controller import CogSearchController
 from app.core.fs_generators.income_statement_gen import generate_income_statement
+from app.core.fs_generators.income_statement_json_gen import generate_income_statement_single_pass
+from app.core.fs_generators.income_statement_agg import aggregate_income_statements
+from app.core.classifiers.table_classifier import load_default_pre_classifier, log_classifications
 
-def process_documents(blob_names: List[str]) -> str:
+# Leading characters of a document read by the metadata extractors before any retrieval fallback
+METADATA_HEAD_CHARS = 5000
+
+def process_documents(
+    blob_names: List[str],
+    stream: bool = False,
+    target_pages: bool = False,
+    single_pass: bool = False,
+    hedged: bool = False,
+    run_id: Optional[str] = None
+) -> str:
     """
     Processes documents from Azure Blob Storage, extracts structured data,
     and uploads an aggregated income statement DataFrame to Azure Blob Storage.
 
     Args:
         blob_names (List[str]): List of blob names to process.
+        stream (bool): Whether to structure each document as a stream of segments that are indexed
+            and classified while later segments are still being built. Defaults to False.
+        target_pages (bool): Whether to analyze only the pages likely to hold the financial statements,
+            selected from the PDF text layer, falling back to all pages when none are found. Defaults to False.
+        single_pass (bool): Whether to extract each income statement from a single JSON response with
+            locally verified subtotals instead of five sequential queries. Defaults to False.
+        hedged (bool): Whether to send the metadata queries of increasing context concurrently,
+            staggered by the observed query latency, instead of one after another. Defaults to False.
+        run_id (Optional[str]): The run id the Azure OpenAI usage of each filing and stage is recorded
+            under (see `usage_tracker.get_run_usage`). Defaults to a new id.
 
     Returns:
         str: The blob as a sas url of the uploaded Excel sheet.
@@ -22,59 +50,264 @@ def process_documents(blob_names: List[str]) -> str:
     blob_service = AzureBlobStorageService()
     results = {}
 
-    for blob_name in blob_names:
-        print(f"Processing document: {blob_name}")
+    with usage_tracker.usage_run(run_id) as run_id:
+        for blob_name in blob_names:
+            print(f"Processing document: {blob_name}")
+            with usage_tracker.usage_filing(blob_name):
+                year_ended, statement = _process_document(
+                    blob_name, openai_service, cog_search_controller, stream, target_pages, single_pass, hedged
+                )
+            # Step 8: Add Results to Dictionary
+            results[year_ended] = statement
 
-        # Step 1: Analyze Document
-        analyze_document_result = doc_intel_utils.process_blob_document(blob_name)
+        # Step 9: Aggregate Income Statements
+        with usage_tracker.usage_stage("aggregation"):
+            df = aggregate_income_statements(results, openai_service)
 
-        # Step 2: Convert Analyze Document to Structured Data
-        text, text_sources, table_indicator, table_sources = general_utils.convert_analyze_document_to_structured_data(
-            result=analyze_document_result
+        # Step 10: Store Aggregated DataFrame in Azure Blob Storage
+        with usage_tracker.usage_stage("upload"):
+            excel_blob_name = general_utils.store_dataframe_to_blob(df, blob_service)
+            sas_url = blob_service.get_blob_sas_url(excel_blob_name)
+
+    usage = usage_tracker.get_run_usage(run_id)
+    if usage:
+        total = usage["total"]
+        hit_rate = total["cached_tokens"] / total["prompt_tokens"] if total["prompt_tokens"] else 0.0
+        print(
+            f"Prompt cache: {total['cached_tokens']} of {total['prompt_tokens']} prompt tokens cached "
+            f"({hit_rate:.0%}) over {total['requests']} requests."
         )
+        for field, counts in metadata_utils.get_metadata_hit_rates(total).items():
+            resolved = sum(counts.values())
+            rates = ", ".join(f"{path} {count / resolved:.0%}" for path, count in counts.items())
+            print(f"Metadata '{field}' resolved by {rates} of {resolved} lookups.")
+    for stage, counters in (usage["stages"] if usage else {}).items():
+        print(
+            f"Stage {stage}: {counters['requests']} LLM calls, {counters['prompt_tokens']} prompt and "
+            f"{counters['completion_tokens']} completion tokens, {counters['retries']} retries, "
+            f"{counters['wall_time']:.1f}s, ${counters['cost']:.4f}."
+        )
+        if counters.get("table_tokens"):
+            print(
+                f"Stage {stage}: {counters['table_tokens_sent']} of {counters['table_tokens']} table tokens "
+                f"sent in prompts ({counters['table_tokens'] - counters['table_tokens_sent']} saved)."
+            )
+        if counters.get("step_runs"):
+            print(
+                f"Stage {stage}: {counters['step_attempts']} statement step calls over {counters['step_runs']} "
+                f"runs ({counters['step_corrections']} corrections, {counters['step_failures']} failures)."
+            )
+    return sas_url
+
+def _process_document(
+    blob_name: str,
+    openai_service: AzureOpenAIService,
+    cog_search_controller: CogSearchController,
+    stream: bool,
+    target_pages: bool,
+    single_pass: bool,
+    hedged: bool
+) -> Tuple[Optional[str], Tuple[List, List[float]]]:
+    """
+    Runs steps 1-7 of `process_documents` on one filing, each as a usage stage.
+
+    Returns:
+        Tuple: The fiscal year end and the (dataframes, amounts) of the filing's income statement.
+    """
+    # Step 1: Analyze Document
+    with usage_tracker.usage_stage("analysis"):
+        if target_pages:
+            analyze_document_result, page_report = doc_intel_utils.process_blob_document_targeted(blob_name)
+            print(
+                f"Analyzed {page_report['analyzed_pages']} of {page_report['total_pages']} pages "
+                f"({page_report['page_reduction']:.0%} reduction) for {blob_name}"
+            )
+            if page_report["fallback"]:
+                print(f"Page targeting fell back to the full document: {page_report['fallback_reason']}")
+        else:
+            analyze_document_result = doc_intel_utils.process_blob_document(blob_name)
+
+    if stream:
+        # Steps 2-5: Structure, index and classify the document incrementally
+        with usage_tracker.usage_stage("segment_stream"):
+            year_ended, company_name, dfs, classifications, index = process_segment_stream(
+                analyze_document_result, blob_name, openai_service, cog_search_controller,
+                index_cache_key=_index_cache_key(blob_name, target_pages), hedged=hedged
+            )
+        del analyze_document_result
+    else:
+        # Step 2: Convert Analyze Document to Structured Data
+        with usage_tracker.usage_stage("structuring"):
+            segments = general_utils.convert_analyze_document_to_structured_data(
+                result=analyze_document_result
+            )
+        # Segments keep no references into the AnalyzeResult, so it can be released now
+        del analyze_document_result
+        text = [segment.text for segment in segments]
+
+        # Build the retrieval index queried by the metadata and statement stages
+        with usage_tracker.usage_stage("indexing"):
+            index = retrieval_utils.build_document_index(
+                text, [segment.is_table for segment in segments], _index_cache_key(blob_name, target_pages)
+            )
 
         # Step 3: Extract Metadata
-        year_ended = openai_utils.extract_fiscal_year_end(text, openai_service)
-        company_name = openai_utils.extract_company_name(text, openai_service)
+        with usage_tracker.usage_stage("metadata"):
+            year_ended = openai_utils.extract_fiscal_year_end(text, openai_service, index=index, hedged=hedged)
+            company_name = openai_utils.extract_company_name(text, openai_service, index=index, hedged=hedged)
 
         # Step 4: Upload results to Azure Cognitive Search
-        cog_search_utils.process_and_upload_documents(
-            text=text,
-            text_sources=text_sources,
-            table_indicator=table_indicator,
-            blob_name=blob_name,
-            year_ended=year_ended,
-            company_name=company_name,
-            cog_search_controller=cog_search_controller
-        )
+        with usage_tracker.usage_stage("search_upload"):
+            cog_search_utils.process_and_upload_documents(
+                segments=segments,
+                blob_name=blob_name,
+                year_ended=year_ended,
+                company_name=company_name,
+                cog_search_controller=cog_search_controller
+            )
 
         # Step 5: Process Tables
-        dfs = [t for i, t in enumerate(text) if table_indicator[i]]
-        classifications = openai_utils.classify_multiple_tables(dfs=dfs)
+        dfs = [segment.text for segment in segments if segment.is_table]
+        with usage_tracker.usage_stage("classification"):
+            classifications = openai_utils.classify_multiple_tables(dfs=dfs, batched=True)
 
-        # Filter Tables by Classification
-        income_statement_dfs = [
-            df for df, classification in zip(dfs, classifications) if classification == "Income Statement"
-        ]
+    # Filter Tables by Classification
+    income_statement_dfs = [
+        df for df, classification in zip(dfs, classifications) if classification == "Income Statement"
+    ]
 
-        # Step 6: Extract Unit Scale
-        unit_scale = openai_utils.extract_unit_scale("\n\n".join(income_statement_dfs), openai_service)
+    # Step 6: Extract Unit Scale
+    with usage_tracker.usage_stage("unit_scale"):
+        unit_scale = openai_utils.extract_unit_scale(
+            prompt_utils.build_tables_prompt(income_statement_dfs, "unit_scale", year_ended), openai_service
+        )
 
-        # Step 7: Generate Income Statement
-        dataframes, amounts = generate_income_statement(
+    # Step 7: Generate Income Statement
+    generate = generate_income_statement_single_pass if single_pass else generate_income_statement
+    with usage_tracker.usage_stage("income_statement"):
+        dataframes, amounts = generate(
             income_statement_dfs=income_statement_dfs,
             unit_scale=unit_scale,
             year_ended=year_ended
         )
+    return year_ended, (dataframes, amounts)
+
+def _index_cache_key(blob_name: str, target_pages: bool) -> str:
+    """
+    Returns the cache name of a document's retrieval index, kept apart for page-targeted analyses.
+    """
+    return f"{blob_name}.targeted" if target_pages else blob_name
+
+
+def _extract_head_metadata(
+    head: List[str], openai_service: AzureOpenAIService, hedged: bool = False
+) -> Tuple[Optional[str], str]:
+    """
+    Extracts the fiscal year end and company name from the leading segments of a document.
+    """
+    with usage_tracker.usage_stage("metadata"):
+        year_ended = openai_utils.extract_fiscal_year_end(head, openai_service, retrieval_fallback=False, hedged=hedged)
+        company_name = openai_utils.extract_company_name(head, openai_service, hedged=hedged)
+    return year_ended, company_name
+
+
+def _classify_streamed_table(table: str) -> Optional[str]:
+    """
+    Classifies a table of a segment stream with the LLM, as a usage stage of its own.
+    """
+    with usage_tracker.usage_stage("classification"):
+        return openai_utils.classify_table(table)
+
+
+def process_segment_stream(
+    analyze_document_result: dict,
+    blob_name: str,
+    openai_service: AzureOpenAIService,
+    cog_search_controller: CogSearchController,
+    index_cache_key: Optional[str] = None,
+    hedged: bool = False
+) -> Tuple[Optional[str], str, List[str], List[Optional[str]], retrieval_utils.DocumentIndex]:
+    """
+    Structures a document as a stream of segments, uploading them to Azure Cognitive Search in batches
+    and classifying each table as soon as it is rendered. Tables the local pre-classifier is confident
+    about are labelled without an LLM call.
+
+    Metadata extraction starts once the leading context is available. Segments are buffered for upload
+    only until the metadata is known; the fiscal year retrieval fallback runs over the full text after
+    the stream ends if the leading context has no answer.
+
+    Streaming reduces latency, not memory: the AnalyzeResult is loaded whole, and the text of every
+    segment is kept to build the retrieval index once the stream ends, as in the batch mode.
+
+    Args:
+        analyze_document_result (dict): The result of the document intelligence "Analyze Document" operation.
+        blob_name (str): The name of the blob being processed.
+        openai_service (AzureOpenAIService): OpenAI service used for metadata extraction.
+        cog_search_controller (CogSearchController): An instance of the CogSearchController.
+        index_cache_key (Optional[str]): Cache name of the retrieval index built once the stream ends.
+        hedged (bool): Whether to hedge the metadata queries, see `process_documents`. Defaults to False.
+
+    Returns:
+        Tuple: The fiscal year end, company name, table texts, their classifications and the retrieval index.
+    """
+    uploader = cog_search_utils.SegmentStreamUploader(blob_name, cog_search_controller)
+    pre_classifier = load_default_pre_classifier()
+    text, is_table, table_texts, classification_futures, llm_indices = [], [], [], [], []
+    head_chars = 0
+    metadata_future = None
+
+    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as classification_executor, \
+            ThreadPoolExecutor(max_workers=1) as metadata_executor:
+        for segment in general_utils.iter_structured_segments(analyze_document_result):
+            text.append(segment.text)
+            is_table.append(segment.is_table)
+            uploader.add(segment)
+
+            # Classify tables as soon as they are rendered, locally when the pre-classifier is confident
+            if segment.is_table:
+                statement = pre_classifier.decide([segment.text])[0] if pre_classifier is not None else None
+                if statement is None:
+                    llm_indices.append(len(table_texts))
+                    future = usage_tracker.submit_in_context(
+                        classification_executor, _classify_streamed_table, segment.text
+                    )
+                else:
+                    future = Future()
+                    future.set_result(statement)
+                table_texts.append(segment.text)
+                classification_futures.append(future)
+
+            # Start metadata extraction once the leading context is complete
+            head_chars += len(segment.text)
+            if metadata_future is None and head_chars > METADATA_HEAD_CHARS:
+                metadata_future = usage_tracker.submit_in_context(
+                    metadata_executor, _extract_head_metadata, list(text), openai_service, hedged
+                )
+
+            # Release buffered segments for upload as soon as the metadata is known
+            if metadata_future is not None and metadata_future.done() and not uploader.has_metadata:
+                year_ended, company_name = metadata_future.result()
+                if year_ended is not None:
+                    uploader.set_metadata(company_name, year_ended)
+
+        if metadata_future is None:
+            metadata_future = usage_tracker.submit_in_context(
+                metadata_executor, _extract_head_metadata, list(text), openai_service, hedged
+            )
+        year_ended, company_name = metadata_future.result()
+
+        index = retrieval_utils.build_document_index(text, is_table, index_cache_key)
+        if year_ended is None:
+            year_ended = openai_utils.extract_fiscal_year_end_by_retrieval(text, openai_service, index=index)
 
-        # Step 8: Add Results to Dictionary
-        results[year_ended] = (dataframes, amounts)
+        if not uploader.has_metadata:
+            uploader.set_metadata(company_name, year_ended)
+        uploader.close()
 
-    # Step 9: Aggregate Income Statements
-    aggregated_table = openai_utils.aggregate_income_statements(results)
+        classifications = [future.result() for future in classification_futures]
 
-    df = general_utils.parse_table_from_response(aggregated_table)
+    log_classifications([table_texts[i] for i in llm_indices], [classifications[i] for i in llm_indices])
+    skipped = len(table_texts) - len(llm_indices)
+    print(f"Table pre-classifier decided {skipped} of {len(table_texts)} tables; skipped {skipped} LLM classification calls.")
 
-    # Step 10: Store Aggregated DataFrame in Azure Blob Storage
-    excel_blob_name = general_utils.store_dataframe_to_blob(df, blob_service)
-    return blob_service.get_blob_sas_url(excel_blob_name)
\ No newline at end of file
+    return year_ended, company_name, table_texts, classifications, index
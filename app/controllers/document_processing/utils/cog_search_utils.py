@@ -1,7 +1,9 @@
 import uuid
 import time
 import json
+from typing import List, Dict, Any
 from app.controllers.azure_controllers.cog_search_controller import CogSearchController
+from app.controllers.document_processing.utils.segment_utils import Segment
 
 def check_existing_blob(
         blob_name: str, 
@@ -33,10 +35,57 @@ def check_existing_blob(
         print(f"Error checking existing blob: {str(e)}")
         return False
     
+def serialize_bounding_regions(segment: Segment) -> str:
+    """
+    Serializes the bounding regions of a segment into the compact form stored in the index.
+
+    Args:
+        segment (Segment): The paragraph or table segment.
+
+    Returns:
+        str: The JSON-encoded list of per-page bounding boxes.
+    """
+    return json.dumps(segment.bounding_boxes(), separators=(",", ":"))
+
+def segment_to_index_document(
+    segment: Segment,
+    document_index: int,
+    blob_name: str,
+    document_group_id: str,
+    document_id: str,
+    company_name: str,
+    year_ended: str
+) -> Dict[str, Any]:
+    """
+    Builds the Azure Cognitive Search document for a segment.
+
+    Args:
+        segment (Segment): The paragraph or table segment.
+        document_index (int): The numeric ID of the search document.
+        blob_name (str): The name of the blob the segment belongs to.
+        document_group_id (str): The group ID shared by all segments of the upload.
+        document_id (str): The ID shared by all segments of the document.
+        company_name (str): The name of the company associated with the document.
+        year_ended (str): The fiscal year for the document.
+
+    Returns:
+        Dict[str, Any]: The search document.
+    """
+    return {
+        "id": str(document_index),
+        "text": segment.text,
+        "document_group_id": document_group_id,
+        "bounding_regions": serialize_bounding_regions(segment),
+        "blob_name": blob_name,
+        "is_table": str(int(segment.is_table)),
+        "document_id": document_id,
+        "company_name": company_name,
+        "fiscal_year": year_ended,
+        "quarter": ""
+    }
+
 def process_and_upload_documents(
-    text: list,
-    text_sources: list,
-    table_indicator: list,
+    segments: List[Segment],
     blob_name: str,
     company_name: str,
     year_ended: str,
@@ -47,9 +96,7 @@ def process_and_upload_documents(
     but skips the upload if the `blob_name` already exists in the index.
 
     Args:
-        text (list): List of textual content for each document section.
-        text_sources (list): List of bounding regions or sources for each text.
-        table_indicator (list): Boolean list indicating whether a section is a table.
+        segments (List[Segment]): Paragraph and table segments of the document, in document order.
         blob_name (str): The name of the blob the documents belong to.
         company_name (str): The name of the company associated with the documents.
         year_ended (str): The fiscal year for the documents.
@@ -72,25 +119,125 @@ def process_and_upload_documents(
         document_id = str(int(uuid.uuid4().hex[:8], 16) + int(time.time() * 1000))
 
         # Prepare documents for upload
-        documents_to_upload = []
-        for i, t in enumerate(text):
-            document = {
-                "id": str(int(max_id) + i + 1),
-                "text": t,
-                "document_group_id": document_group_id,
-                "bounding_regions": json.dumps(text_sources[i]),
-                "blob_name": blob_name,
-                "is_table": str(table_indicator[i]),
-                "document_id": document_id,
-                "company_name": company_name,
-                "fiscal_year": year_ended,
-                "quarter": ""
-            }
-            documents_to_upload.append(document)
+        documents_to_upload = [
+            segment_to_index_document(
+                segment, int(max_id) + i + 1, blob_name, document_group_id, document_id, company_name, year_ended
+            )
+            for i, segment in enumerate(segments)
+        ]
 
         # Upload documents to Azure Cognitive Search
         cog_search_controller.add_documents({"documents": documents_to_upload})
         print(f"Documents successfully uploaded for blob '{blob_name}'.")
 
     except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
+
+class SegmentStreamUploader:
+    """
+    Uploads segments to Azure Cognitive Search in batches while they are still being produced.
+
+    Segments are buffered until the document metadata (company name and fiscal year) is known,
+    after which every full batch is uploaded immediately. As in `process_and_upload_documents`,
+    upload errors are printed rather than raised, so they do not abort the processing of the
+    filing; the remaining segments of the blob are then skipped.
+    """
+
+    def __init__(
+        self,
+        blob_name: str,
+        cog_search_controller: CogSearchController,
+        batch_size: int = 500
+    ) -> None:
+        """
+        Initializes the uploader and reserves document IDs for the blob.
+
+        Args:
+            blob_name (str): The name of the blob the segments belong to.
+            cog_search_controller (CogSearchController): An instance of the CogSearchController.
+            batch_size (int): Number of segments per upload request. Defaults to 500.
+        """
+        self.blob_name = blob_name
+        self.cog_search_controller = cog_search_controller
+        self.batch_size = batch_size
+        self.company_name = None
+        self.year_ended = None
+        self.buffer: List[Segment] = []
+        self.uploaded = 0
+
+        # Skip the upload entirely if the blob already exists in the index
+        self.skip = check_existing_blob(blob_name, cog_search_controller)
+        if self.skip:
+            print(f"Blob '{blob_name}' already exists in the index. No action taken.")
+            return
+
+        try:
+            self.max_id = int(cog_search_controller.get_max_id())
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            self.skip = True
+            return
+        self.document_group_id = str(int(uuid.uuid4().hex[:8], 16) + int(time.time() * 1000))
+        self.document_id = str(int(uuid.uuid4().hex[:8], 16) + int(time.time() * 1000))
+
+    @property
+    def has_metadata(self) -> bool:
+        """Whether the document metadata has been set."""
+        return self.company_name is not None
+
+    def set_metadata(self, company_name: str, year_ended: str) -> None:
+        """
+        Sets the document metadata and uploads any full batches buffered so far.
+
+        Args:
+            company_name (str): The name of the company associated with the documents.
+            year_ended (str): The fiscal year for the documents.
+        """
+        self.company_name = company_name or ""
+        self.year_ended = year_ended
+        self._flush(full_batches_only=True)
+
+    def add(self, segment: Segment) -> None:
+        """
+        Adds a segment, uploading a batch once enough segments are buffered and metadata is known.
+
+        Args:
+            segment (Segment): The next segment of the document, in document order.
+        """
+        if self.skip:
+            return
+        self.buffer.append(segment)
+        if self.has_metadata:
+            self._flush(full_batches_only=True)
+
+    def close(self) -> None:
+        """
+        Uploads all remaining buffered segments. Metadata must have been set.
+        """
+        if self.skip:
+            return
+        if not self.has_metadata:
+            raise ValueError("Metadata must be set before closing the uploader.")
+        self._flush(full_batches_only=False)
+        if not self.skip:
+            print(f"Documents successfully uploaded for blob '{self.blob_name}'.")
+
+    def _flush(self, full_batches_only: bool) -> None:
+        while self.buffer and (len(self.buffer) >= self.batch_size or not full_batches_only):
+            batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+            documents_to_upload = [
+                segment_to_index_document(
+                    segment, self.max_id + self.uploaded + i + 1, self.blob_name, self.document_group_id,
+                    self.document_id, self.company_name, self.year_ended
+                )
+                for i, segment in enumerate(batch)
+            ]
+            try:
+                self.cog_search_controller.add_documents({"documents": documents_to_upload})
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                # Stop uploading the blob rather than leave gaps in its document IDs
+                self.skip = True
+                self.buffer = []
+                return
+            self.uploaded += len(batch)
@@ -0,0 +1,126 @@
+import re
+import zlib
+from typing import Any, Dict, List, Set, Tuple
+
+import numpy as np
+
+from app.controllers.document_processing.utils.markdown_utils import compact_markdown_whitespace
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+# Words per shingle compared between search results
+SHINGLE_WORDS = 5
+# Hash functions of a MinHash signature; the Jaccard estimate error is about 1 / sqrt(MINHASH_PERMUTATIONS)
+MINHASH_PERMUTATIONS = 64
+# Estimated Jaccard similarity of shingles from which a result is a near-duplicate of a packed one
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+CONTEXT_SEPARATOR = "\n\n"
+
+# Universal hashing (a * x + b) mod p of 32-bit shingle hashes; a < 2^31 keeps a * x within 64 bits
+_HASH_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(0)
+_HASH_A = _rng.integers(1, 1 << 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 1 << 32, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[str]:
+    """
+    Splits a text into its overlapping word shingles.
+
+    :param text: The text.
+    :param size: Words per shingle.
+    :return: The lowercase shingles; a text shorter than one shingle is a single shingle.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """
+    Computes the MinHash signature of a text's shingles.
+
+    :param text: The text.
+    :return: The minimum of each hash function over the shingles.
+    """
+    hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles(text)], dtype=np.uint64)
+    return ((_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) % _HASH_PRIME).min(axis=1)
+
+
+def estimate_similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """
+    Estimates the Jaccard similarity of two texts' shingles from their MinHash signatures.
+
+    :param signature: The first signature.
+    :param other: The second signature.
+    :return: The fraction of hash functions with the same minimum.
+    """
+    return float(np.mean(signature == other))
+
+
+def result_score(result: Dict[str, Any]) -> float:
+    """
+    Returns the relevance of a search result: its semantic reranker score, or its search score.
+
+    :param result: The search result.
+    :return: The score, 0 if the result has none.
+    """
+    score = result.get("@search.reranker_score")
+    if score is None:
+        score = result.get("@search.score")
+    return float(score) if score is not None else 0.0
+
+
+def pack_context(
+    results: List[Dict[str, Any]],
+    token_budget: int,
+    model: str = "gpt-4o",
+    threshold: float = NEAR_DUPLICATE_THRESHOLD
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Packs the texts of search results into a prompt context of at most `token_budget` tokens.
+
+    Results are taken from the most to the least relevant, with table and text whitespace compacted.
+    Results that are near-duplicates of a packed result are dropped, and results that no longer fit
+    the budget are skipped in favour of smaller, less relevant ones.
+
+    :param results: The search results, with their text under 'text'.
+    :param token_budget: Maximum tokens of the context.
+    :param model: The model the tokens are counted for.
+    :param threshold: Estimated shingle similarity from which a result is a near-duplicate.
+    :return: The context and a report with the number of results, duplicates dropped, results packed,
+        results skipped for the budget, tokens packed and the budget.
+    """
+    ordered = sorted((result for result in results if result.get("text")), key=result_score, reverse=True)
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR, model)
+
+    texts, signatures = [], []
+    duplicates, skipped, tokens = 0, 0, 0
+    for result in ordered:
+        text = compact_markdown_whitespace(result["text"])
+        signature = minhash_signature(text)
+        if any(estimate_similarity(signature, packed) >= threshold for packed in signatures):
+            duplicates += 1
+            continue
+
+        text_tokens = count_tokens(text, model) + (separator_tokens if texts else 0)
+        if tokens + text_tokens > token_budget:
+            skipped += 1
+            continue
+        texts.append(text)
+        signatures.append(signature)
+        tokens += text_tokens
+
+    # Tokens are counted per text while packing, which may overestimate the joined context slightly
+    context = CONTEXT_SEPARATOR.join(texts)
+    report = {
+        "results": len(results),
+        "duplicates": duplicates,
+        "packed": len(texts),
+        "skipped": skipped,
+        "tokens": count_tokens(context, model) if texts else 0,
+        "budget": token_budget
+    }
+    return context, report
@@ -1,11 +1,15 @@
 import pandas as pd 
-from typing import List, Tuple
+import numpy as np
+from typing import Any, Dict, List, Tuple
 import logging
 import os
 import pickle
 
 from app.services.azure_services import AzureBlobStorageService
 from app.services.azure_services.doc_intel_service import AzureDocIntelService
+from app.controllers.document_processing.utils.page_selection_utils import (
+    is_page_selection_available, plan_page_selection
+)
 
 def process_blob_document(blob_name: str, cache_dir: str = "./cache/") -> dict:
     """
@@ -56,9 +60,102 @@ def process_blob_document(blob_name: str, cache_dir: str = "./cache/") -> dict:
 
     return analyze_document_result
 
-def analyze_result_dict_to_df(table: dict)  -> Tuple[pd.DataFrame, List[List[dict]]]:
+def process_blob_document_targeted(blob_name: str, cache_dir: str = "./cache/") -> Tuple[dict, Dict[str, Any]]:
+    """
+    Processes a document from Azure Blob Storage, analyzing only the pages likely to hold the
+    financial statements.
+
+    The PDF text layer is scored locally (see `page_selection_utils`) and DocIntel is asked for the
+    selected page ranges only. The document is analyzed in full, with a warning, when pypdf is not
+    installed, the text layer cannot be read, no statement page is found, or the targeted result
+    contains no tables. Results and page reports are cached in a .pkl file separate from the
+    full-analysis cache; full analyses made because pypdf is missing are not cached there.
+
+    Args:
+        blob_name (str): The name of the blob in Azure Blob Storage.
+        cache_dir (str): Directory to store the cache files.
+
+    Returns:
+        Tuple[dict, Dict[str, Any]]: The result of the document analysis and the page report, with
+        the total and analyzed page counts, the analyzed page ranges, the page reduction (share of
+        pages not analyzed), whether the full analysis fallback was used and why.
+    """
+    cache_file = os.path.join(cache_dir, f"{blob_name}.targeted.pkl")
+    if os.path.exists(cache_file):
+        logging.info(f"Cache file found: {cache_file}. Loading result from cache.")
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+
+    blob_service = AzureBlobStorageService()
+    doc_intel_service = AzureDocIntelService()
+
+    try:
+        file_content = blob_service.get_blob_content(blob_name)
+    except Exception as e:
+        logging.error(f"Error retrieving blob content for '{blob_name}': {e}")
+        raise RuntimeError(f"Failed to retrieve blob content for '{blob_name}'") from e
+
+    available = is_page_selection_available()
+    plan = plan_page_selection(file_content)
+    page_ranges = plan["page_ranges"]
+    if not available:
+        fallback_reason = "pypdf is not installed"
+    elif plan["total_pages"] is None:
+        fallback_reason = "the PDF text layer could not be read"
+    elif page_ranges is None:
+        fallback_reason = "no statement page was found"
+    else:
+        fallback_reason = None
+
+    try:
+        analyze_document_result = None
+        if page_ranges is not None:
+            analyze_document_result = doc_intel_service.analyze_document_from_binary(file_content, pages=page_ranges)
+            if not analyze_document_result.get("tables"):
+                fallback_reason = f"no tables were found on pages {page_ranges}"
+                analyze_document_result, page_ranges = None, None
+        if fallback_reason is not None:
+            logging.warning(f"Page-targeted analysis of '{blob_name}' fell back to all pages: {fallback_reason}.")
+        if analyze_document_result is None:
+            analyze_document_result = doc_intel_service.analyze_document_from_binary(file_content)
+    except Exception as e:
+        logging.error(f"Error processing document '{blob_name}': {e}")
+        raise RuntimeError(f"Failed to process document '{blob_name}'") from e
+
+    total_pages = plan["total_pages"] or len(analyze_document_result.get("pages") or [])
+    analyzed_pages = len(plan["pages"]) if page_ranges is not None else total_pages
+    report = {
+        "blob_name": blob_name,
+        "total_pages": total_pages,
+        "analyzed_pages": analyzed_pages,
+        "page_ranges": page_ranges,
+        "page_reduction": 1 - analyzed_pages / total_pages if total_pages else 0.0,
+        "fallback": page_ranges is None,
+        "fallback_reason": fallback_reason
+    }
+    logging.info(
+        f"Analyzed {analyzed_pages} of {total_pages} pages of '{blob_name}' "
+        f"({report['page_reduction']:.0%} reduction, fallback={report['fallback']})."
+    )
+
+    # Do not pin a full analysis to the targeted cache when targeting could not run at all
+    if not available:
+        return analyze_document_result, report
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file, 'wb') as f:
+        pickle.dump((analyze_document_result, report), f)
+    logging.info(f"Result cached to: {cache_file}")
+
+    return analyze_document_result, report
+
+def analyze_result_dict_to_df(table: dict)  -> Tuple[pd.DataFrame, np.ndarray]:
     """
     Converts tables from the begin_analyze_document result into a cleaned pandas DataFrame.
+
+    The grid is built as a NumPy object array in a single pass over the cells. Cells spanning
+    several rows or columns (rowSpan/columnSpan) fill every grid position they cover, while the
+    bounding region is only recorded on the cell's anchor position.
     
     Parameters
     ----------
@@ -69,56 +166,52 @@ def analyze_result_dict_to_df(table: dict)  -> Tuple[pd.DataFrame, List[List[dic
     -------
     pd.DataFrame
         A cleaned DataFrame representation of the DocumentTable.
-    list
-        A 2D list containing metadata (bounding regions) for each cell.
+    np.ndarray
+        An object array parallel to the DataFrame (same rows and columns) holding the bounding
+        region of each cell, or None for cells without one; an empty (0, 0) array for an empty table.
     """
     
     # Extract row and column counts
     row_count = table.get('rowCount', 0)
     column_count = table.get('columnCount', 0)
     
-    # Return an empty DataFrame if table has no rows or columns
+    # Return an empty DataFrame, with an empty source grid of the same type, if table has no rows or columns
     if row_count == 0 or column_count == 0:
-        return pd.DataFrame(), []
+        return pd.DataFrame(), np.empty((0, 0), dtype=object)
 
-    # Initialize DataFrame and source list for metadata
-    df: pd.DataFrame = pd.DataFrame(
-        data=[[''] * column_count for _ in range(row_count)],
-        columns=[''] * column_count
-    )
-    sources = [
-        [[] for _ in range(column_count)] 
-        for _ in range(row_count)
-    ]
+    # Initialize the cell grid and the parallel source grid
+    grid = np.full((row_count, column_count), '', dtype=object)
+    sources = np.full((row_count, column_count), None, dtype=object)
 
     column_headers = [None] * column_count
 
-    # Populate DataFrame and source list with cell data
+    # Populate grid and source grid with cell data
     for cell in table.get("cells", []):
         row_idx = cell.get("rowIndex", -1)
         col_idx = cell.get("columnIndex", -1)
         if row_idx == -1 or col_idx == -1:
             continue
+        row_end = row_idx + cell.get("rowSpan", 1)
+        col_end = col_idx + cell.get("columnSpan", 1)
         
         # Set column headers if the cell is of kind 'columnHeader'
         if cell.get("kind", "") == 'columnHeader':
-            column_headers[col_idx] = cell["content"].strip()
+            for header_idx in range(col_idx, min(col_end, column_count)):
+                column_headers[header_idx] = cell["content"].strip()
         elif cell.get("content", ""):
-            df.iat[row_idx, col_idx] = cell["content"].strip()
+            grid[row_idx:row_end, col_idx:col_end] = cell["content"].strip()
             # Add bounding region metadata if available
-            sources[row_idx][col_idx] = cell.get("boundingRegions", [{}])[0]
+            sources[row_idx, col_idx] = cell.get("boundingRegions", [{}])[0]
+
+    # Filter out empty rows with a vectorized mask
+    non_empty_rows = (grid != '').any(axis=1)
+    if not non_empty_rows.any():
+        return pd.DataFrame(), np.empty((0, 0), dtype=object)  # Return empty if no non-empty rows exist
+
+    df = pd.DataFrame(data=grid[non_empty_rows], columns=[''] * column_count)
 
     # Set column headers if available
     if any(column_headers):
         df.columns = column_headers
 
-    # Filter out empty rows and update source list
-    non_empty_rows = [i for i, row in df.iterrows() if any(row)]
-    if non_empty_rows:
-        df = df.iloc[non_empty_rows].reset_index(drop=True)
-        sources = [sources[i] for i in non_empty_rows]
-    else:
-        return pd.DataFrame(), []  # Return empty if no non-empty rows exist
-
-    return df, sources
-
+    return df, sources[non_empty_rows]
@@ -1,17 +1,26 @@
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Iterator
 from collections import defaultdict
+from bisect import bisect_right
+from functools import partial
 import pandas as pd
+import numpy as np
 from io import BytesIO
-import re
 
 from app.controllers.document_processing.utils.doc_intel_utils import analyze_result_dict_to_df
+from app.controllers.document_processing.utils.segment_utils import Segment, bounds_to_bounding_boxes
+from app.controllers.document_processing.utils.markdown_utils import (
+    render_markdown_table,
+    parse_markdown_table,
+    to_numeric
+)
 from app.services.azure_services.blob_storage_service import AzureBlobStorageService
 
 def extract_table_details(
     table: Dict[str, Any],
     paragraphs: List[Dict[str, Any]],
     dfs: List[Any],
-    dfs_sources: List[Any]
+    dfs_sources: List[Any],
+    paragraph_ends: Optional[List[int]] = None
 ) -> Dict[str, Any]:
     """
     Extracts table details, including its content, associated context, and bounding polygons.
@@ -20,7 +29,9 @@ def extract_table_details(
     :param paragraphs: List of all paragraphs in the document.
     :param dfs: List to store extracted dataframes.
     :param dfs_sources: List to store bounding source polygons for tables.
-    :return: A dictionary containing table details for merging with the final output.
+    :param paragraph_ends: Optional precomputed paragraph end offsets (see `paragraph_end_offsets`).
+    :return: A dictionary containing table details for merging with the final output. The table
+        text is returned as a `render_text` callable so it is only formatted when first needed.
     """
     df, source = analyze_result_dict_to_df(table)
     dfs.append(df)
@@ -33,48 +44,83 @@ def extract_table_details(
     table_start = table["spans"][0]["offset"] if "spans" in table else None
 
     # Extract context paragraphs
-    context_content, context_polygons, context_indices = extract_context_for_table(paragraphs, table_start)
-
-    # Combine context, table content, and footnotes into a single string
-    context_string = "\n".join(context_content)
-    combined_string = f"Context:\n{context_string}\n\nTable:\n{df.to_markdown(index=False)}"
-    if footnotes_text:
-        combined_string += f"\n\nFootnotes:\n{footnotes_text}"
+    context_content, context_polygons, context_indices = extract_context_for_table(
+        paragraphs, table_start, paragraph_ends
+    )
 
     # Collect all polygons (context, sources, and footnotes)
     all_polygons = collect_table_polygons(context_polygons, source, footnotes)
 
-    # Generate bounding boxes for each page
-    page_bounding_boxes = create_page_bounding_boxes(all_polygons)
-
     return {
         "offset": table_start,
-        "combined_string": combined_string,
-        "source_boxes": page_bounding_boxes,
+        "render_text": partial(render_table_text, df, context_content, footnotes_text),
+        "page_bounds": page_bounds(all_polygons),
         "context_indices": context_indices,
         "table_index": table_index
     }
 
 
+def render_table_text(df: pd.DataFrame, context_content: List[str], footnotes_text: str) -> str:
+    """
+    Combines a table's context, markdown content, and footnotes into a single string.
+
+    :param df: The table as a DataFrame.
+    :param context_content: Context paragraphs preceding the table.
+    :param footnotes_text: Footnote text of the table, or an empty string.
+    :return: The combined table text.
+    """
+    context_string = "\n".join(context_content)
+    combined_string = f"Context:\n{context_string}\n\nTable:\n{render_markdown_table(df)}"
+    if footnotes_text:
+        combined_string += f"\n\nFootnotes:\n{footnotes_text}"
+    return combined_string
+
+
+def paragraph_end_offsets(paragraphs: List[Dict[str, Any]]) -> Optional[List[int]]:
+    """
+    Computes the end offset of every paragraph so tables can locate their context with a binary search.
+
+    DocIntel returns paragraphs in reading order, so the end offsets are normally non-decreasing.
+    If they are not, None is returned and callers fall back to a linear scan.
+
+    :param paragraphs: List of all paragraphs in the document.
+    :return: List of paragraph end offsets in paragraph order, or None if they are not sorted.
+    """
+    ends = [p["spans"][0]["offset"] + p["spans"][0]["length"] for p in paragraphs]
+    if any(ends[i] > ends[i + 1] for i in range(len(ends) - 1)):
+        return None
+    return ends
+
+
 def extract_context_for_table(
     paragraphs: List[Dict[str, Any]],
-    table_start: Optional[int]
+    table_start: Optional[int],
+    paragraph_ends: Optional[List[int]] = None
 ) -> Tuple[List[str], Dict[int, List[List[float]]], List[int]]:
     """
     Extracts up to three paragraphs before a table to serve as its context.
 
     :param paragraphs: List of all paragraphs in the document.
     :param table_start: The starting offset of the table.
+    :param paragraph_ends: Optional precomputed paragraph end offsets. Pass the output of
+        `paragraph_end_offsets` when extracting context for many tables of the same document.
     :return: A tuple containing context content, bounding polygons, and paragraph indices.
     """
     if table_start is None:
         return [], defaultdict(list), []
 
+    if paragraph_ends is None:
+        paragraph_ends = paragraph_end_offsets(paragraphs)
+
     # Find the last three paragraphs before the table
-    previous_paragraphs = [
-        (idx, p) for idx, p in enumerate(paragraphs)
-        if p["spans"][0]["offset"] + p["spans"][0]["length"] <= table_start
-    ][-3:]
+    if paragraph_ends is not None:
+        end_idx = bisect_right(paragraph_ends, table_start)
+        previous_paragraphs = [(idx, paragraphs[idx]) for idx in range(max(0, end_idx - 3), end_idx)]
+    else:
+        previous_paragraphs = [
+            (idx, p) for idx, p in enumerate(paragraphs)
+            if p["spans"][0]["offset"] + p["spans"][0]["length"] <= table_start
+        ][-3:]
 
     # Identify the closest section heading or title
     closest_heading_idx = next(
@@ -98,58 +144,131 @@ def extract_context_for_table(
     return context_content, context_polygons, context_indices
 
 
+def polygons_to_bounds(polygons: List[List[float]]) -> np.ndarray:
+    """
+    Reduces flat [x1, y1, x2, y2, ...] polygons to their axis-aligned bounds.
+
+    :param polygons: List of flat polygon coordinate lists.
+    :return: Contiguous float32 array of shape (n, 4) holding [min_x, min_y, max_x, max_y] per polygon.
+    """
+    if not polygons:
+        return np.empty((0, 4), dtype=np.float32)
+
+    # DocIntel polygons are almost always quadrilaterals, so reduce them in one shot
+    if len({len(polygon) for polygon in polygons}) == 1:
+        points = np.asarray(polygons, dtype=np.float32).reshape(len(polygons), -1, 2)
+        return np.ascontiguousarray(np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1))
+
+    bounds = np.empty((len(polygons), 4), dtype=np.float32)
+    for i, polygon in enumerate(polygons):
+        points = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+        bounds[i, :2] = points.min(axis=0)
+        bounds[i, 2:] = points.max(axis=0)
+    return bounds
+
+
 def collect_table_polygons(
     context_polygons: Dict[int, List[List[float]]],
-    source: List[Dict[str, Any]],
+    source: Any,
     footnotes: List[Dict[str, Any]]
-) -> Dict[int, List[List[float]]]:
+) -> Dict[int, np.ndarray]:
     """
     Collects all bounding polygons associated with a table, including context and footnotes.
 
     :param context_polygons: Polygons from context paragraphs.
-    :param source: Polygons from the table's sources.
+    :param source: Cell bounding regions of the table, row by row.
     :param footnotes: Polygons from the table's footnotes.
-    :return: Dictionary of all polygons grouped by page.
+    :return: Dictionary of polygon bounds (see `polygons_to_bounds`) grouped by page.
     """
-    all_polygons = defaultdict(list)
+    polygons_by_page = defaultdict(list)
 
     # Add context polygons
     for page, polygons in context_polygons.items():
-        all_polygons[page].extend(polygons)
+        polygons_by_page[page].extend(polygons)
 
     # Add source polygons
     for source_item in source:
         for region in source_item:
             if isinstance(region, dict) and "polygon" in region:
-                all_polygons[region["pageNumber"]].append(region["polygon"])
+                polygons_by_page[region["pageNumber"]].append(region["polygon"])
 
     # Add footnote polygons
     if footnotes:
         for region in footnotes[0]["boundingRegions"]:
-            all_polygons[region["pageNumber"]].append(region["polygon"])
+            polygons_by_page[region["pageNumber"]].append(region["polygon"])
 
-    return all_polygons
+    return {page: polygons_to_bounds(polygons) for page, polygons in polygons_by_page.items()}
 
 
-def create_page_bounding_boxes(all_polygons: Dict[int, List[List[float]]]) -> List[Dict[str, Any]]:
+def page_bounds(all_polygons: Dict[int, Any]) -> np.ndarray:
+    """
+    Reduces polygons grouped by page to one bounding rectangle per page.
+
+    :param all_polygons: Dictionary of polygon bounds arrays (as returned by `collect_table_polygons`)
+        or lists of raw polygons, grouped by page.
+    :return: Float32 array of shape (pages, 5) with rows [page, min_x, min_y, max_x, max_y].
+    """
+    rows = []
+    for page, polygons in all_polygons.items():
+        bounds = polygons if isinstance(polygons, np.ndarray) else polygons_to_bounds(polygons)
+        if not len(bounds):
+            continue
+        rows.append(np.concatenate([[page], bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0)]))
+
+    if not rows:
+        return np.empty((0, 5), dtype=np.float32)
+    return np.asarray(rows, dtype=np.float32)
+
+
+def create_page_bounding_boxes(all_polygons: Dict[int, Any]) -> List[Dict[str, Any]]:
     """
     Creates bounding boxes for each page from a collection of polygons.
 
-    :param all_polygons: Dictionary of polygons grouped by page.
+    :param all_polygons: Dictionary of polygon bounds arrays (as returned by `collect_table_polygons`)
+        or lists of raw polygons, grouped by page.
     :return: List of bounding box dictionaries for each page.
     """
-    page_bounding_boxes = []
-    for page, polygons in all_polygons.items():
-        min_x = min(point[0] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
-        min_y = min(point[1] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
-        max_x = max(point[0] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
-        max_y = max(point[1] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
+    return bounds_to_bounding_boxes(page_bounds(all_polygons))
+
+
+def paragraph_page_bounds(paragraph: Dict[str, Any]) -> np.ndarray:
+    """
+    Creates compact per-page bounds for a single paragraph.
+
+    :param paragraph: Dictionary representing a paragraph from the document.
+    :return: Float32 array of shape (pages, 5) with rows [page, min_x, min_y, max_x, max_y].
+    """
+    polygons_by_page = defaultdict(list)
+    for region in paragraph.get("boundingRegions", []):
+        polygons_by_page[region["pageNumber"]].append(region["polygon"])
+    return page_bounds(polygons_by_page)
+
+
+def paragraph_page_bounding_boxes(paragraph: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Creates per-page bounding boxes for a single paragraph.
+
+    :param paragraph: Dictionary representing a paragraph from the document.
+    :return: List of bounding box dictionaries for each page the paragraph touches.
+    """
+    return bounds_to_bounding_boxes(paragraph_page_bounds(paragraph))
+
+
+def merge_table_spans(table_spans: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    """
+    Sorts table spans and merges overlapping ones into disjoint intervals.
 
-        page_bounding_boxes.append({
-            "pageNumber": page,
-            "boundingBox": [min_x, min_y, max_x, min_y, max_x, max_y, min_x, max_y]
-        })
-    return page_bounding_boxes
+    :param table_spans: List of spans corresponding to tables.
+    :return: Two parallel lists with the start and end offsets of the merged intervals.
+    """
+    starts, ends = [], []
+    for start, end in sorted((s["offset"], s["offset"] + s["length"]) for s in table_spans):
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
 
 
 def filter_paragraphs_without_overlap(
@@ -159,137 +278,178 @@ def filter_paragraphs_without_overlap(
     """
     Filters paragraphs that do not overlap with any table spans.
 
+    Table spans are merged into sorted, disjoint intervals once, so each paragraph only needs a
+    binary search against the interval starting closest before its end.
+
     :param paragraphs: List of all paragraphs in the document.
     :param table_spans: List of spans corresponding to tables.
     :return: List of non-overlapping paragraphs with their starting offsets.
     """
+    span_starts, span_ends = merge_table_spans(table_spans)
+
     non_overlapping_paragraphs = []
-    for i, paragraph in enumerate(paragraphs):
+    for paragraph in paragraphs:
         paragraph_span = paragraph.get("spans", [{}])[0]
         paragraph_start = paragraph_span.get("offset")
         paragraph_end = paragraph_start + paragraph_span.get("length", 0)
 
-        if not any(
-            t_span["offset"] <= paragraph_end and paragraph_start <= t_span["offset"] + t_span["length"]
-            for t_span in table_spans
-        ):
+        if not overlaps_merged_spans(span_starts, span_ends, paragraph_start, paragraph_end):
             non_overlapping_paragraphs.append((paragraph_start, paragraph))
 
     return non_overlapping_paragraphs
 
 
-def convert_analyze_document_to_structured_data(
-    result: Dict[str, Any]
-) -> Tuple[List[str], List[Any], List[int], List[List[Any]]]:
+def overlaps_merged_spans(span_starts: List[int], span_ends: List[int], start: int, end: int) -> bool:
+    """
+    Checks whether the closed interval [start, end] overlaps any merged table span.
+
+    :param span_starts: Start offsets of the merged spans (see `merge_table_spans`).
+    :param span_ends: End offsets of the merged spans.
+    :param start: Start offset of the interval to check.
+    :param end: End offset of the interval to check.
+    :return: True if the interval overlaps a span.
+    """
+    # Last merged interval that starts at or before the end of the checked interval
+    span_idx = bisect_right(span_starts, end) - 1
+    return span_idx >= 0 and span_ends[span_idx] >= start
+
+
+def convert_analyze_document_to_structured_data(result: Dict[str, Any]) -> List[Segment]:
     """
     Converts the output of an "Analyze Document" operation into structured paragraphs and tables.
 
     :param result: The result of the document intelligence "Analyze Document" operation.
-    :return: A tuple containing final items (text), sources, table indicators, and related sources.
+    :return: List of paragraph and table segments in document order.
     """
     dfs, dfs_sources = [], []
     tables_info = []
+    paragraphs = result.get("paragraphs", [])
+
+    # Precompute paragraph end offsets once for all tables
+    paragraph_ends = paragraph_end_offsets(paragraphs)
 
     # Extract table details
     for table in result.get("tables", []):
-        tables_info.append(extract_table_details(table, result.get("paragraphs", []), dfs, dfs_sources))
+        tables_info.append(extract_table_details(table, paragraphs, dfs, dfs_sources, paragraph_ends))
 
     # Filter paragraphs that do not overlap with tables
     non_overlapping_paragraphs = filter_paragraphs_without_overlap(
-        result.get("paragraphs", []), [t["spans"][0] for t in result.get("tables", [])]
+        paragraphs, [t["spans"][0] for t in result.get("tables", [])]
     )
     paragraphs_by_offset = {p_off: p_val for p_off, p_val in non_overlapping_paragraphs}
 
     # Build final output
-    return build_final_output(paragraphs_by_offset, tables_info, dfs_sources)
+    return build_final_output(paragraphs_by_offset, tables_info)
 
 
-def build_final_output(
-    paragraphs_by_offset: Dict[int, Dict[str, Any]],
-    tables_info: List[Dict[str, Any]],
-    dfs_sources: List[Any]
-) -> Tuple[List[str], List[Any], List[int], List[List[Any]]]:
+def iter_structured_segments(result: Dict[str, Any]) -> Iterator[Segment]:
     """
-    Builds the final structured output containing paragraphs and tables.
+    Lazily converts the output of an "Analyze Document" operation into segments.
 
-    :param paragraphs_by_offset: Dictionary of non-overlapping paragraphs by offset.
-    :param tables_info: List of extracted table details.
-    :param dfs_sources: List of sources for tables.
-    :return: A tuple containing final items, sources, table indicators, and related sources.
-    """
-    final_items = []
-    final_sources = []
-    table_indicator = []
-    table_related_sources = []
-
-    all_offsets = [(off, "paragraph", p) for off, p in paragraphs_by_offset.items()]
-    for tinfo in tables_info:
-        all_offsets.append((tinfo["offset"], "table", tinfo["combined_string"], tinfo["source_boxes"], tinfo["table_index"]))
-
-    all_offsets.sort(key=lambda x: x[0])
-
-    for item in all_offsets:
-        if item[1] == "paragraph":
-            paragraph_dict = item[2]
-            final_items.append(paragraph_dict["content"])
-            final_sources.append(paragraph_dict)
-            table_indicator.append(0)
-            table_related_sources.append([])
-        else:
-            combined_string = item[2]
-            source_boxes = item[3]
-            table_idx = item[4]
+    Yields the same segments as `convert_analyze_document_to_structured_data`, in document order,
+    with a single merge sweep over paragraphs and tables. Tables are only rendered when the sweep
+    reaches them, so consumers can index and classify early segments while later ones are built.
+    If the paragraphs are not in offset order, the document is structured up front instead.
 
-            final_items.append(combined_string)
-            final_sources.append(source_boxes)
-            table_indicator.append(1)
-            table_related_sources.append(dfs_sources[table_idx])
+    :param result: The result of the document intelligence "Analyze Document" operation.
+    :return: Iterator over paragraph and table segments in document order.
+    """
+    paragraphs = result.get("paragraphs", [])
+    tables = result.get("tables", [])
 
-    return final_items, final_sources, table_indicator, table_related_sources
+    paragraph_ends = paragraph_end_offsets(paragraphs)
+    paragraph_starts = [p.get("spans", [{}])[0].get("offset") for p in paragraphs]
+    if paragraph_ends is None or any(a > b for a, b in zip(paragraph_starts, paragraph_starts[1:])):
+        yield from convert_analyze_document_to_structured_data(result)
+        return
 
-import pandas as pd
-import re
+    span_starts, span_ends = merge_table_spans([t["spans"][0] for t in tables])
+    ordered_tables = sorted(tables, key=lambda t: t["spans"][0]["offset"])
+    table_idx = 0
 
-def parse_table_from_response(response: str) -> pd.DataFrame:
+    def next_table_segment() -> Segment:
+        # Fresh lists so rendered tables are not retained by the generator
+        return table_to_segment(extract_table_details(ordered_tables[table_idx], paragraphs, [], [], paragraph_ends))
+
+    def overlaps_table(i: int) -> bool:
+        return overlaps_merged_spans(span_starts, span_ends, paragraph_starts[i], paragraph_ends[i])
+
+    for i, paragraph in enumerate(paragraphs):
+        paragraph_start = paragraph_starts[i]
+
+        # As in the batch conversion, paragraphs overlapping a table are dropped first, and the
+        # remaining paragraphs sharing an offset then collapse to the last one
+        if overlaps_table(i):
+            continue
+        following = i + 1
+        while following < len(paragraphs) and paragraph_starts[following] == paragraph_start and overlaps_table(following):
+            following += 1
+        if following < len(paragraphs) and paragraph_starts[following] == paragraph_start:
+            continue
+
+        while table_idx < len(ordered_tables) and ordered_tables[table_idx]["spans"][0]["offset"] < paragraph_start:
+            yield next_table_segment()
+            table_idx += 1
+
+        yield paragraph_to_segment(paragraph_start, paragraph)
+
+    while table_idx < len(ordered_tables):
+        yield next_table_segment()
+        table_idx += 1
+
+
+def paragraph_to_segment(offset: int, paragraph: Dict[str, Any]) -> Segment:
     """
-    Dynamically parses a table from a text response containing a markdown table 
-    and converts it into a pandas DataFrame.
+    Builds a segment from a DocIntel paragraph, keeping only its content and page bounds.
+
+    :param offset: The starting offset of the paragraph.
+    :param paragraph: Dictionary representing a paragraph from the document.
+    :return: The paragraph segment.
     """
-    # Extract lines that look like table rows (start and end with '|')
+    regions = paragraph_page_bounds(paragraph)
+    page = int(regions[0, 0]) if len(regions) else 0
+    return Segment(offset, page, Segment.PARAGRAPH, paragraph["content"], regions)
 
-    lines = [line for line in response.split('\n') if line.strip().startswith('|') and line.strip().endswith('|')]
 
-    if len(lines) < 2:
-        raise ValueError("No valid table found in the response.")
+def table_to_segment(table_info: Dict[str, Any]) -> Segment:
+    """
+    Builds a segment from the details returned by `extract_table_details`.
 
-    # Parse each line into columns
-    rows = []
-    for line in lines:
-        # Split on '|', ignoring the first and last empty splits due to leading/trailing '|'
-        parts = [col.strip() for col in line.strip().split('|')[1:-1]]
-        rows.append(parts)
+    :param table_info: Dictionary of extracted table details.
+    :return: The table segment.
+    """
+    regions = table_info["page_bounds"]
+    page = int(regions[:, 0].min()) if len(regions) else 0
+    return Segment(table_info["offset"], page, Segment.TABLE, table_info["render_text"], regions)
 
-    # The first row is the header
-    headers = rows[0]
 
-    # The second row is likely the separator row (dashes). Remove it if present.
-    if all(re.match(r'^\-+$', col) for col in rows[1]):
-        rows.pop(1)
+def build_final_output(
+    paragraphs_by_offset: Dict[int, Dict[str, Any]],
+    tables_info: List[Dict[str, Any]]
+) -> List[Segment]:
+    """
+    Builds the final structured output containing paragraphs and tables.
+
+    :param paragraphs_by_offset: Dictionary of non-overlapping paragraphs by offset.
+    :param tables_info: List of extracted table details.
+    :return: List of paragraph and table segments sorted by offset.
+    """
+    segments = [paragraph_to_segment(off, p) for off, p in paragraphs_by_offset.items()]
+    segments.extend(table_to_segment(tinfo) for tinfo in tables_info)
 
-    # The remaining rows are data
-    data = rows[1:]
+    segments.sort(key=lambda segment: segment.offset)
+    return segments
 
-    # Create a DataFrame
-    df = pd.DataFrame(data, columns=headers)
+def parse_table_from_response(response: str) -> pd.DataFrame:
+    """
+    Dynamically parses a table from a text response containing a markdown table 
+    and converts it into a pandas DataFrame.
+    """
+    df = parse_markdown_table(response)
 
     # Convert numeric columns
-    for col in df.columns[1:]:  # Skipping the first column (descriptive)
-        df[col] = (
-            df[col]
-            .str.replace(',', '', regex=False)                  # Remove commas
-            .str.replace(r'\(([\d.]+)\)', r'-\1', regex=True)   # Convert (xxx) to -xxx
-            .apply(pd.to_numeric, errors='coerce')              # Convert to numeric
-        )
+    for col_idx in range(1, len(df.columns)):  # Skipping the first column (descriptive)
+        df.isetitem(col_idx, to_numeric(df.iloc[:, col_idx]))
 
     return df
     
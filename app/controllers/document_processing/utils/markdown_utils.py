@@ -0,0 +1,233 @@
+from typing import Any, Iterable, List, Optional, Tuple
+import re
+import numpy as np
+import pandas as pd
+
+# A markdown table row: a line that starts and ends with a pipe
+_TABLE_ROW_RE = re.compile(r"^[ \t]*\|(.*)\|[ \t]*$")
+# A separator cell such as '---', ':---' or '---:'
+_SEPARATOR_CELL_RE = re.compile(r"^:?-+:?$")
+# Pipes that are not escaped with a backslash
+_CELL_SPLIT_RE = re.compile(r"(?<!\\)\|")
+# Characters that carry no numeric value: currency symbols, thousands separators, spaces, percent
+_NUMERIC_NOISE_RE = re.compile(r"[\s,$€£¥%]|US(?=\$)")
+# A cleaned numeric cell: optional parentheses or minus sign, digits, optional unit suffix
+_NUMBER_RE = re.compile(
+    r"^(?P<open>\()?(?P<sign>[-−–])?(?P<number>\d+(?:\.\d*)?|\.\d+)"
+    r"(?P<suffix>k|thousands?|m|mm|mn|millions?|b|bn|billions?)?\)?$",
+    re.IGNORECASE
+)
+# Cells that stand for zero in financial tables
+_DASH_RE = re.compile(r"^[-−–—]+$")
+# Runs of spaces and tabs, and of blank lines
+_SPACE_RUN_RE = re.compile(r"[ \t]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+_SUFFIX_MULTIPLIERS = {
+    "k": 1e3, "thousand": 1e3, "thousands": 1e3,
+    "m": 1e6, "mm": 1e6, "mn": 1e6, "million": 1e6, "millions": 1e6,
+    "b": 1e9, "bn": 1e9, "billion": 1e9, "billions": 1e9,
+}
+
+
+def _format_cell(value: Any) -> str:
+    """
+    Formats a single cell for a markdown pipe table.
+
+    :param value: The cell value.
+    :return: The cell text with pipes escaped and line breaks collapsed.
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    text = value if isinstance(value, str) else str(value)
+    if "|" in text:
+        text = text.replace("|", "\\|")
+    if "\n" in text:
+        text = " ".join(text.split())
+    return text
+
+
+def render_markdown_table(df: pd.DataFrame) -> str:
+    """
+    Renders a DataFrame as a compact markdown pipe table.
+
+    Unlike `DataFrame.to_markdown`, columns are not padded to a common width and no alignment
+    markers are emitted, which keeps the table cheap to build and short in prompts.
+
+    :param df: The DataFrame to render. The index is not included.
+    :return: The markdown table, or an empty string for a DataFrame without columns.
+    """
+    if len(df.columns) == 0:
+        return ""
+    return render_markdown_rows(list(df.columns), df.to_numpy(dtype=object).tolist())
+
+
+def render_markdown_rows(columns: List[Any], rows: List[List[Any]]) -> str:
+    """
+    Renders a header and rows of cells as a compact markdown pipe table.
+
+    :param columns: The header cells.
+    :param rows: The data rows, each with one cell per column.
+    :return: The markdown table, or an empty string without columns.
+    """
+    if not columns:
+        return ""
+
+    header = "| " + " | ".join(_format_cell(column) for column in columns) + " |"
+    separator = "|" + "---|" * len(columns)
+    lines = ["| " + " | ".join(_format_cell(value) for value in row) + " |" for row in rows]
+    return "\n".join([header, separator, *lines])
+
+
+def _split_row(line: str) -> List[str]:
+    """
+    Splits a markdown table row into stripped cells.
+
+    :param line: A line matching a markdown table row.
+    :return: The cell texts, with escaped pipes unescaped.
+    """
+    inner = _TABLE_ROW_RE.match(line).group(1)
+    return [cell.strip().replace("\\|", "|") for cell in _CELL_SPLIT_RE.split(inner)]
+
+
+def compact_markdown_whitespace(text: str) -> str:
+    """
+    Removes padding whitespace from a text and the markdown tables in it: cell padding, separator
+    dashes, runs of spaces and repeated blank lines.
+
+    :param text: The text, e.g. a table segment with its context and footnotes.
+    :return: The compacted text, with one space around each table pipe.
+    """
+    lines = []
+    for line in text.splitlines():
+        if _TABLE_ROW_RE.match(line):
+            cells = _split_row(line)
+            if all(_SEPARATOR_CELL_RE.match(cell) for cell in cells):
+                lines.append("|" + "---|" * len(cells))
+            else:
+                lines.append("| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |")
+        else:
+            lines.append(_SPACE_RUN_RE.sub(" ", line).strip())
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def extract_table_rows(response: str, header: Optional[str] = None) -> Tuple[List[str], List[List[str]]]:
+    """
+    Extracts the header and data rows of a markdown table from a text response.
+
+    :param response: The text containing the markdown table.
+    :param header: Optional first header cell identifying the table to extract.
+    :return: The header cells and the data rows, padded or truncated to the header width.
+    :raises ValueError: If no table with a header and at least one more row is found.
+    """
+    blocks, current = [], []
+    for line in response.splitlines():
+        if _TABLE_ROW_RE.match(line):
+            current.append(_split_row(line))
+        elif current:
+            blocks.append(current)
+            current = []
+    if current:
+        blocks.append(current)
+
+    blocks = [rows for rows in blocks if len(rows) >= 2]
+    if header is not None:
+        blocks.sort(key=lambda rows: rows[0][0].lower() != header.lower())
+
+    for rows in blocks:
+        # Drop the separator row (dashes) below the header if present
+        if all(_SEPARATOR_CELL_RE.match(cell) for cell in rows[1]):
+            rows = [rows[0]] + rows[2:]
+
+        columns = rows[0]
+        width = len(columns)
+        return columns, [(row + [""] * width)[:width] for row in rows[1:]]
+
+    raise ValueError("No valid table found in the response.")
+
+
+def parse_markdown_table(response: str, header: Optional[str] = None) -> pd.DataFrame:
+    """
+    Extracts a markdown table from a text response, such as an LLM completion.
+
+    The response is split into blocks of consecutive table rows. When `header` is given, the first
+    block whose first header cell equals it (case-insensitive) is preferred; otherwise the first
+    block is used. All cells are returned as strings; see `to_numeric` for converting value columns.
+
+    :param response: The text containing the markdown table.
+    :param header: Optional first header cell identifying the table to extract.
+    :return: A DataFrame with the header row as columns and the remaining rows as data.
+    :raises ValueError: If no table with a header and at least one more row is found.
+    """
+    columns, data = extract_table_rows(response, header)
+    return pd.DataFrame(data, columns=columns)
+
+
+def parse_number(cell: Any, scale_suffixes: bool = False) -> float:
+    """
+    Converts a single financial table cell to a float, with the same rules as `to_numeric`.
+
+    :param cell: The cell value.
+    :param scale_suffixes: Whether unit suffixes multiply the value.
+    :return: The number, 0.0 for dashes, or NaN if the cell is not a number.
+    """
+    return float(to_numeric([cell], scale_suffixes=scale_suffixes).iloc[0])
+
+
+def to_numeric(values: Iterable[Any], scale_suffixes: bool = False) -> pd.Series:
+    """
+    Converts financial table cells to float64 with pandas string operations.
+
+    Handles thousands separators, currency symbols, percent signs, negatives written in
+    parentheses or with a leading minus, dashes standing for zero, and unit suffixes such as
+    'M', 'bn' or 'thousand'. Cells that are not numbers become NaN.
+
+    :param values: The cells to convert.
+    :param scale_suffixes: Whether unit suffixes multiply the value (e.g. '1.5M' -> 1,500,000).
+        By default suffixes are dropped, since table values are normally already in the table's unit scale.
+    :return: A float64 Series, aligned with `values` if it is a Series.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series.astype(np.float64)
+
+    cleaned = series.astype(str).str.replace(_NUMERIC_NOISE_RE, "", regex=True)
+    parts = cleaned.str.extract(_NUMBER_RE)
+    numbers = pd.to_numeric(parts["number"], errors="coerce").astype(np.float64)
+    # Parentheses and leading minus signs become a negative value
+    numbers = numbers.where(parts["open"].isna() & parts["sign"].isna(), -numbers)
+    if scale_suffixes:
+        numbers *= parts["suffix"].str.lower().map(_SUFFIX_MULTIPLIERS).fillna(1.0).astype(np.float64)
+
+    # Cells already holding numbers, or written in scientific notation, convert directly; booleans are not numbers
+    direct = series.where(series.notna() & (series.map(type) != bool))
+    numbers = numbers.fillna(pd.to_numeric(direct, errors="coerce").astype(np.float64))
+    numbers[numbers.isna() & cleaned.str.match(_DASH_RE)] = 0.0
+    return numbers
+
+
+def parse_statement_table(response: str, label_column: str, value_column: str) -> pd.DataFrame:
+    """
+    Parses a two-column statement table (line item and amount) from an LLM response.
+
+    Rows whose amount is not numeric, such as section headers, are dropped.
+
+    :param response: The raw response containing the markdown table.
+    :param label_column: Header of the line item column (e.g. 'Item' or 'Segment').
+    :param value_column: Name given to the amount column (e.g. 'Value' or 'Revenue').
+    :return: A DataFrame with the label column as strings and the value column as float64.
+    :raises ValueError: If the table cannot be found or has no numeric rows.
+    """
+    columns, data = extract_table_rows(response, header=label_column)
+    if len(columns) < 2:
+        raise ValueError("Table must have a label column and a value column.")
+
+    table = pd.DataFrame({
+        label_column: [row[0] for row in data],
+        value_column: to_numeric([row[1] for row in data])
+    })
+    # Skip NaN amounts
+    table = table[table[value_column].notna()].reset_index(drop=True)
+    if table.empty:
+        raise ValueError("No valid rows found in the extracted table.")
+    return table
@@ -0,0 +1,149 @@
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.services.azure_services import usage_tracker
+
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+_MONTH_BY_PREFIX = {month[:3].lower(): month for month in MONTHS}
+_MONTH_PATTERN = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\.?"
+
+# "For the fiscal year ended December 31, 2023" on the cover page of a 10-K or 10-Q
+_FISCAL_YEAR_END_RE = re.compile(
+    r"for the (?:fiscal )?(?:year|quarterly period|quarter|period) ended:?\s*"
+    rf"(?P<month>{_MONTH_PATTERN})\s+(?P<day>\d{{1,2}}),?\s*(?P<year>(?:19|20)\d{{2}})",
+    re.IGNORECASE
+)
+# The cover page caption placed under the registrant's name
+_REGISTRANT_RE = re.compile(r"\(?\s*exact name of (?:the )?registrant as specified in its charter\s*\)?", re.IGNORECASE)
+# Table captions such as "(in millions, except per share data)" or "(Dollars in thousands)"
+_UNIT_SCALE_RE = re.compile(
+    r"\(\s*(?:in|(?:amounts|dollars|\$|U\.S\. dollars)\s+in)\s+(thousands|millions|billions)\b", re.IGNORECASE
+)
+
+# Leading characters searched for cover page values
+COVER_CHARS = 20000
+# Share of unit scale captions the most frequent scale must have to be trusted
+UNIT_SCALE_MAJORITY = 0.6
+
+# Paths by which a metadata field is resolved, and the prefix of their usage counts
+METADATA_PATHS = ("rules", "llm", "miss")
+_PATH_COUNT_PREFIX = "metadata/"
+
+
+def _head(text: List[str], max_chars: int = COVER_CHARS) -> List[str]:
+    """
+    Returns the leading segments of a document, up to about `max_chars` characters.
+    """
+    head, length = [], 0
+    for segment in text:
+        if length >= max_chars:
+            break
+        head.append(segment)
+        length += len(segment)
+    return head
+
+
+def find_fiscal_year_end(text: List[str]) -> Optional[str]:
+    """
+    Finds the fiscal year end date on the cover page of a filing.
+
+    Args:
+        text (List[str]): List of text strings from the document.
+
+    Returns:
+        Optional[str]: The date as 'Month Day, Year', or None if the cover page statement is not found.
+    """
+    match = _FISCAL_YEAR_END_RE.search(" ".join(" ".join(_head(text)).split()))
+    if match is None:
+        return None
+    month = _MONTH_BY_PREFIX.get(match.group("month")[:3].lower())
+    day = int(match.group("day"))
+    if month is None or not 1 <= day <= 31:
+        return None
+    return f"{month} {day}, {match.group('year')}"
+
+
+def _is_plausible_name(name: str) -> bool:
+    return 2 <= len(name) <= 120 and any(c.isalpha() for c in name) and not name.lower().startswith(
+        ("commission file", "form 10-", "(", "securities registered")
+    )
+
+
+def find_company_name(text: List[str]) -> Optional[str]:
+    """
+    Finds the registrant name on the cover page of a filing, the line above the
+    "(Exact name of registrant as specified in its charter)" caption.
+
+    Args:
+        text (List[str]): List of text strings from the document.
+
+    Returns:
+        Optional[str]: The company name, or None if the caption is not found.
+    """
+    head = _head(text)
+    for i, segment in enumerate(head):
+        match = _REGISTRANT_RE.search(segment)
+        if match is None:
+            continue
+        # The name may share the caption's paragraph or sit in one of the paragraphs before it
+        candidates = [segment[:match.start()]] + head[max(0, i - 2):i][::-1]
+        for candidate in candidates:
+            lines = [line.strip() for line in candidate.splitlines() if line.strip()]
+            if lines and _is_plausible_name(lines[-1]):
+                return " ".join(lines[-1].split())
+        return None
+    return None
+
+
+def find_unit_scale(combined_text: str) -> Optional[str]:
+    """
+    Finds the unit scale of a filing's tables from captions such as "(in millions, except per share data)".
+
+    Args:
+        combined_text (str): The table texts, including their context.
+
+    Returns:
+        Optional[str]: 'thousands', 'millions' or 'billions' when one scale clearly dominates the captions, else None.
+    """
+    counts = Counter(match.lower() for match in _UNIT_SCALE_RE.findall(combined_text))
+    if not counts:
+        return None
+    scale, count = counts.most_common(1)[0]
+    return scale if count / sum(counts.values()) >= UNIT_SCALE_MAJORITY else None
+
+
+def record_metadata_path(field: str, path: str) -> None:
+    """
+    Records how a metadata field was resolved as a count of the current run, filing and stage
+    (see `usage_tracker.record_counts` and `get_metadata_hit_rates`).
+
+    Args:
+        field (str): The metadata field, e.g. 'fiscal_year_end'.
+        path (str): 'rules', 'llm' or 'miss'.
+    """
+    usage_tracker.record_counts(**{f"{_PATH_COUNT_PREFIX}{field}/{path}": 1})
+    logging.debug(f"Metadata '{field}' resolved by {path}.")
+
+
+def get_metadata_hit_rates(counters: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Returns how often each metadata field was resolved by the rules, by the LLM, or not at all.
+
+    Args:
+        counters (Dict[str, Any]): Usage counters of a run, filing or stage, e.g. the 'total' of
+            `usage_tracker.get_run_usage`.
+
+    Returns:
+        Dict[str, Dict[str, int]]: Counts per field and path.
+    """
+    rates: Dict[str, Dict[str, int]] = {}
+    for key, count in counters.items():
+        if key.startswith(_PATH_COUNT_PREFIX):
+            field, path = key[len(_PATH_COUNT_PREFIX):].rsplit("/", 1)
+            rates.setdefault(field, dict.fromkeys(METADATA_PATHS, 0))[path] = int(count)
+    return rates
@@ -1,31 +1,60 @@
+import functools
 import pandas as pd
 import time
 import re 
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Type
 import multiprocessing
 
+from app.services.azure_services import usage_tracker
 from app.services.azure_services.openai_service import AzureOpenAIService
 
-def retry_with_exponential_backoff(max_retries: int = 3, backoff_factor: int = 2):
+# Possible classifier answers (lowercase) mapped to the statement names used downstream
+VALID_STATEMENTS = {
+    "income statement": "Income Statement",
+    "balance sheet": "Balance Sheet",
+    "stockholders equity statement": "Stockholder's Equity Statement",
+    "stockholder's equity statement": "Stockholder's Equity Statement",
+    "stockholders' equity statement": "Stockholder's Equity Statement",
+    "cash flow statement": "Cash Flow Statement",
+    "none": "None"
+}
+
+def retry_with_exponential_backoff(
+    max_retries: int = 3,
+    backoff_factor: int = 2,
+    exceptions: Tuple[Type[BaseException], ...] = (Exception,),
+    reraise: bool = False
+):
     """
-    Decorator that retries a function with exponential backoff upon an assertion error.
+    Decorator that retries a function with exponential backoff upon an error.
 
     Args:
-        max_retries (int): Maximum number of retries.
+        max_retries (int): Maximum number of attempts.
         backoff_factor (int): Backoff factor for exponential delay.
+        exceptions (Tuple[Type[BaseException], ...]): The errors that are retried. Defaults to any Exception.
+        reraise (bool): Whether to raise the last error once all attempts fail. Defaults to False,
+            in which case the failure is logged and None is returned.
 
     Returns:
         Decorated function.
     """
     def decorator(func):
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
-                except AssertionError:
+                except exceptions as e:
                     if attempt < max_retries - 1:
+                        print(f"Attempt {attempt + 1} of {func.__name__} failed ({e}). Retrying...")
+                        usage_tracker.record_retry()
                         time.sleep(backoff_factor ** attempt)
+                    elif reraise:
+                        raise
+                    else:
+                        print(f"All {max_retries} attempts of {func.__name__} failed ({e}).")
             # Return None if all retries fail
             return None
         return wrapper
@@ -42,26 +71,15 @@ def process_chatbot_response(response: str) -> Tuple[str, str]:
     Returns:
         Tuple[str, str]: A tuple containing the statement type and explanation.
     """
-    # Define the list of possible responses
-    valid_responses = {
-        "income statement": "Income Statement",
-        "balance sheet": "Balance Sheet",
-        "stockholders equity statement": "Stockholder's Equity Statement",
-        "stockholder's equity statement": "Stockholder's Equity Statement",
-        "stockholders' equity statement": "Stockholder's Equity Statement",
-        "cash flow statement": "Cash Flow Statement",
-        "none": "None"
-    }
-
     # Find the first pair of brackets and extract the text inside
     match = re.search(r"\[(.*?)\]", response)
     statement = match.group(1).strip().lower() if match else None
 
-    if statement is None or statement not in valid_responses:
+    if statement is None or statement not in VALID_STATEMENTS:
         raise ValueError(f"Invalid response: '{statement}' is not in the list of valid responses.")
 
     # Map the extracted statement to the correct case-sensitive version
-    normalized_statement = valid_responses[statement]
+    normalized_statement = VALID_STATEMENTS[statement]
 
     return normalized_statement
 
@@ -102,67 +120,371 @@ def classify_table(df: str) -> Tuple[str, str]:
 
 
 from typing import List, Tuple, Optional
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import multiprocessing
 import pandas as pd
+from app.core.classifiers.table_classifier import TablePreClassifier, load_default_pre_classifier, log_classifications
+
+import json
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+# Token budget for the tables packed into one batched classification prompt
+BATCH_CLASSIFICATION_TOKEN_BUDGET = 6000
+
+BATCH_CLASSIFICATION_INSTRUCTIONS = (
+    "You are given markdown tables taken from the 10-K or 10-Q filing of a company, each preceded by "
+    "its index. For each table, identify if it belongs to the income statement, balance sheet, "
+    "stockholder's equity statement, or cash flow statement, or none of them at all. "
+    "If a table contains information on the revenue breakdown that counts as part of the Income Statement. "
+    "Return a JSON object with a 'classifications' array holding one object per table with its "
+    "'index' and its 'statement', which must be one of: Income Statement, Balance Sheet, "
+    "Stockholder's Equity Statement, Cash Flow Statement, None.\n"
+    "Example Output:\n"
+    '{"classifications": [{"index": 0, "statement": "Income Statement"}, {"index": 1, "statement": "None"}]}\n\n'
+)
+
+
+def pack_table_batches(dfs: List[str], token_budget: int = BATCH_CLASSIFICATION_TOKEN_BUDGET) -> List[List[int]]:
+    """
+    Packs tables into batches of consecutive indices whose combined size stays within a token budget.
+
+    Args:
+        dfs (List[str]): Markdown tables.
+        token_budget (int): Maximum tokens of tables per batch. A table larger than the budget forms its own batch.
+
+    Returns:
+        List[List[int]]: The table indices of each batch.
+    """
+    batches, current, current_tokens = [], [], 0
+    for i, df in enumerate(dfs):
+        tokens = count_tokens(df)
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def classify_table_batch(tables: Dict[int, str], openai_service: Optional[AzureOpenAIService] = None) -> Dict[int, str]:
+    """
+    Classifies several markdown tables with a single JSON query.
+
+    Args:
+        tables (Dict[int, str]): Markdown tables keyed by their index.
+        openai_service (AzureOpenAIService, optional): The service to query. Defaults to a new instance.
+
+    Returns:
+        Dict[int, str]: The statement type of each table the response classified with a valid label.
+        Tables missing from the response or given an invalid label are left out.
+    """
+    openai_service = openai_service or AzureOpenAIService()
+    prompt = BATCH_CLASSIFICATION_INSTRUCTIONS + "\n\n".join(
+        f"Table {index}:\n{table}" for index, table in tables.items()
+    )
+
+    try:
+        response = json.loads(openai_service.query_json(prompt, use_memory=False))
+        items = response.get("classifications", []) if isinstance(response, dict) else response
+    except Exception as e:
+        print(f"Error in batched table classification: {e}")
+        return {}
+
+    classifications = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index"))
+        except (TypeError, ValueError):
+            continue
+        statement = str(item.get("statement", "")).strip().strip("[]").lower()
+        if index in tables and statement in VALID_STATEMENTS:
+            classifications[index] = VALID_STATEMENTS[statement]
+    return classifications
+
+
+def classify_tables_batched(
+    dfs: List[str],
+    max_workers: Optional[int] = None,
+    token_budget: int = BATCH_CLASSIFICATION_TOKEN_BUDGET
+) -> List[Optional[str]]:
+    """
+    Classifies markdown tables in batched JSON queries, falling back to one query per table for
+    any table the batched response misses or labels invalidly.
+
+    Args:
+        dfs (List[str]): Markdown tables to classify.
+        max_workers (int, optional): Maximum number of concurrent queries. Defaults to the number of CPU cores.
+        token_budget (int): Maximum tokens of tables per batch.
+
+    Returns:
+        List[Optional[str]]: The statement type of each table.
+    """
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+
+    classifications: List[Optional[str]] = [None] * len(dfs)
+    batches = pack_table_batches(dfs, token_budget)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch_futures = [
+            usage_tracker.submit_in_context(executor, classify_table_batch, {i: dfs[i] for i in batch})
+            for batch in batches
+        ]
+        for future in as_completed(batch_futures):
+            for index, statement in future.result().items():
+                classifications[index] = statement
+
+        missing = [i for i, statement in enumerate(classifications) if statement is None]
+        fallback_futures = {usage_tracker.submit_in_context(executor, classify_table, dfs[i]): i for i in missing}
+        for future in as_completed(fallback_futures):
+            classifications[fallback_futures[future]] = future.result()
+
+    print(
+        f"Classified {len(dfs)} tables in {len(batches)} batched queries "
+        f"and {len(missing)} single-table fallbacks."
+    )
+    return classifications
+
 
 
 def classify_multiple_tables(
     dfs: List[pd.DataFrame],
-    max_workers: Optional[int] = None
+    max_workers: Optional[int] = None,
+    pre_classifier: Optional[TablePreClassifier] = None,
+    use_pre_classifier: bool = True,
+    batched: bool = False
 ) -> List[str]:
     """
     Classifies multiple markdown tables concurrently.
 
+    Tables the local pre-classifier is confident about are labelled without an LLM call; the rest
+    are sent to the LLM, and their classifications are logged as training data for the pre-classifier.
+
     Args:
         dfs (List[pd.DataFrame]): List of DataFrames to classify.
         max_workers (int, optional): Maximum number of worker threads. Defaults to the number of CPU cores.
+        pre_classifier (TablePreClassifier, optional): Local classifier deciding confident tables.
+            Defaults to the trained classifier at TABLE_CLASSIFIER_PATH, if any.
+        use_pre_classifier (bool): Whether to use a pre-classifier at all. Defaults to True.
+        batched (bool): Whether to pack the remaining tables into batched JSON queries
+            (see `classify_tables_batched`) instead of one query per table. Defaults to False.
 
     Returns:
         List[str]: A list of classification statements for each table.
     """
     if max_workers is None:
         max_workers = multiprocessing.cpu_count()
-
-    classifications = [None] * len(dfs)  # To maintain order in results
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit tasks with indices to keep track of table order
-        future_to_index = {
-            executor.submit(classify_table, df): i for i, df in enumerate(dfs)
-        }
-
-        for future in as_completed(future_to_index):
-            index = future_to_index[future]
-            statement = future.result()  # Ignore explanation
+    if use_pre_classifier and pre_classifier is None:
+        pre_classifier = load_default_pre_classifier()
+
+    # Decide confident tables locally; None marks the tables left to the LLM
+    if use_pre_classifier and pre_classifier is not None:
+        classifications = pre_classifier.decide(dfs)
+    else:
+        classifications = [None] * len(dfs)
+    pending = [i for i, statement in enumerate(classifications) if statement is None]
+
+    if batched:
+        for index, statement in zip(pending, classify_tables_batched([dfs[i] for i in pending], max_workers)):
             classifications[index] = statement
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit tasks with indices to keep track of table order
+            future_to_index = {
+                usage_tracker.submit_in_context(executor, classify_table, dfs[i]): i for i in pending
+            }
+
+            for future in as_completed(future_to_index):
+                index = future_to_index[future]
+                statement = future.result()  # Ignore explanation
+                classifications[index] = statement
+
+    log_classifications([dfs[i] for i in pending], [classifications[i] for i in pending])
+    skipped = len(dfs) - len(pending)
+    print(f"Table pre-classifier decided {skipped} of {len(dfs)} tables; skipped {skipped} LLM classification calls.")
 
     return classifications
 
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
 from app.services.azure_services.openai_service import AzureOpenAIService
+from app.controllers.document_processing.utils import metadata_utils
+from app.controllers.document_processing.utils.retrieval_utils import (
+    DocumentIndex, FISCAL_YEAR_END_QUERY, COMPANY_NAME_QUERY
+)
 from typing import List, Optional
 
+# Delay between the requests of a hedged context expansion until enough latencies are observed
+HEDGE_DELAY_SECONDS = 0.5
+# Observed metadata query latencies: how many are kept, how many are needed and which percentile
+# of them a hedged request waits before the next one is sent
+HEDGE_LATENCY_WINDOW = 50
+HEDGE_MIN_SAMPLES = 5
+HEDGE_LATENCY_PERCENTILE = 0.9
+
+_query_latencies = deque(maxlen=HEDGE_LATENCY_WINDOW)
+_query_latencies_lock = threading.Lock()
+
+
+def _record_query_latency(latency: float) -> None:
+    """
+    Records the latency of a metadata query for the adaptive hedge delay.
+    """
+    with _query_latencies_lock:
+        _query_latencies.append(latency)
+
+
+def observed_hedge_delay() -> float:
+    """
+    Returns the delay between hedged requests: the HEDGE_LATENCY_PERCENTILE of the recently observed
+    metadata query latencies, so a request is only hedged once it is slower than most, or
+    HEDGE_DELAY_SECONDS until HEDGE_MIN_SAMPLES latencies are observed.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    with _query_latencies_lock:
+        latencies = sorted(_query_latencies)
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY_SECONDS
+    return latencies[min(int(len(latencies) * HEDGE_LATENCY_PERCENTILE), len(latencies) - 1)]
+
+
+def _prefix_contexts(text: List[str], max_context_lengths: List[int]) -> List[str]:
+    """
+    Builds the progressively longer leading contexts of a document, skipping empty and repeated ones.
+
+    Args:
+        text (List[str]): List of text strings from the document
+        max_context_lengths (List[int]): Maximum context lengths to try
+
+    Returns:
+        List[str]: The distinct non-empty contexts, shortest first.
+    """
+    contexts = []
+    for max_length in max_context_lengths:
+        # Concatenate text segments up to max_length
+        full_context = ""
+        for segment in text:
+            if len(full_context) + len(segment) <= max_length:
+                full_context += segment + "\n\n"
+            else:
+                break
+        if full_context.strip() and full_context not in contexts:
+            contexts.append(full_context)
+    return contexts
+
+
+def query_first_answer(
+    system_prompt: str,
+    user_prompts: List[str],
+    openai_service: AzureOpenAIService,
+    hedged: bool = False,
+    hedge_delay: Optional[float] = None,
+    description: str = "metadata"
+) -> Optional[str]:
+    """
+    Queries prompts of increasing context size and returns the answer to the smallest one that is not 'Not Found'.
+
+    Prompts are queried one after another, or, when hedged, all at once with each request sent
+    `hedge_delay` seconds after the previous one. A hedged query still returns the smallest-context
+    answer, but waits for about one round trip instead of one per prompt. Requests not yet sent once
+    an answer is found are cancelled; requests already in flight are left to finish and ignored.
+
+    Args:
+        system_prompt (str): The system prompt of every query.
+        user_prompts (List[str]): The user prompts, smallest context first.
+        openai_service (AzureOpenAIService): OpenAI service to query
+        hedged (bool): Whether to send the prompts concurrently. Defaults to False.
+        hedge_delay (Optional[float]): Seconds between hedged requests. Defaults to the delay derived
+            from observed latencies, see `observed_hedge_delay`.
+        description (str): What is extracted, used in error messages.
+
+    Returns:
+        Optional[str]: The first meaningful answer, or None if every prompt was answered 'Not Found' or failed.
+    """
+    answered = threading.Event()
+    if hedge_delay is None:
+        hedge_delay = observed_hedge_delay()
+
+    def ask(position: int, user_prompt: str) -> Optional[str]:
+        # Stagger hedged requests; skip the ones an earlier answer made unnecessary
+        if hedged and position and answered.wait(position * hedge_delay):
+            return None
+        try:
+            start = time.perf_counter()
+            response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
+            _record_query_latency(time.perf_counter() - start)
+        except Exception as e:
+            print(f"Error extracting {description}: {e}")
+            return None
+        # Check if a meaningful response was found
+        return response.strip() if response.strip().lower() not in ['not found', ''] else None
+
+    if not hedged or len(user_prompts) < 2:
+        for position, user_prompt in enumerate(user_prompts):
+            answer = ask(position, user_prompt)
+            if answer is not None:
+                return answer
+        return None
+
+    executor = ThreadPoolExecutor(max_workers=len(user_prompts))
+    futures = [
+        usage_tracker.submit_in_context(executor, ask, position, user_prompt)
+        for position, user_prompt in enumerate(user_prompts)
+    ]
+    try:
+        # Take answers in context order so a larger context never wins over a smaller one
+        for future in futures:
+            answer = future.result()
+            if answer is not None:
+                return answer
+        return None
+    finally:
+        answered.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def extract_fiscal_year_end(
     text: List[str], 
     openai_service: AzureOpenAIService,
     top_n: int = 5,
-    max_context_lengths: List[int] = [1000, 2000]
+    max_context_lengths: List[int] = [1000, 2000],
+    retrieval_fallback: bool = True,
+    use_rules: bool = True,
+    index: Optional[DocumentIndex] = None,
+    hedged: bool = False
 ) -> Optional[str]:
     """
     Extract the fiscal year end date using a Retrieval-Augmented Generation (RAG) approach.
 
+    The cover page statement ("For the fiscal year ended ...") is matched first; the LLM is only
+    queried when it is not found.
+
     Args:
         text (List[str]): List of text strings from the document
         openai_service (AzureOpenAIService): OpenAI service to query
         top_n (int, optional): Number of top similar text segments to retrieve. Defaults to 5.
+        retrieval_fallback (bool, optional): Whether to fall back to TF-IDF retrieval over `text`
+            when the leading context has no answer. Defaults to True.
+        use_rules (bool, optional): Whether to try the rule-based extractor first. Defaults to True.
+        index (DocumentIndex, optional): The document's retrieval index, used by the retrieval fallback.
+            Built from `text` when not given.
+        hedged (bool, optional): Whether to query the context expansions concurrently, see
+            `query_first_answer`. Defaults to False.
 
     Returns:
         Optional[str]: Extracted fiscal year end date or None if not found
     """
+    if use_rules:
+        year_ended = metadata_utils.find_fiscal_year_end(text)
+        if year_ended is not None:
+            metadata_utils.record_metadata_path("fiscal_year_end", "rules")
+            return year_ended
 
     # Prepare system prompt for extracting fiscal year end
     system_prompt = (
@@ -176,47 +498,46 @@ def extract_fiscal_year_end(
     )
 
     # Attempt extraction with progressive context expansion
-    for max_length in max_context_lengths:
-        # Concatenate text segments up to max_length
-        full_context = ""
-        for segment in text:
-            if len(full_context) + len(segment) <= max_length:
-                full_context += segment + "\n\n"
-            else:
-                break
-        
-        # Skip if context is empty
-        if not full_context.strip():
-            continue
-        
-        # Query the chatbot
-        response = openai_service.query(
-            system_prompt=system_prompt, 
-            user_prompt=full_context
-        )
-        
-        # Check if a meaningful response was found
-        if response.strip().lower() not in ['not found', '']:
-            return response.strip()
-        
-    # Create TF-IDF vectorizer
-    vectorizer = TfidfVectorizer(stop_words='english')
-    
-    # Define retrieval query
-    query = "fiscal year end date"
-    
-    # Convert text to TF-IDF vectors
-    text_vectors = vectorizer.fit_transform(text)
-    
-    # Convert query to TF-IDF vector
-    query_vector = vectorizer.transform([query])
-    
-    # Calculate cosine similarities
-    similarities = cosine_similarity(query_vector, text_vectors)[0]
-    
+    year_ended = query_first_answer(
+        system_prompt, _prefix_contexts(text, max_context_lengths), openai_service,
+        hedged=hedged, description="fiscal year end"
+    )
+    if year_ended is not None:
+        metadata_utils.record_metadata_path("fiscal_year_end", "llm")
+        return year_ended
+
+    if not retrieval_fallback:
+        metadata_utils.record_metadata_path("fiscal_year_end", "miss")
+        return None
+
+    year_ended = extract_fiscal_year_end_by_retrieval(text, openai_service, top_n, index)
+    metadata_utils.record_metadata_path("fiscal_year_end", "llm" if year_ended else "miss")
+    return year_ended
+
+
+def extract_fiscal_year_end_by_retrieval(
+    text: List[str],
+    openai_service: AzureOpenAIService,
+    top_n: int = 5,
+    index: Optional[DocumentIndex] = None
+) -> Optional[str]:
+    """
+    Extract the fiscal year end date from the text segments most similar to a fiscal year end query.
+
+    Args:
+        text (List[str]): List of text strings from the document
+        openai_service (AzureOpenAIService): OpenAI service to query
+        top_n (int, optional): Number of top similar text segments to retrieve. Defaults to 5.
+        index (DocumentIndex, optional): The document's retrieval index. Built from `text` when not given.
+
+    Returns:
+        Optional[str]: Extracted fiscal year end date or None if not found
+    """
     # Find the top k most similar text segments
-    top_k_indices = np.argsort(similarities)[-top_n:][::-1]
-    retrieved_contexts = [text[idx] for idx in top_k_indices]
+    index = index or DocumentIndex.build(text)
+    retrieved_contexts = index.top_segments(FISCAL_YEAR_END_QUERY, top_k=top_n)
+    if not retrieved_contexts:
+        return None
     
     # Prepare system prompt for extracting fiscal year end
     system_prompt = (
@@ -247,20 +568,38 @@ def extract_fiscal_year_end(
 def extract_company_name(
     text: List[str], 
     openai_service: AzureOpenAIService,
-    max_context_lengths: List[int] = [1000, 2000, 5000]
+    max_context_lengths: List[int] = [1000, 2000, 5000],
+    use_rules: bool = True,
+    index: Optional[DocumentIndex] = None,
+    top_n: int = 5,
+    hedged: bool = False
 ) -> Optional[str]:
     """
     Extract document metadata using progressive context expansion.
+
+    The registrant line of the cover page is matched first; the LLM is only queried when it is not found.
     
     Args:
         text (List[str]): List of text strings from the document
         openai_service (AzureOpenAIService): OpenAI service to query
         metadata_type (str): Type of metadata to extract ('fiscal_year_end' or 'company_name')
         max_context_lengths (List[int]): Maximum context lengths to try
+        use_rules (bool): Whether to try the rule-based extractor first. Defaults to True.
+        index (DocumentIndex, optional): The document's retrieval index. When given, the segments most
+            similar to a company name query replace the context expansions after the first.
+        top_n (int): Number of segments retrieved from `index`. Defaults to 5.
+        hedged (bool): Whether to query the context expansions concurrently, see `query_first_answer`.
+            Defaults to False.
     
     Returns:
         Optional[str]: Extracted metadata or None if not found
     """
+    if use_rules:
+        company_name = metadata_utils.find_company_name(text)
+        if company_name is not None:
+            metadata_utils.record_metadata_path("company_name", "rules")
+            return company_name
+
     # Define system prompts and queries based on metadata type
     system_prompt = (
         "You are an expert document analyzer. Your task is to precisely extract "
@@ -276,49 +615,39 @@ def extract_company_name(
     user_prompt_template = "Extract the official company name from the following context:\n\n{context}"
 
     # Attempt extraction with progressive context expansion
-    for max_length in max_context_lengths:
-        # Concatenate text segments up to max_length
-        full_context = ""
-        for segment in text:
-            if len(full_context) + len(segment) <= max_length:
-                full_context += segment + "\n\n"
-            else:
-                break
-        
-        # Skip if context is empty
-        if not full_context.strip():
-            continue
-        
-        # Prepare user prompt
-        user_prompt = user_prompt_template.format(context=full_context)
-        
-        try:
-            # Query the chatbot
-            response = openai_service.query(
-                system_prompt=system_prompt, 
-                user_prompt=user_prompt
-            )
-            
-            # Check if a meaningful response was found
-            if response.strip().lower() not in ['not found', '']:
-                return response.strip()
-        
-        except Exception as e:
-            print(f"Error extracting company name: {e}")
-    
+    contexts = _prefix_contexts(text, max_context_lengths)
+    if index is not None:
+        # Retrieved segments instead of ever longer prefixes
+        retrieved = "\n\n".join(index.top_segments(COMPANY_NAME_QUERY, top_k=top_n, in_order=True))
+        contexts = contexts[:1] + ([retrieved] if retrieved.strip() else [])
+
+    company_name = query_first_answer(
+        system_prompt, [user_prompt_template.format(context=context) for context in contexts], openai_service,
+        hedged=hedged, description="company name"
+    )
+    if company_name is not None:
+        metadata_utils.record_metadata_path("company_name", "llm")
+        return company_name
+
     # Return None if no metadata found after all attempts
+    metadata_utils.record_metadata_path("company_name", "miss")
     return ""
 
 def extract_unit_scale(
     combined_dfs: str,
-    openai_service: AzureOpenAIService
+    openai_service: AzureOpenAIService,
+    use_rules: bool = True
 ) -> str:
     """
     Extracts the collective unit scale from the provided tables using Azure OpenAI.
 
+    Table captions such as "(in millions, except per share data)" are counted first; the LLM is
+    only queried when no scale clearly dominates them.
+
     Args:
         dfs (str): List of pandas DataFrames representing the tables in string markdown form.
         openai_service (AzureOpenAIService): Service to interact with Azure OpenAI.
+        use_rules (bool): Whether to try the rule-based extractor first. Defaults to True.
 
     Returns:
         str: The collective unit scale (e.g., 'millions', 'thousands', 'billions').
@@ -326,6 +655,12 @@ def extract_unit_scale(
     Raises:
         AssertionError: If the chatbot output is invalid or doesn't match the expected format.
     """
+    if use_rules:
+        unit_scale = metadata_utils.find_unit_scale(combined_dfs)
+        if unit_scale is not None:
+            metadata_utils.record_metadata_path("unit_scale", "rules")
+            return unit_scale
+
     # Combine all tables into a single prompt
     system_prompt = (
         "You are given all the tables from the 10-K or 10-Q filing of a company. "
@@ -339,7 +674,9 @@ def extract_unit_scale(
     response = openai_service.query(system_prompt, combined_dfs)
 
     # Parse and validate the response
-    return _parse_unit_scale_response(response)
+    unit_scale = _parse_unit_scale_response(response)
+    metadata_utils.record_metadata_path("unit_scale", "llm")
+    return unit_scale
 
 
 def _parse_unit_scale_response(response: str) -> str:
@@ -367,86 +704,3 @@ def _parse_unit_scale_response(response: str) -> str:
         return parsed_response
     except Exception as e:
         raise AssertionError(f"Failed to parse or validate chatbot response: {e}")
-
-def aggregate_income_statements(results: Dict[str, Tuple[List[pd.DataFrame], List[float]]]) -> str:
-    """
-    Sends multiple fiscal years' income statement data to the Azure OpenAI Service
-    and asks the model to aggregate them into a single clean table, relying on the model’s
-    best professional judgment as an accountant to merge similar line items.
-
-    Args:
-        results (Dict[str, Tuple[List[pd.DataFrame], List[float]]]): Dictionary where keys are `year_ended`
-            and values are tuples (dataframes, amounts).
-
-    Returns:
-        str: The aggregated table as a string.
-    """
-
-    def dataframe_to_text(df) -> str:
-        """Converts a DataFrame to a simple text representation (e.g., CSV)."""
-        return df.to_csv(index=False)
-
-    # Adjusted system prompt to rely on the model's professional judgment
-    system_prompt = (
-        "You are a financial assistant acting as a professional accountant. You are given data from multiple "
-        "fiscal years' income statements.\n"
-        "Aggregate them into a single clean table, following these rules:\n\n"
-        "Formatting:\n"
-        "- The table should have a header row with the exact fiscal year ended dates as column headers "
-        "(e.g., 'January 31, 2023', 'February 1, 2024').\n"
-        "- The first column header (row 1, col 0) should be blank.\n"
-        "- Preserve the original order of rows from the first year processed for all identical or equivalent line items.\n"
-        "- If new line items appear in subsequent years, place them in the most logically appropriate category "
-        "according to standard income statement sequencing.\n"
-        "- Use your best professional judgment as an accountant to merge line items that represent the same concept, "
-        "even if phrased slightly differently (e.g., adding or removing words like 'and', 'Expenses', etc.).\n"
-        "- Do not include unnecessary rows like 'Income Statement' or 'Revenue' as section headers.\n"
-        "- Negative values should be displayed in parentheses.\n"
-        "- Keep a consistent unit scale.\n"
-        "- The final output should be a clean table without bold formatting or extra section headers.\n\n"
-        "Logical Arithmetic Flow (Standard Income Statement Ordering):\n"
-        "1. All revenue line items (segment revenues) and then Total Revenue.\n"
-        "2. Cost of Goods Sold (COGS).\n"
-        "3. Gross Profit.\n"
-        "4. Operating Expenses (e.g., Selling, General & Administrative).\n"
-        "5. Operating Income.\n"
-        "6. Interest-related items (e.g., Interest Expense, Other Interest Expense, Interest Income), Other Non-Operating Items.\n"
-        "7. Pre-Tax Income.\n"
-        "8. Income Tax Expense.\n"
-        "9. Net Income.\n\n"
-        "Ensure that items like 'Interest Expense on Long-Term Debt' and 'Other Interest Expense' appear after Operating Income "
-        "and before Pre-Tax Income. If new items appear in later years that fit into the interest/other non-operating category, "
-        "place them in that category.\n\n"
-        "Do not provide any explanation outside of the final table. Just provide the aggregated table."
-    )
-
-    # Build the user prompt with all the years' data
-    user_prompt = "Below are the income statement tables for multiple fiscal years:\n\n"
-    for year_ended, (dataframes, amounts) in results.items():
-        user_prompt += f"Year: {year_ended}\n"
-        metric_names = [
-            "Revenue Breakdown",
-            "Gross Profit",
-            "Operating Income",
-            "Pre-Tax Income",
-            "Net Income"
-        ]
-        for metric_name, df, amount in zip(metric_names, dataframes, amounts):
-            user_prompt += f"{metric_name} table:\n"
-            user_prompt += dataframe_to_text(df) + "\n\n"
-            user_prompt += f"Amount associated with {metric_name}: {amount}\n\n"
-
-    user_prompt += (
-        "Please aggregate all the years' data into a single table following the rules above.\n"
-        "Use the exact fiscal year-end dates provided (e.g., 'January 31, 2023', 'February 1, 2024') "
-        "as the column headers in the output table.\n"
-        "Remember to merge line items representing the same concept, using your best judgment as a professional accountant.\n"
-    )
-
-    import json
-    json.dump(user_prompt, open("user_prompt.json", "w"))
-    json.dump(system_prompt, open("system_prompt.json", "w"))
-
-    openai_service = AzureOpenAIService()
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-    return response
\ No newline at end of file
@@ -0,0 +1,151 @@
+import io
+import logging
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is listed in requirements.txt; without it documents are always analyzed in full
+    PdfReader = None
+
+# Phrases that mark income statement pages, with their weight in the page score
+STATEMENT_KEYWORDS = {
+    "consolidated statements of operations": 5.0,
+    "consolidated statements of income": 5.0,
+    "consolidated statements of earnings": 5.0,
+    "income statement": 4.0,
+    "statements of comprehensive income": 3.0,
+    "income before income taxes": 2.0,
+    "provision for income taxes": 2.0,
+    "operating income": 1.5,
+    "gross profit": 1.5,
+    "net income": 1.5,
+    "cost of revenue": 1.5,
+    "cost of sales": 1.5,
+    "earnings per share": 1.5,
+    "total revenue": 1.0,
+    "net sales": 1.0,
+}
+_KEYWORD_RE = re.compile("|".join(re.escape(keyword) for keyword in STATEMENT_KEYWORDS))
+_NUMBER_TOKEN_RE = re.compile(r"^\(?[$€£]?\d[\d,]*(?:\.\d+)?\)?%?$")
+
+# Weight of the share of numeric tokens on a page; statements are mostly numbers
+NUMERIC_DENSITY_WEIGHT = 4.0
+# Minimum page score for a page to be analyzed
+PAGE_SCORE_THRESHOLD = 6.0
+# Leading pages always analyzed, since the cover carries the company name and fiscal year
+COVER_PAGES = 2
+
+
+def is_page_selection_available() -> bool:
+    """
+    Whether page-targeted analysis can run, i.e. pypdf is installed.
+
+    :return: True if the PDF text layer can be read.
+    """
+    return PdfReader is not None
+
+
+def extract_page_texts(document_bytes: bytes) -> Optional[List[str]]:
+    """
+    Extracts the text layer of each page of a PDF.
+
+    :param document_bytes: The binary content of the PDF.
+    :return: The text of each page, or None if pypdf is not installed or the PDF cannot be read.
+    """
+    if PdfReader is None:
+        logging.warning("pypdf is not installed; page-targeted analysis is unavailable.")
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(document_bytes))
+        return [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        logging.warning(f"Failed to read the PDF text layer: {e}")
+        return None
+
+
+def score_pages(page_texts: List[str]) -> np.ndarray:
+    """
+    Scores pages by statement keywords and numeric density.
+
+    :param page_texts: The text of each page.
+    :return: A float array with one score per page.
+    """
+    scores = np.zeros(len(page_texts), dtype=np.float64)
+    for i, text in enumerate(page_texts):
+        lowered = text.lower()
+        keyword_score = sum(STATEMENT_KEYWORDS[match] for match in set(_KEYWORD_RE.findall(lowered)))
+        tokens = lowered.split()
+        numeric_density = (
+            sum(1 for token in tokens if _NUMBER_TOKEN_RE.match(token)) / len(tokens) if tokens else 0.0
+        )
+        scores[i] = keyword_score + NUMERIC_DENSITY_WEIGHT * numeric_density
+    return scores
+
+
+def select_pages(
+    scores: np.ndarray,
+    threshold: float = PAGE_SCORE_THRESHOLD,
+    following_pages: int = 1,
+    cover_pages: int = COVER_PAGES
+) -> List[int]:
+    """
+    Selects the pages to analyze from their scores.
+
+    Pages at or above the threshold are kept together with the pages that follow them, since
+    statements and their notes often continue onto the next page.
+
+    :param scores: One score per page.
+    :param threshold: Minimum score of a statement page.
+    :param following_pages: Number of pages after each statement page to include.
+    :param cover_pages: Number of leading pages to include whenever a statement page is found.
+    :return: Sorted 1-based page numbers, or an empty list if no page reaches the threshold.
+    """
+    hits = np.flatnonzero(scores >= threshold)
+    if hits.size == 0:
+        return []
+
+    selected = set(range(min(cover_pages, len(scores))))
+    for page in hits:
+        selected.update(range(page, min(page + following_pages + 1, len(scores))))
+    return [page + 1 for page in sorted(selected)]
+
+
+def format_page_ranges(pages: List[int]) -> str:
+    """
+    Formats sorted page numbers as a DocIntel `pages` parameter, e.g. [1, 2, 3, 7] -> '1-3,7'.
+
+    :param pages: Sorted 1-based page numbers.
+    :return: The comma-separated page ranges.
+    """
+    ranges = []
+    start = previous = pages[0]
+    for page in pages[1:]:
+        if page != previous + 1:
+            ranges.append(f"{start}-{previous}" if start != previous else str(start))
+            start = page
+        previous = page
+    ranges.append(f"{start}-{previous}" if start != previous else str(start))
+    return ",".join(ranges)
+
+
+def plan_page_selection(document_bytes: bytes) -> Dict[str, object]:
+    """
+    Plans which pages of a filing to send to DocIntel.
+
+    :param document_bytes: The binary content of the PDF.
+    :return: A report with the total page count, the selected pages and the DocIntel `pages`
+        parameter, which is None when the document should be analyzed in full.
+    """
+    page_texts = extract_page_texts(document_bytes)
+    if not page_texts:
+        return {"total_pages": None, "pages": [], "page_ranges": None}
+
+    pages = select_pages(score_pages(page_texts))
+    return {
+        "total_pages": len(page_texts),
+        "pages": pages,
+        "page_ranges": format_page_ranges(pages) if pages else None
+    }
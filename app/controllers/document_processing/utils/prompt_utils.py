@@ -0,0 +1,241 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from app.services.azure_services import usage_tracker
+from app.controllers.document_processing.utils.markdown_utils import extract_table_rows, render_markdown_rows
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+# Token budget of the tables in each prompt stage. Every statement step shares the 'income_statement'
+# tables so that they form a prompt prefix the service can cache across the steps of a filing.
+STAGE_TOKEN_BUDGETS = {
+    "income_statement": 12000,
+    "unit_scale": 1500,
+}
+
+# Rows no stage asks for
+_IRRELEVANT_ROW_RE = re.compile(r"per (common )?share|weighted[- ]average|shares outstanding|dividends declared", re.IGNORECASE)
+# Columns no stage asks for
+_IRRELEVANT_COLUMN_RE = re.compile(r"change|variance|%", re.IGNORECASE)
+# Cells that carry no value on their own; DocIntel often splits '$' and ')' into separate columns
+_EMPTY_CELLS = {"", "$", "%", "(", ")", "-"}
+_YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+# Leading rows kept for the unit scale stage, which only reads headings and the first values
+UNIT_SCALE_ROWS = 3
+
+
+def split_table_text(table_text: str) -> Tuple[str, str, str]:
+    """
+    Splits a table segment text into its context, markdown table and footnotes.
+
+    :param table_text: Text in the 'Context: ... Table: ... Footnotes: ...' layout of table segments.
+    :return: The context, table and footnotes. Text in another layout is returned as the table.
+    """
+    context, separator, rest = table_text.partition("\n\nTable:\n")
+    if not separator:
+        return "", table_text, ""
+    table, _, footnotes = rest.partition("\n\nFootnotes:\n")
+    return context.removeprefix("Context:\n"), table, footnotes
+
+
+def column_years(columns: List[str], rows: List[List[str]]) -> Tuple[List[Optional[str]], int]:
+    """
+    Finds the fiscal year of each column from the header, or from the first rows when the years
+    sit in a second header row.
+
+    :param columns: The header cells.
+    :param rows: The data rows.
+    :return: The year of each column (None if unlabelled), and the index of the data row holding
+        the years, or -1 if they are in the header or not found.
+    """
+    for row_index, cells in enumerate([columns] + rows[:2], start=-1):
+        years = [match.group(0) if (match := _YEAR_RE.search(cell)) else None for cell in cells]
+        if any(years[1:]):
+            return years, row_index
+    return [None] * len(columns), -1
+
+
+def select_columns(columns: List[str], rows: List[List[str]], years: List[Optional[str]], year: Optional[str]) -> List[int]:
+    """
+    Selects the columns of a table worth sending: the label column, and the value columns that are
+    not empty, not percentage changes and not comparatives for another fiscal year.
+
+    :param columns: The header cells.
+    :param rows: The data rows.
+    :param years: The year of each column, see `column_years`.
+    :param year: The fiscal year asked for, e.g. '2023'. Comparative columns are kept when None or
+        when no column is labelled with it.
+    :return: The indices of the columns to keep.
+    """
+    keep_year = year if year is not None and year in years[1:] else None
+
+    keep = [0]
+    for i in range(1, len(columns)):
+        if rows and all(row[i].strip() in _EMPTY_CELLS for row in rows):
+            continue
+        if _IRRELEVANT_COLUMN_RE.search(columns[i]):
+            continue
+        if keep_year is not None and years[i] is not None and years[i] != keep_year:
+            continue
+        keep.append(i)
+    return keep
+
+
+def select_rows(rows: List[List[str]], stage: str) -> List[int]:
+    """
+    Selects the rows a prompt stage needs.
+
+    :param rows: The data rows.
+    :param stage: The prompt stage, e.g. 'unit_scale'.
+    :return: The indices of the rows to keep.
+    """
+    rows_kept = [i for i, row in enumerate(rows) if not _IRRELEVANT_ROW_RE.search(row[0])]
+    if stage == "unit_scale":
+        return rows_kept[:UNIT_SCALE_ROWS]
+    return rows_kept
+
+
+def trim_table_text(table_text: str, stage: str, year: Optional[str]) -> str:
+    """
+    Trims a table segment text to the columns and rows a prompt stage needs.
+
+    :param table_text: The table segment text.
+    :param stage: The prompt stage.
+    :param year: The fiscal year asked for.
+    :return: The trimmed text.
+    """
+    context, table, footnotes = split_table_text(table_text)
+    try:
+        columns, rows = extract_table_rows(table)
+    except ValueError:
+        return table_text
+
+    years, year_row = column_years(columns, rows)
+    column_indices = select_columns(columns, rows, years, year)
+    row_indices = select_rows(rows, stage)
+    if year_row >= 0 and year_row not in row_indices:
+        # Keep the second header row that labels the columns with their years
+        row_indices.insert(0, year_row)
+    trimmed = render_markdown_rows(
+        [columns[c] for c in column_indices],
+        [[rows[r][c] for c in column_indices] for r in row_indices]
+    )
+
+    parts = [f"Context:\n{context}"] if context.strip() else []
+    parts.append(f"Table:\n{trimmed}")
+    if footnotes and stage != "unit_scale":
+        parts.append(f"Footnotes:\n{footnotes}")
+    return "\n\n".join(parts)
+
+
+def table_name(table_text: str) -> str:
+    """
+    Names a table segment in log messages by the first line of its context, or its header row.
+
+    :param table_text: The table segment text.
+    :return: The name, at most 80 characters.
+    """
+    context, table, _ = split_table_text(table_text)
+    lines = [line.strip() for line in (context + "\n" + table).splitlines() if line.strip()]
+    return lines[0][:80] if lines else ""
+
+
+def truncate_table_rows(table_text: str, token_budget: int) -> str:
+    """
+    Cuts the trailing rows of a table segment until it fits a token budget. The context and the
+    header are always kept.
+
+    :param table_text: The table segment text, without footnotes.
+    :param token_budget: Maximum tokens of the text.
+    :return: The text with as many leading rows as fit.
+    """
+    context, table, _ = split_table_text(table_text)
+    try:
+        columns, rows = extract_table_rows(table)
+    except ValueError:
+        return table_text
+    prefix = f"Context:\n{context}\n\n" if context.strip() else ""
+
+    def render(row_count: int) -> str:
+        return f"{prefix}Table:\n{render_markdown_rows(columns, rows[:row_count])}"
+
+    # Binary search for the largest number of leading rows that fits
+    low, high = 0, len(rows)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(render(middle)) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return render(low)
+
+
+def build_tables_prompt(
+    income_statement_dfs: List[str],
+    stage: str,
+    year_ended: Optional[str] = None,
+    token_budget: Optional[int] = None
+) -> str:
+    """
+    Builds the tables section of a prompt within a token budget.
+
+    Columns for other fiscal years, empty columns and rows no stage asks for (such as per-share
+    data) are dropped. Tables are then added in order while they fit the budget, without footnotes if necessary.
+    Tables that still do not fit are dropped with a warning, except the first, highest-ranked table,
+    whose trailing rows are cut instead. The token savings of the call are recorded under the current
+    run and stage (see `record_prompt_savings`).
+
+    :param income_statement_dfs: The table segment texts.
+    :param stage: The prompt stage, one of STAGE_TOKEN_BUDGETS.
+    :param year_ended: The fiscal year ended date asked for, used to drop comparative columns.
+    :param token_budget: Maximum tokens of the tables. Defaults to the stage's budget.
+    :return: The tables joined by blank lines.
+    """
+    token_budget = token_budget or STAGE_TOKEN_BUDGETS.get(stage, STAGE_TOKEN_BUDGETS["income_statement"])
+    year_match = _YEAR_RE.search(year_ended or "")
+    year = year_match.group(0) if year_match else None
+
+    trimmed = [trim_table_text(text, stage, year) for text in income_statement_dfs]
+
+    tables, used_tokens = [], 0
+    for rank, text in enumerate(trimmed):
+        tokens = count_tokens(text)
+        if used_tokens + tokens > token_budget:
+            text = text.split("\n\nFootnotes:\n")[0]
+            tokens = count_tokens(text)
+        if used_tokens + tokens > token_budget:
+            if rank > 0:
+                logging.warning(
+                    f"Prompt stage '{stage}': dropped table '{table_name(text)}' ({tokens} tokens) "
+                    f"over the {token_budget} token budget."
+                )
+                continue
+            # The highest-ranked table is never dropped, only cut to the rows that fit
+            text = truncate_table_rows(text, token_budget)
+            logging.warning(
+                f"Prompt stage '{stage}': truncated table '{table_name(text)}' from {tokens} to "
+                f"{count_tokens(text)} tokens to fit the {token_budget} token budget."
+            )
+            tokens = count_tokens(text)
+        tables.append(text)
+        used_tokens += tokens
+
+    prompt = "\n\n".join(tables)
+    record_prompt_savings(stage, count_tokens("\n\n".join(income_statement_dfs)), count_tokens(prompt))
+    return prompt
+
+
+def record_prompt_savings(stage: str, original_tokens: int, prompt_tokens: int) -> None:
+    """
+    Records the token savings of a prompt as the 'table_tokens' and 'table_tokens_sent' counts of
+    the current run, filing and stage (see `usage_tracker.get_run_usage`).
+
+    :param stage: The prompt stage.
+    :param original_tokens: Tokens of the untrimmed tables.
+    :param prompt_tokens: Tokens of the tables sent.
+    """
+    usage_tracker.record_counts(table_tokens=original_tokens, table_tokens_sent=prompt_tokens)
+    logging.debug(
+        f"Prompt stage '{stage}': {prompt_tokens} of {original_tokens} table tokens sent "
+        f"({original_tokens - prompt_tokens} saved)."
+    )
@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import os
+import pickle
+from typing import List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Queries of the stages that retrieve from the index
+FISCAL_YEAR_END_QUERY = "fiscal year end date"
+COMPANY_NAME_QUERY = "exact name of registrant as specified in its charter company incorporated"
+INCOME_STATEMENT_QUERY = (
+    "consolidated statements of operations income revenue cost of revenue gross profit "
+    "operating income income before income taxes net income"
+)
+
+
+def content_hash(texts: List[str], is_table: Optional[List[bool]] = None) -> str:
+    """
+    Hashes the segments of a document, to tell whether a cached index was built from them.
+
+    Args:
+        texts (List[str]): The segment texts, in document order.
+        is_table (Optional[List[bool]]): Whether each segment is a table.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    for i, text in enumerate(texts):
+        encoded = text.encode("utf-8")
+        flag = b"T" if is_table is not None and is_table[i] else b"P"
+        # Length prefixes keep segment boundaries from being ambiguous
+        digest.update(flag + len(encoded).to_bytes(8, "little") + encoded)
+    return digest.hexdigest()
+
+
+class DocumentIndex:
+    """
+    A TF-IDF index over the segments of one structured document.
+
+    The index is built once after structuring and queried by every stage that needs the segments
+    most relevant to a question, instead of refitting a vectorizer or reading a fixed prefix. Rows
+    of the sparse matrix are L2-normalized, so the dot product with a query vector is the cosine
+    similarity.
+    """
+
+    def __init__(
+        self,
+        texts: List[str],
+        vectorizer: Optional[TfidfVectorizer],
+        matrix: Optional[csr_matrix],
+        is_table: Optional[List[bool]] = None
+    ) -> None:
+        """
+        Initializes a DocumentIndex from a fitted vectorizer and its segment matrix.
+
+        Args:
+            texts (List[str]): The segment texts, in document order.
+            vectorizer (Optional[TfidfVectorizer]): The fitted vectorizer; None for a document without terms.
+            matrix (Optional[csr_matrix]): The TF-IDF matrix, one row per segment.
+            is_table (Optional[List[bool]]): Whether each segment is a table. Defaults to all False.
+        """
+        self.texts = texts
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.is_table = np.asarray(is_table if is_table is not None else [False] * len(texts), dtype=bool)
+
+    @classmethod
+    def build(cls, texts: List[str], is_table: Optional[List[bool]] = None) -> "DocumentIndex":
+        """
+        Fits the index on the segments of a document.
+
+        Args:
+            texts (List[str]): The segment texts, in document order.
+            is_table (Optional[List[bool]]): Whether each segment is a table.
+
+        Returns:
+            DocumentIndex: The index.
+        """
+        vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True, dtype=np.float32)
+        try:
+            matrix = vectorizer.fit_transform(texts).tocsr()
+        except ValueError:
+            # Empty document, or one with stop words only
+            return cls(texts, None, None, is_table)
+        return cls(texts, vectorizer, matrix, is_table)
+
+    def search(self, query: str, top_k: int = 5, tables_only: bool = False) -> List[int]:
+        """
+        Finds the segments most similar to a query.
+
+        Args:
+            query (str): The query text.
+            top_k (int): Maximum number of segments returned. Defaults to 5.
+            tables_only (bool): Whether to consider table segments only. Defaults to False.
+
+        Returns:
+            List[int]: Indices of the matching segments, most similar first. Segments sharing no term
+            with the query are not returned.
+        """
+        if self.matrix is None or top_k <= 0:
+            return []
+        query_vector = self.vectorizer.transform([query])
+        scores = np.asarray((self.matrix @ query_vector.T).todense()).ravel()
+        if tables_only:
+            scores = np.where(self.is_table, scores, 0.0)
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+        # Ties keep document order
+        return [int(i) for i in candidates[np.lexsort((candidates, -scores[candidates]))]]
+
+    def top_segments(self, query: str, top_k: int = 5, tables_only: bool = False, in_order: bool = False) -> List[str]:
+        """
+        Returns the texts of the segments most similar to a query.
+
+        Args:
+            query (str): The query text.
+            top_k (int): Maximum number of segments returned. Defaults to 5.
+            tables_only (bool): Whether to consider table segments only. Defaults to False.
+            in_order (bool): Whether to return the segments in document order instead of by similarity.
+
+        Returns:
+            List[str]: The segment texts.
+        """
+        indices = self.search(query, top_k, tables_only)
+        if in_order:
+            indices = sorted(indices)
+        return [self.texts[i] for i in indices]
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to a directory: the matrix as .npy arrays, which can be memory-mapped when
+        loaded, and a pickle file holding a small header (the content hash of the segments and the
+        matrix shape) followed by the vectorizer. The texts are not saved; the caller has them.
+
+        Args:
+            path (str): The directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        if self.matrix is not None:
+            np.save(os.path.join(path, "data.npy"), self.matrix.data)
+            np.save(os.path.join(path, "indices.npy"), self.matrix.indices)
+            np.save(os.path.join(path, "indptr.npy"), self.matrix.indptr)
+        with open(os.path.join(path, "index.pkl"), "wb") as f:
+            pickle.dump({
+                "content_hash": content_hash(self.texts, self.is_table.tolist()),
+                "shape": self.matrix.shape if self.matrix is not None else None
+            }, f)
+            pickle.dump(self.vectorizer, f)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        texts: List[str],
+        is_table: Optional[List[bool]] = None,
+        mmap: bool = True
+    ) -> Optional["DocumentIndex"]:
+        """
+        Loads an index saved with `save` for the given segments.
+
+        Only the header is read before the content hash is checked, so a stale cache costs neither
+        unpickling the vectorizer nor reading the matrix.
+
+        Args:
+            path (str): The directory.
+            texts (List[str]): The segment texts the index must have been built from.
+            is_table (Optional[List[bool]]): Whether each segment is a table.
+            mmap (bool): Whether to memory-map the matrix arrays instead of reading them. Defaults to True.
+
+        Returns:
+            Optional[DocumentIndex]: The index, or None if it was built from other segments.
+        """
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            header = pickle.load(f)
+            if header["content_hash"] != content_hash(texts, is_table):
+                return None
+            vectorizer = pickle.load(f)
+        matrix = None
+        if header["shape"] is not None:
+            mmap_mode = "r" if mmap else None
+            arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ("data", "indices", "indptr")]
+            matrix = csr_matrix(tuple(arrays), shape=header["shape"], copy=False)
+        return cls(texts, vectorizer, matrix, is_table)
+
+
+def build_document_index(
+    texts: List[str],
+    is_table: Optional[List[bool]] = None,
+    cache_key: Optional[str] = None,
+    cache_dir: str = "./cache/"
+) -> DocumentIndex:
+    """
+    Builds the retrieval index of a document, or loads it memory-mapped from the cache.
+
+    Args:
+        texts (List[str]): The segment texts, in document order.
+        is_table (Optional[List[bool]]): Whether each segment is a table.
+        cache_key (Optional[str]): The cache name, e.g. the blob name; nothing is cached when None.
+        cache_dir (str): Directory of the cache, shared with the analysis results.
+
+    Returns:
+        DocumentIndex: The index.
+    """
+    if cache_key is None:
+        return DocumentIndex.build(texts, is_table)
+
+    cache_path = os.path.join(cache_dir, f"{cache_key}.index")
+    if os.path.exists(os.path.join(cache_path, "index.pkl")):
+        try:
+            # A document structured differently (e.g. with page targeting) gets a new index
+            index = DocumentIndex.load(cache_path, texts, is_table)
+            if index is not None:
+                logging.info(f"Retrieval index loaded from cache: {cache_path}")
+                return index
+        except Exception as e:
+            logging.warning(f"Failed to load retrieval index from '{cache_path}': {e}")
+
+    index = DocumentIndex.build(texts, is_table)
+    index.save(cache_path)
+    logging.info(f"Retrieval index cached to: {cache_path}")
+    return index
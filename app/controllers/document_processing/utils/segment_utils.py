@@ -0,0 +1,87 @@
+from typing import List, Dict, Any, Callable, Union
+import numpy as np
+
+
+def bounds_to_bounding_boxes(page_bounds: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Expands compact per-page bounds into the bounding box dictionaries stored in the search index.
+
+    :param page_bounds: Float32 array of shape (pages, 5) with rows [page, min_x, min_y, max_x, max_y].
+    :return: List of bounding box dictionaries for each page.
+    """
+    page_bounding_boxes = []
+    for page, min_x, min_y, max_x, max_y in np.asarray(page_bounds, dtype=np.float64):
+        box = np.array([min_x, min_y, max_x, min_y, max_x, max_y, min_x, max_y])
+        page_bounding_boxes.append({
+            "pageNumber": int(page),
+            "boundingBox": np.round(box, 4).tolist()
+        })
+    return page_bounding_boxes
+
+
+class Segment:
+    """
+    A single paragraph or table of a structured document.
+
+    Only the fields read downstream are kept: the raw DocIntel paragraph and the per-cell table
+    regions are dropped once the segment is built, so a document's segments can outlive its
+    AnalyzeResult cheaply. Table text can be supplied as a callable, in which case it is rendered
+    on first access and memoized.
+    """
+    __slots__ = ("offset", "page", "kind", "regions", "_text", "_render")
+
+    PARAGRAPH = "paragraph"
+    TABLE = "table"
+
+    def __init__(
+        self,
+        offset: int,
+        page: int,
+        kind: str,
+        text: Union[str, Callable[[], str]],
+        regions: np.ndarray
+    ) -> None:
+        """
+        Initializes a Segment.
+
+        Args:
+            offset (int): Character offset of the segment in the document content.
+            page (int): Page number the segment starts on (0 if unknown).
+            kind (str): Either Segment.PARAGRAPH or Segment.TABLE.
+            text (Union[str, Callable[[], str]]): Text content of the segment (for tables: context,
+                markdown table and footnotes), or a callable that renders it.
+            regions (np.ndarray): Float32 array of shape (pages, 5) with rows [page, min_x, min_y, max_x, max_y].
+        """
+        self.offset = offset
+        self.page = page
+        self.kind = kind
+        self.regions = regions
+        if callable(text):
+            self._text, self._render = None, text
+        else:
+            self._text, self._render = text, None
+
+    @property
+    def text(self) -> str:
+        """Text content of the segment, rendered once on first access."""
+        if self._text is None:
+            self._text = self._render()
+            self._render = None
+        return self._text
+
+    @property
+    def is_table(self) -> bool:
+        """Whether the segment is a table."""
+        return self.kind == Segment.TABLE
+
+    def bounding_boxes(self) -> List[Dict[str, Any]]:
+        """
+        Returns the per-page bounding boxes of the segment.
+
+        Returns:
+            List[Dict[str, Any]]: Bounding box dictionaries for each page.
+        """
+        return bounds_to_bounding_boxes(self.regions)
+
+    def __repr__(self) -> str:
+        return f"Segment(offset={self.offset}, page={self.page}, kind={self.kind!r}, text={self.text[:30]!r})"
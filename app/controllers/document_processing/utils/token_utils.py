@@ -0,0 +1,40 @@
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; token counts are estimated from the text length without it
+    tiktoken = None
+
+# Average characters per token of English prose for GPT-4-class tokenizers
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Optional[object]:
+    """
+    Returns the tiktoken encoding of a model, or None if tiktoken is unavailable.
+
+    :param model: The model name, e.g. 'gpt-4o'.
+    :return: The encoding, falling back to o200k_base for unknown model names.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Counts the tokens of a text for a model.
+
+    :param text: The text to count.
+    :param model: The model name. Defaults to 'gpt-4o'.
+    :return: The exact token count with tiktoken, otherwise an estimate of one token per four characters.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
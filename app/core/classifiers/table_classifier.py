@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import pickle
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+from app.config import Config
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Guards appends to the classification log from concurrent classification threads
+_log_lock = threading.Lock()
+
+
+def table_features(table_text: str) -> str:
+    """
+    Reduces a rendered table to the text the pre-classifier looks at: its context headings and
+    the row labels (first cell of each row). Numbers carry little signal about the statement type
+    and are dropped.
+
+    Args:
+        table_text (str): The table segment text (context, markdown table and footnotes).
+
+    Returns:
+        str: The context lines followed by the row labels, one per line.
+    """
+    headings, labels = [], []
+    for line in table_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("|"):
+            cells = line.strip("|").split("|")
+            label = cells[0].strip() if cells else ""
+            if label and not set(label) <= set("-: "):
+                labels.append(label)
+        elif not labels:
+            headings.append(line)
+    return "\n".join(headings + labels)
+
+
+class TablePreClassifier:
+    """
+    A local TF-IDF and logistic regression classifier that labels tables before the LLM is asked.
+
+    It is trained from logged LLM classifications and only decides tables it is confident about;
+    uncertain tables are left to the LLM.
+    """
+
+    def __init__(self, confidence_threshold: float = 0.9) -> None:
+        """
+        Initializes an untrained TablePreClassifier.
+
+        Args:
+            confidence_threshold (float): Minimum predicted probability for a local decision. Defaults to 0.9.
+        """
+        self.confidence_threshold = confidence_threshold
+        self.pipeline = Pipeline([
+            ("tfidf", TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=2)),
+            ("model", LogisticRegression(max_iter=1000, class_weight="balanced"))
+        ])
+
+    def fit(self, table_texts: List[str], labels: List[str]) -> "TablePreClassifier":
+        """
+        Trains the classifier on table texts and their LLM classifications.
+
+        Args:
+            table_texts (List[str]): Rendered table texts.
+            labels (List[str]): The statement type of each table (e.g. 'Income Statement' or 'None').
+
+        Returns:
+            TablePreClassifier: The trained classifier.
+        """
+        self.pipeline.fit([table_features(text) for text in table_texts], labels)
+        return self
+
+    def predict(self, table_texts: List[str]) -> List[Tuple[str, float]]:
+        """
+        Predicts the statement type of each table with its probability.
+
+        Args:
+            table_texts (List[str]): Rendered table texts.
+
+        Returns:
+            List[Tuple[str, float]]: The most likely label and its probability for each table.
+        """
+        if not table_texts:
+            return []
+        probabilities = self.pipeline.predict_proba([table_features(text) for text in table_texts])
+        best = probabilities.argmax(axis=1)
+        classes = self.pipeline.classes_
+        return [(str(classes[i]), float(p)) for i, p in zip(best, probabilities[np.arange(len(best)), best])]
+
+    def decide(self, table_texts: List[str]) -> List[Optional[str]]:
+        """
+        Labels the tables the classifier is confident about.
+
+        Args:
+            table_texts (List[str]): Rendered table texts.
+
+        Returns:
+            List[Optional[str]]: The label of each confident table, or None for tables left to the LLM.
+        """
+        return [
+            label if confidence >= self.confidence_threshold else None
+            for label, confidence in self.predict(table_texts)
+        ]
+
+    def save(self, path: str) -> None:
+        """
+        Saves the trained classifier to a pickle file.
+
+        Args:
+            path (str): The file path.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path: str, confidence_threshold: Optional[float] = None) -> "TablePreClassifier":
+        """
+        Loads a trained classifier from a pickle file.
+
+        Args:
+            path (str): The file path.
+            confidence_threshold (Optional[float]): Overrides the saved confidence threshold.
+
+        Returns:
+            TablePreClassifier: The loaded classifier.
+        """
+        with open(path, "rb") as f:
+            classifier = pickle.load(f)
+        if confidence_threshold is not None:
+            classifier.confidence_threshold = confidence_threshold
+        return classifier
+
+
+def load_default_pre_classifier() -> Optional[TablePreClassifier]:
+    """
+    Loads the pre-classifier configured by TABLE_CLASSIFIER_PATH, if one has been trained.
+
+    Returns:
+        Optional[TablePreClassifier]: The classifier with the configured threshold, or None.
+    """
+    path = Config.TABLE_CLASSIFIER_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return TablePreClassifier.load(path, confidence_threshold=Config.TABLE_CLASSIFIER_THRESHOLD)
+    except Exception as e:
+        logger.warning(f"Failed to load table pre-classifier from '{path}': {e}")
+        return None
+
+
+def log_classifications(table_texts: List[str], labels: List[Optional[str]], path: Optional[str] = None) -> None:
+    """
+    Appends LLM table classifications to a JSON lines file used as training data.
+
+    Args:
+        table_texts (List[str]): Rendered table texts.
+        labels (List[Optional[str]]): The LLM classification of each table; failed classifications are skipped.
+        path (Optional[str]): The log file. Defaults to TABLE_CLASSIFICATION_LOG; nothing is logged if unset.
+    """
+    path = path or Config.TABLE_CLASSIFICATION_LOG
+    if not path:
+        return
+    lines = [
+        json.dumps({"text": text, "label": label}) + "\n"
+        for text, label in zip(table_texts, labels) if label is not None
+    ]
+    with _log_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+
+def train_pre_classifier(
+    log_path: Optional[str] = None,
+    model_path: Optional[str] = None,
+    confidence_threshold: Optional[float] = None
+) -> Dict[str, int]:
+    """
+    Trains the pre-classifier from the classification log and saves it.
+
+    Args:
+        log_path (Optional[str]): The classification log. Defaults to TABLE_CLASSIFICATION_LOG.
+        model_path (Optional[str]): Where to save the classifier. Defaults to TABLE_CLASSIFIER_PATH.
+        confidence_threshold (Optional[float]): Threshold stored with the classifier. Defaults to
+            TABLE_CLASSIFIER_THRESHOLD.
+
+    Returns:
+        Dict[str, int]: The number of training examples per label.
+    """
+    log_path = log_path or Config.TABLE_CLASSIFICATION_LOG
+    model_path = model_path or Config.TABLE_CLASSIFIER_PATH
+    if not log_path or not model_path:
+        raise ValueError("Both a classification log and a model path are required.")
+
+    texts, labels = [], []
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            texts.append(record["text"])
+            labels.append(record["label"])
+    if len(set(labels)) < 2:
+        raise ValueError("The classification log must contain at least two different labels.")
+
+    classifier = TablePreClassifier(confidence_threshold or Config.TABLE_CLASSIFIER_THRESHOLD).fit(texts, labels)
+    classifier.save(model_path)
+    counts = {label: labels.count(label) for label in sorted(set(labels))}
+    logger.info(f"Table pre-classifier trained on {len(labels)} tables {counts} and saved to '{model_path}'.")
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(train_pre_classifier())
@@ -0,0 +1,292 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.services.azure_services.openai_service import AzureOpenAIService
+from app.core.fs_generators.income_statement_json_gen import SECTIONS
+
+# Canonical income statement categories: line items matching the same pattern are the same
+# concept, and line items matching different patterns never are
+CANONICAL_CATEGORIES = [
+    ("cost_of_revenue", r"cost of (goods sold|sales|revenues?|products?|services)|\bcogs\b"),
+    ("selling_general_administrative", r"selling,? general|general and administrative|\bsg ?and ?a\b"),
+    ("research_and_development", r"research and development|\br ?and ?d\b"),
+    ("depreciation_and_amortization", r"depreciation|amortization"),
+    ("interest_expense", r"interest expense"),
+    ("interest_income", r"interest income|investment income"),
+    ("income_tax", r"income tax|provision for taxes|taxes on income"),
+    ("other_non_operating", r"other (income|expense|non-?operating)"),
+]
+_CATEGORY_RES = [(name, re.compile(pattern)) for name, pattern in CANONICAL_CATEGORIES]
+
+# Words that do not change the concept of a line item
+_FILLER_WORDS = {"and", "the", "of", "total", "expense", "expenses"}
+
+# Label similarity from which line items are merged without asking, and below which they are never merged
+MATCH_THRESHOLD = 0.8
+AMBIGUOUS_THRESHOLD = 0.5
+
+LABEL_MATCH_INSTRUCTIONS = (
+    "You are a professional accountant merging income statements of several fiscal years. For each pair of "
+    "line item labels below, decide whether both labels denote the same line item. "
+    'Return a JSON object: {"matches": [{"id": <pair id>, "same": true or false}]}\n\n'
+)
+
+
+def normalize_label(label: str) -> str:
+    """
+    Normalizes a line item label for comparison: lowercase words without punctuation or filler words.
+
+    Args:
+        label (str): The line item label.
+
+    Returns:
+        str: The normalized label.
+    """
+    words = re.findall(r"[a-z0-9]+", str(label).lower().replace("&", " and "))
+    return " ".join(word for word in words if word not in _FILLER_WORDS)
+
+
+def label_category(label: str) -> Optional[str]:
+    """
+    Finds the canonical category of a line item label.
+
+    Args:
+        label (str): The line item label.
+
+    Returns:
+        Optional[str]: The category name, or None if the label matches no category.
+    """
+    text = " ".join(re.findall(r"[a-z0-9,]+", str(label).lower().replace("&", " and ")))
+    return next((name for name, regex in _CATEGORY_RES if regex.search(text)), None)
+
+
+def section_items(df: pd.DataFrame, section: int) -> List[Tuple[str, float]]:
+    """
+    Reads the line items of an income statement section, without its subtotals.
+
+    Args:
+        df (pd.DataFrame): The section DataFrame, a label column followed by a value column, starting
+            with the previous subtotal (except for revenue) and ending with the section's subtotal.
+        section (int): The position of the section in SECTIONS.
+
+    Returns:
+        List[Tuple[str, float]]: The (label, value) pairs of the line items.
+    """
+    label = SECTIONS[section][2].lower()
+    previous_label = SECTIONS[section - 1][2].lower() if section > 0 else None
+    subtotals = {normalize_label(label)} | ({normalize_label(previous_label)} if previous_label else set())
+
+    rows = [(str(item).strip(), value) for item, value in zip(df.iloc[:, 0], df.iloc[:, 1])]
+    if rows and label in rows[-1][0].lower():
+        rows = rows[:-1]
+    if rows and previous_label and previous_label in rows[0][0].lower():
+        rows = rows[1:]
+    return [(item, float(value)) for item, value in rows if normalize_label(item) not in subtotals]
+
+
+def _label_similarities(labels: List[str], row_labels: List[str]) -> np.ndarray:
+    """
+    Cosine similarity of character n-gram TF-IDF vectors between two lists of labels.
+    """
+    if not labels or not row_labels:
+        return np.zeros((len(labels), len(row_labels)))
+    vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
+    vectors = vectorizer.fit_transform([normalize_label(label) for label in labels + row_labels])
+    return (vectors[:len(labels)] @ vectors[len(labels):].T).toarray()
+
+
+def align_items(
+    labels: List[str],
+    rows: List[dict],
+    year: str,
+    match_threshold: float = MATCH_THRESHOLD,
+    ambiguous_threshold: float = AMBIGUOUS_THRESHOLD
+) -> Tuple[List[Optional[dict]], List[Tuple[int, dict]]]:
+    """
+    Aligns one year's line items of a section with the rows aggregated so far.
+
+    Items are matched by normalized label first, then by canonical category, then by label
+    similarity. Similar labels are matched from the most similar pair down; pairs whose
+    similarity falls between the two thresholds are returned for review instead.
+
+    Args:
+        labels (List[str]): The year's line item labels, in order.
+        rows (List[dict]): The section's aggregated rows, each with a 'label', a 'category' and
+            the 'values' of every year aligned so far.
+        year (str): The year being aligned; rows that already have a value for it are not matched.
+        match_threshold (float): Similarity from which labels are matched.
+        ambiguous_threshold (float): Similarity from which unmatched labels are flagged as ambiguous.
+
+    Returns:
+        Tuple[List[Optional[dict]], List[Tuple[int, dict]]]: The matched row of each item (None for a
+        new row), and the ambiguous (item index, row) pairs.
+    """
+    matches: List[Optional[dict]] = [None] * len(labels)
+    available = [row for row in rows if year not in row["values"]]
+
+    def claim(i: int, row: dict) -> None:
+        matches[i] = row
+        available.remove(row)
+
+    # Same normalized label
+    for i, label in enumerate(labels):
+        row = next((row for row in available if normalize_label(row["label"]) == normalize_label(label)), None)
+        if row is not None:
+            claim(i, row)
+
+    # Same canonical category
+    categories = [label_category(label) for label in labels]
+    for i, category in enumerate(categories):
+        if matches[i] is None and category is not None:
+            row = next((row for row in available if row["category"] == category), None)
+            if row is not None:
+                claim(i, row)
+
+    pending = [i for i in range(len(labels)) if matches[i] is None]
+    similarities = _label_similarities([labels[i] for i in pending], [row["label"] for row in available])
+    for a, i in enumerate(pending):
+        for b, row in enumerate(available):
+            # Items of different canonical categories are never the same line item
+            if categories[i] is not None and row["category"] is not None and categories[i] != row["category"]:
+                similarities[a, b] = 0.0
+
+    ambiguous, candidates = [], list(available)
+    used_items, used_rows = set(), set()
+    for flat in np.argsort(-similarities, axis=None, kind="stable"):
+        a, b = divmod(int(flat), similarities.shape[1])
+        similarity = similarities[a, b]
+        if similarity < ambiguous_threshold:
+            break
+        if a in used_items or b in used_rows:
+            continue
+        used_items.add(a)
+        used_rows.add(b)
+        if similarity >= match_threshold:
+            claim(pending[a], candidates[b])
+        else:
+            ambiguous.append((pending[a], candidates[b]))
+    return matches, ambiguous
+
+
+def resolve_ambiguous_matches(
+    pairs: List[Tuple[str, str]],
+    openai_service: Optional[AzureOpenAIService] = None
+) -> List[bool]:
+    """
+    Asks Azure OpenAI whether each pair of line item labels denotes the same line item.
+
+    Args:
+        pairs (List[Tuple[str, str]]): The label pairs.
+        openai_service (AzureOpenAIService, optional): The service to query. Defaults to a new instance.
+
+    Returns:
+        List[bool]: Whether each pair is the same line item. Pairs the response misses, or all
+        pairs if the query fails, are kept apart.
+    """
+    if not pairs:
+        return []
+    openai_service = openai_service or AzureOpenAIService()
+    prompt = LABEL_MATCH_INSTRUCTIONS + "\n".join(
+        f'Pair {i}: "{label}" / "{row_label}"' for i, (label, row_label) in enumerate(pairs)
+    )
+
+    decisions = [False] * len(pairs)
+    try:
+        response = json.loads(openai_service.query_json(prompt, use_memory=False))
+        items = response.get("matches", []) if isinstance(response, dict) else []
+    except Exception as e:
+        print(f"Error resolving ambiguous line items: {e}")
+        return decisions
+
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < len(pairs):
+            decisions[index] = item.get("same") is True
+    return decisions
+
+
+def _ordered_years(years: List[str]) -> List[str]:
+    """
+    Orders fiscal year ended dates chronologically; dates that cannot be parsed keep their order at the end.
+    """
+    dates = [pd.to_datetime(year, errors="coerce") for year in years]
+    order = sorted(range(len(years)), key=lambda i: (pd.isna(dates[i]), dates[i] if not pd.isna(dates[i]) else 0, i))
+    return [years[i] for i in order]
+
+
+def aggregate_income_statements(
+    results: Dict[str, Tuple[List[pd.DataFrame], List[float]]],
+    openai_service: Optional[AzureOpenAIService] = None,
+    resolve_ambiguous: bool = True
+) -> pd.DataFrame:
+    """
+    Aggregates several fiscal years' income statements into a single table without an LLM.
+
+    Line items are aligned across years section by section (see `align_items`), in the order of the
+    first year processed; items that first appear in a later year are placed after the item that
+    precedes them in that year. Only label pairs too similar to keep apart but not similar enough to
+    merge are sent to Azure OpenAI, in one query per year.
+
+    Args:
+        results (Dict[str, Tuple[List[pd.DataFrame], List[float]]]): Dictionary where keys are `year_ended`
+            and values are tuples (dataframes, amounts) from the income statement generators.
+        openai_service (AzureOpenAIService, optional): The service resolving ambiguous labels. Defaults to a new instance.
+        resolve_ambiguous (bool): Whether to resolve ambiguous labels with Azure OpenAI; they are kept
+            as separate rows otherwise. Defaults to True.
+
+    Returns:
+        pd.DataFrame: A blank-headed label column followed by one numeric column per fiscal year ended
+        date in chronological order, with the line items and subtotals of every section.
+    """
+    sections: List[List[dict]] = [[] for _ in SECTIONS]
+    subtotals: List[Dict[str, float]] = [{} for _ in SECTIONS]
+
+    for year, (dataframes, amounts) in results.items():
+        aligned, ambiguous = [], []
+        for s, (df, amount) in enumerate(zip(dataframes, amounts)):
+            items = section_items(df, s)
+            matches, section_ambiguous = align_items([label for label, _ in items], sections[s], year)
+            aligned.append((items, matches))
+            ambiguous += [(s, i, row) for i, row in section_ambiguous]
+            subtotals[s][year] = float(amount)
+
+        if ambiguous:
+            pairs = [(aligned[s][0][i][0], row["label"]) for s, i, row in ambiguous]
+            if resolve_ambiguous:
+                decisions = resolve_ambiguous_matches(pairs, openai_service)
+                print(f"Resolved {len(pairs)} ambiguous line items for {year}; merged {sum(decisions)}.")
+            else:
+                decisions = [False] * len(pairs)
+            for (s, i, row), same in zip(ambiguous, decisions):
+                if same:
+                    aligned[s][1][i] = row
+
+        for s, (items, matches) in enumerate(aligned):
+            rows = sections[s]
+            position = -1
+            for (label, value), row in zip(items, matches):
+                if row is None:
+                    row = {"label": label, "category": label_category(label), "values": {}}
+                    rows.insert(position + 1, row)
+                row["values"][year] = value
+                position = next(p for p, r in enumerate(rows) if r is row)
+
+    years = _ordered_years(list(results))
+    table = []
+    for s, (_, _, label) in enumerate(SECTIONS):
+        table += [[row["label"]] + [row["values"].get(year, np.nan) for year in years] for row in sections[s]]
+        table.append([label] + [subtotals[s].get(year, np.nan) for year in years])
+    df = pd.DataFrame(table, columns=[""] + years)
+    for year in years:
+        df[year] = df[year].astype(float)
+    return df
@@ -1,84 +1,275 @@
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
+import numpy as np
 import pandas as pd
-import re 
 
+from app.services.azure_services import usage_tracker
+from app.services.azure_services.openai_router import FAILOVER_ERRORS
 from app.services.azure_services.openai_service import AzureOpenAIService
 from app.controllers.document_processing.utils.openai_utils import retry_with_exponential_backoff
+from app.controllers.document_processing.utils.markdown_utils import parse_statement_table
+from app.controllers.document_processing.utils.prompt_utils import build_tables_prompt
+from app.core.fs_generators.income_statement_json_gen import ABSOLUTE_TOLERANCE, RELATIVE_TOLERANCE
 
-def run_step_with_retries(step_func, max_attempts=3):
+# Follow-up sent in the same conversation when a step's table fails its arithmetic check
+CORRECTION_PROMPT = (
+    "Your table does not reconcile: {error} "
+    "Correct the table so that every value matches the provided tables and the rows add up exactly, "
+    "and answer again in the same format."
+)
+
+# Corrective follow-ups per step before giving up
+MAX_CORRECTIONS = 2
+
+# Attempts of each step call when the service is throttled, failing or unreachable, with exponential backoff
+MAX_TRANSPORT_ATTEMPTS = 3
+
+
+def record_step_attempts(attempts: int, succeeded: bool) -> None:
+    """
+    Records the LLM calls a statement step needed as the 'step_runs', 'step_attempts',
+    'step_corrections' and 'step_failures' counts of the current run and stage
+    (see `usage_tracker.get_run_usage`).
+
+    Args:
+        attempts (int): The number of calls made, including corrective follow-ups.
+        succeeded (bool): Whether the step's table reconciled.
+    """
+    usage_tracker.record_counts(
+        step_runs=1,
+        step_attempts=attempts,
+        step_corrections=attempts - 1,
+        step_failures=0 if succeeded else 1
+    )
+
+
+def reconcile_statement_table(
+    df: pd.DataFrame,
+    label: str,
+    previous_label: Optional[str] = None,
+    previous_subtotal: Optional[float] = None
+) -> Optional[str]:
+    """
+    Checks the arithmetic of a step's table: the previous subtotal plus the items must equal the
+    step's subtotal, within the rounding tolerance of the single-pass engine. A revenue table whose
+    only row is the total is accepted as is.
+
+    Args:
+        df (pd.DataFrame): The parsed table, a label column followed by a value column.
+        label (str): The label of the step's subtotal row, e.g. 'Gross Profit'.
+        previous_label (Optional[str]): The label of the subtotal the table starts from; None for revenue.
+        previous_subtotal (Optional[float]): The value of that subtotal.
+
+    Returns:
+        Optional[str]: A description of the discrepancy, or None if the table reconciles.
+    """
+    labels = df.iloc[:, 0].astype(str).str.strip()
+    values = df.iloc[:, 1].to_numpy(dtype=float)
+
+    subtotal_rows = np.flatnonzero(labels.str.contains(label, case=False, regex=False).to_numpy())
+    if len(subtotal_rows) == 0:
+        return f"There is no '{label}' row."
+    end = subtotal_rows[0]
+    total = values[end]
+
+    start, first = 0, previous_subtotal
+    if previous_label is not None and end > 0 and previous_label.lower() in labels.iloc[0].lower():
+        # The table repeats the subtotal it starts from
+        start, first = 1, values[0]
+        if previous_subtotal is not None and not np.isclose(first, previous_subtotal, rtol=RELATIVE_TOLERANCE, atol=ABSOLUTE_TOLERANCE):
+            return f"The first row '{labels.iloc[0]}' is {first:,.2f} but must be {previous_subtotal:,.2f}."
+
+    items = values[start:end]
+    missing = np.flatnonzero(np.isnan(items))
+    if len(missing):
+        return f"The row '{labels.iloc[start + missing[0]]}' has no numeric value."
+    if np.isnan(total):
+        return f"The '{label}' row has no numeric value."
+    if first is None and len(items) == 0:
+        # A filing that reports revenue as a single total row has nothing to sum
+        return None
+
+    expected = (first or 0.0) + items.sum()
+    if not np.isclose(expected, total, rtol=RELATIVE_TOLERANCE, atol=ABSOLUTE_TOLERANCE):
+        start_text = f"{first:,.2f} plus " if first is not None else ""
+        return (
+            f"{start_text}the items above '{label}' sum to {expected:,.2f}, but '{label}' is {total:,.2f} "
+            f"(a difference of {total - expected:,.2f})."
+        )
+    return None
+
+
+def run_step_with_feedback(
+    step: str,
+    messages: List[dict],
+    parse: Callable[[str], pd.DataFrame],
+    extract: Callable[[pd.DataFrame], float],
+    label: str,
+    previous: Optional[Tuple[str, float]] = None,
+    openai_service: Optional[AzureOpenAIService] = None,
+    max_corrections: int = MAX_CORRECTIONS
+) -> Tuple[pd.DataFrame, float]:
     """
-    Runs a step (a group of function calls) up to a maximum number of attempts.
-    If any function in the step fails, the entire step is retried from the beginning.
+    Runs a statement step, checking its table locally and answering a failed check with a short
+    corrective follow-up in the same conversation instead of repeating the request. Calls that fail
+    because the service is throttled, failing or unreachable are retried with exponential backoff,
+    separately from the corrections.
+
+    Args:
+        step (str): The step name, used in the error and correction messages.
+        messages (List[dict]): The step's messages.
+        parse (Callable[[str], pd.DataFrame]): Parses the response into a table.
+        extract (Callable[[pd.DataFrame], float]): Reads the step's subtotal from the table.
+        label (str): The label of the step's subtotal row.
+        previous (Optional[Tuple[str, float]]): The label and value of the subtotal the step starts from.
+        openai_service (AzureOpenAIService, optional): The service to query. Defaults to a new instance.
+        max_corrections (int): Maximum corrective follow-ups. Defaults to MAX_CORRECTIONS.
+
+    Returns:
+        Tuple[pd.DataFrame, float]: The step's table and subtotal.
+
+    Raises:
+        ValueError: If the table still does not reconcile after the corrective follow-ups.
+        openai.OpenAIError: If a call still fails after MAX_TRANSPORT_ATTEMPTS attempts.
     """
-    for attempt in range(1, max_attempts + 1):
+    openai_service = openai_service or AzureOpenAIService()
+    previous_label, previous_subtotal = previous if previous is not None else (None, None)
+
+    @retry_with_exponential_backoff(max_retries=MAX_TRANSPORT_ATTEMPTS, exceptions=FAILOVER_ERRORS, reraise=True)
+    def query_step(step_messages: List[dict]) -> str:
+        return openai_service.query_messages(step_messages)
+
+    for attempt in range(1, max_corrections + 2):
+        response = query_step(messages)
         try:
-            return step_func()
-        except Exception as e:
-            if attempt == max_attempts:
-                raise e  # Re-raise the last exception after max attempts
-            print(f"Attempt {attempt} failed for step {step_func.__name__}. Retrying...")
+            df = parse(response)
+            amount = extract(df)
+            error = reconcile_statement_table(df, label, previous_label, previous_subtotal)
+        except ValueError as e:
+            error = str(e)
+
+        if error is None:
+            record_step_attempts(attempt, succeeded=True)
+            return df, amount
+        if attempt > max_corrections:
+            record_step_attempts(attempt, succeeded=False)
+            raise ValueError(f"Step {step} did not reconcile after {attempt} attempts: {error}")
+
+        print(f"Step {step} failed its check ({error}). Sending a correction...")
+        usage_tracker.record_retry()
+        messages = messages + [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": CORRECTION_PROMPT.format(error=error)}
+        ]
+
 
 def generate_income_statement(
     income_statement_dfs: List[pd.DataFrame],
     unit_scale: str,
-    year_ended: str
+    year_ended: str,
+    openai_service: Optional[AzureOpenAIService] = None,
+    max_corrections: int = MAX_CORRECTIONS
 ) -> Tuple[List[pd.DataFrame], List[float]]:
     """
     Generates the income statement by calculating key financial metrics (Total Revenue, Gross Profit,
     Operating Income, Pre-Tax Income, Net Income) and returning associated DataFrames and values.
     
-    If any functions within a step fail, that entire step is retried up to 3 times starting from
-    the first function of that step.
-    """
-
-    def step_1():
-        # Step 1: Get Revenue Breakdown and Total Revenue
-        revenue_breakdown_response = get_revenue_breakdown(income_statement_dfs, unit_scale, year_ended)
-        revenue_df = parse_revenue_table(revenue_breakdown_response)
-        total_revenue = extract_total_revenue(revenue_df)
-        return revenue_df, total_revenue
-
-    def step_2(total_revenue):
-        # Step 2: Calculate Gross Profit
-        gross_profit_response = get_gross_profit(total_revenue, income_statement_dfs, unit_scale, year_ended)
-        gross_profit_df = parse_gross_profit_table(gross_profit_response)
-        gross_profit = calculate_gross_profit(gross_profit_df)
-        return gross_profit_df, gross_profit
-
-    def step_3(gross_profit):
-        # Step 3: Calculate Operating Income
-        operating_income_response = get_operating_income(gross_profit, income_statement_dfs, unit_scale, year_ended)
-        operating_income_df = parse_operating_income_table(operating_income_response)
-        operating_income = calculate_operating_income(operating_income_df)
-        return operating_income_df, operating_income
-
-    def step_4(operating_income):
-        # Step 4: Calculate Pre-Tax Income
-        pre_tax_income_response = get_pre_tax_income(operating_income, income_statement_dfs, unit_scale, year_ended)
-        pre_tax_income_df = parse_pre_tax_income_table(pre_tax_income_response)
-        pre_tax_income = calculate_pre_tax_income(pre_tax_income_df)
-        return pre_tax_income_df, pre_tax_income
-
-    def step_5(pre_tax_income):
-        # Step 5: Calculate Net Income
-        net_income_response = get_net_income(pre_tax_income, income_statement_dfs, unit_scale, year_ended)
-        net_income_df = parse_net_income_table(net_income_response)
-        net_income = calculate_net_income(net_income_df)
-        return net_income_df, net_income
-
-    # Run each step with retries
-    revenue_df, total_revenue = run_step_with_retries(step_1)
-    gross_profit_df, gross_profit = run_step_with_retries(lambda: step_2(total_revenue))
-    operating_income_df, operating_income = run_step_with_retries(lambda: step_3(gross_profit))
-    pre_tax_income_df, pre_tax_income = run_step_with_retries(lambda: step_4(operating_income))
-    net_income_df, net_income = run_step_with_retries(lambda: step_5(pre_tax_income))
-
-    # Return all DataFrames and calculated amounts as lists
-    dataframes = [revenue_df, gross_profit_df, operating_income_df, pre_tax_income_df, net_income_df]
-    amounts = [total_revenue, gross_profit, operating_income, pre_tax_income, net_income]
+    Each step's table is checked locally; a table that does not add up is answered with the specific
+    discrepancy in the same conversation, up to `max_corrections` times (see `run_step_with_feedback`).
+    """
+    openai_service = openai_service or AzureOpenAIService()
+
+    # (step, instructions, subtotal name in the request, parser, subtotal extractor, subtotal row label)
+    steps = [
+        ("revenue", REVENUE_INSTRUCTIONS, None, parse_revenue_table, extract_total_revenue, "Total Revenue"),
+        ("gross_profit", GROSS_PROFIT_INSTRUCTIONS, "Total revenue", parse_gross_profit_table,
+         calculate_gross_profit, "Gross Profit"),
+        ("operating_income", OPERATING_INCOME_INSTRUCTIONS, "Gross profit", parse_operating_income_table,
+         calculate_operating_income, "Operating Income"),
+        ("pre_tax_income", PRE_TAX_INCOME_INSTRUCTIONS, "Operating income", parse_pre_tax_income_table,
+         calculate_pre_tax_income, "Pre-Tax Income"),
+        ("net_income", NET_INCOME_INSTRUCTIONS, "Pre-tax income", parse_net_income_table,
+         calculate_net_income, "Net Income"),
+    ]
+
+    dataframes, amounts = [], []
+    previous = None
+    for step, instructions, subtotal_name, parse, extract, label in steps:
+        subtotal = (subtotal_name, previous[1]) if previous is not None else None
+        messages = build_statement_messages(income_statement_dfs, instructions, unit_scale, year_ended, subtotal)
+        with usage_tracker.usage_stage(step):
+            df, amount = run_step_with_feedback(
+                step, messages, parse, extract, label, previous, openai_service, max_corrections
+            )
+        dataframes.append(df)
+        amounts.append(amount)
+        previous = (label, amount)
 
     return dataframes, amounts
 
+# Instructions shared by every statement step. Together with the filing's tables they form the
+# leading system message, which stays identical across the steps and retries of a filing so the
+# service can serve it from its prompt cache; per-step values are placed last.
+STATEMENT_SYSTEM_PROMPT = (
+    "You are a professional accountant building an income statement from the tables of a company's "
+    "10-K or 10-Q filing, one step at a time. "
+    "Use the unit scale given in the request for all values in your response! "
+    "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
+    "The output should follow professional accounting standards. "
+    "Do not include 'Less' or 'Add' in the item descriptions. "
+    "Answer with a markdown table with only 2 columns in the format given in the request, "
+    "followed by the arithmetic, and check your math."
+)
+
+
+def build_statement_messages(
+    income_statement_dfs: List[str],
+    instructions: str,
+    unit_scale: str,
+    year_ended: str,
+    subtotal: Optional[Tuple[str, float]] = None
+) -> List[dict]:
+    """
+    Builds the chat messages of a statement step with a cache-friendly layout: the static
+    instructions and the filing's tables first, then the step's instructions, then its values.
+
+    Args:
+        income_statement_dfs (List[str]): List of income statement tables as strings.
+        instructions (str): The step's static instructions.
+        unit_scale (str): The unit scale for the values (e.g., 'Millions').
+        year_ended (str): The fiscal year ended date.
+        subtotal (Optional[Tuple[str, float]]): The name and value of the subtotal the step starts from.
+
+    Returns:
+        List[dict]: The system and user messages.
+    """
+    tables = build_tables_prompt(income_statement_dfs, "income_statement", year_ended)
+    values = [f"Year ended: {year_ended}", f"Unit scale: {unit_scale}"]
+    if subtotal is not None:
+        name, value = subtotal
+        values.append(f"{name}: {value:,.2f} ({unit_scale})")
+    return [
+        {"role": "system", "content": f"{STATEMENT_SYSTEM_PROMPT}\n\nProvided tables:\n{tables}"},
+        {"role": "user", "content": instructions + "\n\n" + "\n".join(values)}
+    ]
+
+
+REVENUE_INSTRUCTIONS = (
+    "Provide the total revenue for the fiscal year given below and the revenue breakdown by segment. "
+    "The output should be formatted as a table with only 2 columns: Segment and Revenue. "
+    "Ensure that the sum of all segment revenues matches the total revenue exactly. "
+    "Prioritize that segment revenues sum up to the total revenue and check your math! "
+    "Make sure all revenues are converted to the unit scale given below. "
+    "The table should follow this exact format:\n\n"
+    "| Segment        | Revenue       |\n"
+    "|----------------|---------------|\n"
+    "| Segment A      | 1,000,000     |\n"
+    "| Segment B      | 2,000,000     |\n"
+    "| Segment C      | 3,000,000     |\n"
+    "| Total Revenue  | 6,000,000     |\n\n"
+    "1,000,000 + 2,000,000 + 3,000,000 = 6,000,000\n\n"
+    "Please follow this example format exactly."
+)
+
 def get_revenue_breakdown(
     income_statement_dfs: List[str],
     unit_scale: str,
@@ -88,38 +279,12 @@ def get_revenue_breakdown(
     Queries the Azure OpenAI Service to get the total revenue and revenue breakdown by segment
     for the given fiscal year.
     """
-    system_prompt = (
-        f"Based on the provided tables related to the income statement, "
-        f"please provide the total revenue for the year ended {year_ended} "
-        f"and the revenue breakdown by segment. "
-        f"The unit scale for all values is '{unit_scale}'. "
-        "Use the unit scale '{unit_scale}' for all values in your response!. "
-        "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
-        "The output should be formatted as a table with only 2 columns: "
-        "Segment and Revenue. "
-        "Ensure that the sum of all segment revenues matches the total revenue exactly. "
-        "Prioritize that segment revenues sum up to the total revenue and check your math! "
-        "Make sure all revenues are converted to the same unit scale, which is explicitly stated as '{unit_scale}'. "
-        "The table should follow this exact format:\n\n"
-        "| Segment        | Revenue       |\n"
-        "|----------------|---------------|\n"
-        "| Segment A      | 1,000,000     |\n"
-        "| Segment B      | 2,000,000     |\n"
-        "| Segment C      | 3,000,000     |\n"
-        "| Total Revenue  | 6,000,000     |\n\n"
-        "1,000,000 + 2,000,000 + 3,000,000 = 6,000,000\n\n"
-        "Please follow this example format exactly."
-    )
-
-    user_prompt = (
-        "Provided tables:\n"
-        "\n\n".join(income_statement_dfs)
+    messages = build_statement_messages(
+        income_statement_dfs, REVENUE_INSTRUCTIONS, unit_scale, year_ended
     )
 
     openai_service = AzureOpenAIService()
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-    # print(response)
-    return response
+    return openai_service.query_messages(messages)
 
 def parse_revenue_table(response: str) -> pd.DataFrame:
     """
@@ -136,27 +301,7 @@ def parse_revenue_table(response: str) -> pd.DataFrame:
         ValueError: If the table cannot be parsed correctly.
     """
     try:
-        # Extract the markdown table portion
-        table_start = response.find("| Segment")
-        table_end = response.rfind("|")
-        if table_start == -1 or table_end == -1:
-            raise ValueError("Table format not found in the response.")
-
-        table_text = response[table_start:table_end + 1]
-
-        # Use regex to extract rows from the table
-        rows = re.findall(r"\| ([^|]+?)\s*\| ([\d,]+)\s*\|", table_text)
-        if not rows:
-            raise ValueError("No valid rows found in the extracted table.")
-
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=["Segment", "Revenue"])
-
-        # Clean and format the 'Revenue' column
-        df["Revenue"] = df["Revenue"].str.replace(",", "").astype(float)
-
-        return df
-
+        return parse_statement_table(response, "Segment", "Revenue")
     except Exception as e:
         raise ValueError(f"Failed to parse revenue table: {e}")
 
@@ -187,6 +332,25 @@ def extract_total_revenue(df: pd.DataFrame) -> float:
     except Exception as e:
         raise ValueError(f"Failed to extract total revenue: {e}")
     
+GROSS_PROFIT_INSTRUCTIONS = (
+    "Provide the detailed breakdown of how the total revenue given below transitions to gross profit "
+    "for the fiscal year given below. "
+    "The first row should be 'Total Revenue', followed by specific items contributing to the calculation "
+    "of gross profit, ending with the 'Gross Profit' as the last row. "
+    "Exclude any expense numbers or items that are part of the calculation from gross profit to operating income, "
+    "as operating income will be calculated separately. "
+    "Ensure that all rows above 'Gross Profit' sum to exactly match the 'Gross Profit' value. "
+    "The table should be formatted as follows:\n\n"
+    "| Item                  | Value         |\n"
+    "|-----------------------|---------------|\n"
+    "| Total Revenue         | 10,000,000    |\n"
+    "| Cost of Goods Sold    | (6,000,000)     |\n"
+    "| Discounts             | (500,000)       |\n"
+    "| Gross Profit          | 3,500,000     |\n\n"
+    "10,000,000 - 6,000,000 - 500,000 = 3,500,000\n\n"
+    "Please follow this example format exactly."
+)
+
 def get_gross_profit(
     total_revenue: float,
     income_statement_dfs: List[str],
@@ -206,46 +370,12 @@ def get_gross_profit(
     Returns:
         str: The chatbot's response containing the breakdown of revenue to gross profit in table format.
     """
-    # Define the system prompt
-    system_prompt = (
-        f"Based on the provided tables related to the income statement, "
-        f"please provide the detailed breakdown of how the total revenue transitions to gross profit "
-        f"for the year ended {year_ended}. "
-        f"The total revenue for the year is {total_revenue:,.2f} ({unit_scale}). "
-        "Use the unit scale '{unit_scale}' for all values in your response!. "
-        "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
-        "The output should follow professional accounting standards. "
-        "Do not include 'Less' or 'Add' in the item descriptions. "
-        "If any value is negative, format it with parentheses (e.g., (500,000)). "
-        "The first row should be 'Total Revenue', followed by specific items contributing to the calculation "
-        "of gross profit, ending with the 'Gross Profit' as the last row. "
-        "Exclude any expense numbers or items that are part of the calculation from gross profit to operating income, "
-        "as operating income will be calculated separately. "
-        "Ensure that all rows above 'Gross Profit' sum to exactly match the 'Gross Profit' value. "
-        "The table should be formatted as follows:\n\n"
-        "| Item                  | Value         |\n"
-        "|-----------------------|---------------|\n"
-        "| Total Revenue         | 10,000,000    |\n"
-        "| Cost of Goods Sold    | (6,000,000)     |\n"
-        "| Discounts             | (500,000)       |\n"
-        "| Gross Profit          | 3,500,000     |\n\n"
-        "10,000,000 - 6,000,000 - 500,000 = 3,500,000\n\n"
-        "Please follow this example format exactly."
-    )
-
-    # Combine the income statement tables into the user prompt
-    user_prompt = (
-        "Provided tables:\n"
-        "\n\n".join(income_statement_dfs)
+    messages = build_statement_messages(
+        income_statement_dfs, GROSS_PROFIT_INSTRUCTIONS, unit_scale, year_ended, ("Total revenue", total_revenue)
     )
 
-    # Initialize the Azure OpenAI Service
     openai_service = AzureOpenAIService()
-
-    # Query the chatbot for the gross profit breakdown
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-    # print(response)
-    return response
+    return openai_service.query_messages(messages)
 
 def parse_gross_profit_table(response: str) -> pd.DataFrame:
     """
@@ -261,29 +391,7 @@ def parse_gross_profit_table(response: str) -> pd.DataFrame:
         ValueError: If the table cannot be parsed correctly.
     """
     try:
-        # Extract the table portion from the response
-        table_start = response.find("| Item")
-        table_end = response.rfind("|")
-        if table_start == -1 or table_end == -1:
-            raise ValueError("Table format not found in the response.")
-
-        table_text = response[table_start:table_end + 1]
-
-        # Use regex to parse table rows
-        rows = re.findall(r"\| (.+?)\s+\| ([\d,().-]+)\s+\|", table_text)
-
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=["Item", "Value"])
-
-        # Clean and format 'Value' column
-        df["Value"] = (
-            df["Value"]
-            .str.replace(",", "")  # Remove commas
-            .str.replace(r"\(([\d.]+)\)", r"-\1", regex=True)  # Convert parentheses to negatives
-            .astype(float)
-        )
-
-        return df
+        return parse_statement_table(response, "Item", "Value")
     except Exception as e:
         raise ValueError(f"Failed to parse gross profit table: {e}")
     
@@ -314,6 +422,26 @@ def calculate_gross_profit(df: pd.DataFrame) -> float:
     except Exception as e:
         raise ValueError(f"Failed to calculate gross profit: {e}")
     
+OPERATING_INCOME_INSTRUCTIONS = (
+    "Provide the detailed breakdown of how the gross profit given below transitions to operating income "
+    "for the fiscal year given below. "
+    "The first row should be 'Gross Profit', followed by specific items contributing to the calculation "
+    "of operating income, ending with the 'Operating Income' as the last row. "
+    "Exclude any expense or item that transitions operating income to pre-tax income, "
+    "as pre-tax income will be calculated separately. "
+    "Ensure that all rows above 'Operating Income' sum to exactly match the 'Operating Income' value. "
+    "The table should be formatted as follows:\n\n"
+    "| Item                  | Value         |\n"
+    "|-----------------------|---------------|\n"
+    "| Gross Profit          | 3,500,000     |\n"
+    "| Selling Expenses      | (1,000,000)     |\n"
+    "| Administrative Expenses| (500,000)      |\n"
+    "| Restructuring Costs   | 200,000     |\n"
+    "| Operating Income      | 1,800,000     |\n\n"
+    "3,500,000 - 1,000,000 - 500,000 + 200,000 = 1,800,000\n\n"
+    "Please follow this example format exactly."
+)
+
 def get_operating_income(
     gross_profit: float,
     income_statement_dfs: List[str],
@@ -333,47 +461,12 @@ def get_operating_income(
     Returns:
         str: The chatbot's response containing the breakdown of gross profit to operating income in table format.
     """
-    # Define the system prompt
-    system_prompt = (
-        f"Based on the provided tables related to the income statement, "
-        f"please provide the detailed breakdown of how the gross profit transitions to operating income "
-        f"for the year ended {year_ended}. "
-        f"The gross profit for the year is {gross_profit:,.2f} ({unit_scale}). "
-        "Use the unit scale '{unit_scale}' for all values in your response!. "
-        "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
-        "The output should follow professional accounting standards. "
-        "Do not include 'Less' or 'Add' in the item descriptions. "
-        "If any value is negative, format it with parentheses (e.g., (500,000)). "
-        "The first row should be 'Gross Profit', followed by specific items contributing to the calculation "
-        "of operating income, ending with the 'Operating Income' as the last row. "
-        "Exclude any expense or item that transitions operating income to pre-tax income, "
-        "as pre-tax income will be calculated separately. "
-        "Ensure that all rows above 'Operating Income' sum to exactly match the 'Operating Income' value. "
-        "The table should be formatted as follows:\n\n"
-        "| Item                  | Value         |\n"
-        "|-----------------------|---------------|\n"
-        "| Gross Profit          | 3,500,000     |\n"
-        "| Selling Expenses      | (1,000,000)     |\n"
-        "| Administrative Expenses| (500,000)      |\n"
-        "| Restructuring Costs   | 200,000     |\n"
-        "| Operating Income      | 1,800,000     |\n\n"
-        "3,500,000 - 1,000,000 - 500,000 + 200,000 = 1,800,000\n\n"
-        "Please follow this example format exactly."
+    messages = build_statement_messages(
+        income_statement_dfs, OPERATING_INCOME_INSTRUCTIONS, unit_scale, year_ended, ("Gross profit", gross_profit)
     )
 
-    # Combine the income statement tables into the user prompt
-    user_prompt = (
-        "Provided tables:\n"
-        "\n\n".join(income_statement_dfs)
-    )
-
-    # Initialize the Azure OpenAI Service
     openai_service = AzureOpenAIService()
-
-    # Query the chatbot for the operating income breakdown
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-    # print(response)
-    return response
+    return openai_service.query_messages(messages)
 
 def parse_operating_income_table(response: str) -> pd.DataFrame:
     """
@@ -389,29 +482,7 @@ def parse_operating_income_table(response: str) -> pd.DataFrame:
         ValueError: If the table cannot be parsed correctly.
     """
     try:
-        # Extract the table portion from the response
-        table_start = response.find("| Item")
-        table_end = response.rfind("|")
-        if table_start == -1 or table_end == -1:
-            raise ValueError("Table format not found in the response.")
-
-        table_text = response[table_start:table_end + 1]
-
-        # Use regex to parse table rows
-        rows = re.findall(r"\| (.+?)\s+\| ([\d,().-]+)\s+\|", table_text)
-
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=["Item", "Value"])
-
-        # Clean and format 'Value' column
-        df["Value"] = (
-            df["Value"]
-            .str.replace(",", "")  # Remove commas
-            .str.replace(r"\(([\d.]+)\)", r"-\1", regex=True)  # Convert parentheses to negatives
-            .astype(float)
-        )
-
-        return df
+        return parse_statement_table(response, "Item", "Value")
     except Exception as e:
         raise ValueError(f"Failed to parse operating income table: {e}")
 
@@ -442,6 +513,26 @@ def calculate_operating_income(df: pd.DataFrame) -> float:
     except Exception as e:
         raise ValueError(f"Failed to calculate operating income: {e}")
     
+PRE_TAX_INCOME_INSTRUCTIONS = (
+    "Provide the detailed breakdown of how the operating income given below transitions to pre-tax income "
+    "for the fiscal year given below. "
+    "The first row should be 'Operating Income', followed by specific items contributing to the calculation "
+    "of pre-tax income, ending with the 'Pre-Tax Income' as the last row. "
+    "Exclude any expense or item that transitions pre-tax income to net income, "
+    "as net income will be calculated separately. "
+    "Ensure that all rows above 'Pre-Tax Income' sum to exactly match the 'Pre-Tax Income' value. "
+    "The table should be formatted as follows:\n\n"
+    "| Item                  | Value         |\n"
+    "|-----------------------|---------------|\n"
+    "| Operating Income      | 1,800,000     |\n"
+    "| Interest Expense      | (100,000)     |\n"
+    "| Interest Income       | 50,000        |\n"
+    "| Other Non-Operating Items | (50,000) |\n"
+    "| Pre-Tax Income        | 1,700,000     |\n\n"
+    "1,800,000 - (100,000 - 50,000 + 50,000) = 1,700,000\n\n"
+    "Please follow this example format exactly."
+)
+
 def get_pre_tax_income(
     operating_income: float,
     income_statement_dfs: List[str],
@@ -461,47 +552,12 @@ def get_pre_tax_income(
     Returns:
         str: The chatbot's response containing the breakdown of operating income to pre-tax income in table format.
     """
-    # Define the system prompt
-    system_prompt = (
-        f"Based on the provided tables related to the income statement, "
-        f"please provide the detailed breakdown of how the operating income transitions to pre-tax income "
-        f"for the year ended {year_ended}. "
-        f"The operating income for the year is {operating_income:,.2f} ({unit_scale}). "
-        "Use the unit scale '{unit_scale}' for all values in your response!. "
-        "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
-        "The output should follow professional accounting standards. "
-        "Do not include 'Less' or 'Add' in the item descriptions. "
-        "If any value is negative, format it with parentheses (e.g., (500,000)). "
-        "The first row should be 'Operating Income', followed by specific items contributing to the calculation "
-        "of pre-tax income, ending with the 'Pre-Tax Income' as the last row. "
-        "Exclude any expense or item that transitions pre-tax income to net income, "
-        "as net income will be calculated separately. "
-        "Ensure that all rows above 'Pre-Tax Income' sum to exactly match the 'Pre-Tax Income' value. "
-        "The table should be formatted as follows:\n\n"
-        "| Item                  | Value         |\n"
-        "|-----------------------|---------------|\n"
-        "| Operating Income      | 1,800,000     |\n"
-        "| Interest Expense      | (100,000)     |\n"
-        "| Interest Income       | 50,000        |\n"
-        "| Other Non-Operating Items | (50,000) |\n"
-        "| Pre-Tax Income        | 1,700,000     |\n\n"
-        "1,800,000 - (100,000 - 50,000 + 50,000) = 1,700,000\n\n"
-        "Please follow this example format exactly."
-    )
-
-    # Combine the income statement tables into the user prompt
-    user_prompt = (
-        "Provided tables:\n"
-        "\n\n".join(income_statement_dfs)
+    messages = build_statement_messages(
+        income_statement_dfs, PRE_TAX_INCOME_INSTRUCTIONS, unit_scale, year_ended, ("Operating income", operating_income)
     )
 
-    # Initialize the Azure OpenAI Service
     openai_service = AzureOpenAIService()
-
-    # Query the chatbot for the pre-tax income breakdown
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-    # print(response)
-    return response
+    return openai_service.query_messages(messages)
 
 def parse_pre_tax_income_table(response: str) -> pd.DataFrame:
     """
@@ -517,30 +573,7 @@ def parse_pre_tax_income_table(response: str) -> pd.DataFrame:
         ValueError: If the table cannot be parsed correctly.
     """
     try:
-        # Extract the table portion from the response
-        table_start = response.find("| Item")
-        table_end = response.rfind("|")
-        if table_start == -1 or table_end == -1:
-            raise ValueError("Table format not found in the response.")
-
-        table_text = response[table_start:table_end + 1]
-
-        # Use regex to parse table rows
-        rows = re.findall(r"\| (.+?)\s+\| ([\d,().—-]+)\s+\|", table_text)
-
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=["Item", "Value"])
-
-        # Clean and format 'Value' column
-        df["Value"] = (
-            df["Value"]
-            .str.replace(",", "")  # Remove commas
-            .str.replace(r"\(([\d.]+)\)", r"-\1", regex=True)  # Convert parentheses to negatives
-            .str.replace("—", "0")  # Replace dashes with 0
-            .astype(float)
-        )
-
-        return df
+        return parse_statement_table(response, "Item", "Value")
     except Exception as e:
         raise ValueError(f"Failed to parse pre-tax income table: {e}")
     
@@ -571,6 +604,22 @@ def calculate_pre_tax_income(df: pd.DataFrame) -> float:
     except Exception as e:
         raise ValueError(f"Failed to calculate pre-tax income: {e}")
     
+NET_INCOME_INSTRUCTIONS = (
+    "Provide the detailed breakdown of how the pre-tax income given below transitions to net income "
+    "for the fiscal year given below. "
+    "The first row should be 'Pre-Tax Income', followed by specific items contributing to the calculation "
+    "of net income, ending with the 'Net Income' as the last row. "
+    "Ensure that all rows above 'Net Income' sum to exactly match the 'Net Income' value. "
+    "The table should be formatted as follows:\n\n"
+    "| Item                  | Value         |\n"
+    "|-----------------------|---------------|\n"
+    "| Pre-Tax Income        | 1,700,000     |\n"
+    "| Income Tax Expense    | (500,000)     |\n"
+    "| Net Income            | 1,200,000     |\n\n"
+    "1,700,000 - 500,000 = 1,200,000\n\n"
+    "Please follow this example format exactly."
+)
+
 def get_net_income(
     pre_tax_income: float,
     income_statement_dfs: List[str],
@@ -590,43 +639,12 @@ def get_net_income(
     Returns:
         str: The chatbot's response containing the breakdown of pre-tax income to net income in table format.
     """
-    # Define the system prompt
-    system_prompt = (
-        f"Based on the provided tables related to the income statement, "
-        f"please provide the detailed breakdown of how the pre-tax income transitions to net income "
-        f"for the year ended {year_ended}. "
-        "Use the unit scale '{unit_scale}' for all values in your response!. "
-        "If values are negative make sure to format them with parentheses (e.g., (500,000)). "
-        f"The pre-tax income for the year is {pre_tax_income:,.2f} ({unit_scale}). "
-        "The output should follow professional accounting standards. "
-        "Do not include 'Less' or 'Add' in the item descriptions. "
-        "If any value is negative, format it with parentheses (e.g., (500,000)). "
-        "The first row should be 'Pre-Tax Income', followed by specific items contributing to the calculation "
-        "of net income, ending with the 'Net Income' as the last row. "
-        "Ensure that all rows above 'Net Income' sum to exactly match the 'Net Income' value. "
-        "The table should be formatted as follows:\n\n"
-        "| Item                  | Value         |\n"
-        "|-----------------------|---------------|\n"
-        "| Pre-Tax Income        | 1,700,000     |\n"
-        "| Income Tax Expense    | (500,000)     |\n"
-        "| Net Income            | 1,200,000     |\n\n"
-        "1,700,000 - 500,000 = 1,200,000\n\n"
-        "Please follow this example format exactly."
-    )
-
-    # Combine the income statement tables into the user prompt
-    user_prompt = (
-        "Provided tables:\n"
-        "\n\n".join(income_statement_dfs)
+    messages = build_statement_messages(
+        income_statement_dfs, NET_INCOME_INSTRUCTIONS, unit_scale, year_ended, ("Pre-tax income", pre_tax_income)
     )
 
-    # Initialize the Azure OpenAI Service
     openai_service = AzureOpenAIService()
-
-    # Query the chatbot for the net income breakdown
-    response = openai_service.query(system_prompt=system_prompt, user_prompt=user_prompt)
-
-    return response
+    return openai_service.query_messages(messages)
 
 def parse_net_income_table(response: str) -> pd.DataFrame:
     """
@@ -642,29 +660,7 @@ def parse_net_income_table(response: str) -> pd.DataFrame:
         ValueError: If the table cannot be parsed correctly.
     """
     try:
-        # Extract the table portion from the response
-        table_start = response.find("| Item")
-        table_end = response.rfind("|")
-        if table_start == -1 or table_end == -1:
-            raise ValueError("Table format not found in the response.")
-
-        table_text = response[table_start:table_end + 1]
-
-        # Use regex to parse table rows
-        rows = re.findall(r"\| (.+?)\s+\| ([\d,().-]+)\s+\|", table_text)
-
-        # Convert to DataFrame
-        df = pd.DataFrame(rows, columns=["Item", "Value"])
-
-        # Clean and format 'Value' column
-        df["Value"] = (
-            df["Value"]
-            .str.replace(",", "")  # Remove commas
-            .str.replace(r"\(([\d.]+)\)", r"-\1", regex=True)  # Convert parentheses to negatives
-            .astype(float)
-        )
-
-        return df
+        return parse_statement_table(response, "Item", "Value")
     except Exception as e:
         raise ValueError(f"Failed to parse net income table: {e}")
     
@@ -0,0 +1,268 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+
+from app.services.azure_services.openai_service import AzureOpenAIService
+from app.controllers.document_processing.utils.markdown_utils import parse_number
+from app.controllers.document_processing.utils.prompt_utils import build_tables_prompt
+
+# Sections of the income statement in order: (JSON key, subtotal key, subtotal row label)
+SECTIONS = [
+    ("revenue", "total_revenue", "Total Revenue"),
+    ("gross_profit", "gross_profit", "Gross Profit"),
+    ("operating_income", "operating_income", "Operating Income"),
+    ("pre_tax_income", "pre_tax_income", "Pre-Tax Income"),
+    ("net_income", "net_income", "Net Income"),
+]
+
+SECTION_DESCRIPTIONS = {
+    "revenue": "the revenue breakdown by segment; its items must sum to total_revenue",
+    "gross_profit": "the items between total revenue and gross profit (e.g. cost of goods sold, discounts); "
+                    "total_revenue plus these items must equal gross_profit",
+    "operating_income": "the items between gross profit and operating income (e.g. operating expenses); "
+                        "gross_profit plus these items must equal operating_income",
+    "pre_tax_income": "the items between operating income and pre-tax income (e.g. interest, other "
+                      "non-operating items); operating_income plus these items must equal pre_tax_income",
+    "net_income": "the items between pre-tax income and net income (e.g. income tax expense); "
+                  "pre_tax_income plus these items must equal net_income",
+}
+
+# Largest difference between a subtotal and the sum of its items accepted as rounding
+ABSOLUTE_TOLERANCE = 1.0
+RELATIVE_TOLERANCE = 0.001
+
+
+# Static instructions of every single-pass request. With the filing's tables they form the leading
+# system message shared by the full request and every section retry, so it can be served from the
+# prompt cache; the values of each request are placed last.
+SINGLE_PASS_SYSTEM_PROMPT = (
+    "You are a professional accountant extracting the income statement from the tables of a company's "
+    "10-K or 10-Q filing, and you output JSON. "
+    "Values are plain JSON numbers in the unit scale given in the request; amounts that reduce income "
+    "(costs, expenses, taxes, losses) are negative. "
+    "Do not include 'Less' or 'Add' in the item descriptions, and do not repeat subtotals as items. "
+    "The income statement has these sections:\n"
+    + "\n".join(f"- {key}: {SECTION_DESCRIPTIONS[key]}." for key, _, _ in SECTIONS)
+    + "\nCheck your arithmetic for every section."
+)
+
+
+def build_system_message(income_statement_dfs: List[str], year_ended: str) -> dict:
+    """
+    Builds the system message shared by every request for a filing: the static instructions followed by the tables.
+
+    Args:
+        income_statement_dfs (List[str]): List of income statement tables as strings.
+        year_ended (str): The fiscal year ended date, used to drop comparative columns.
+
+    Returns:
+        dict: The system message.
+    """
+    tables = build_tables_prompt(income_statement_dfs, "income_statement", year_ended)
+    return {"role": "system", "content": f"{SINGLE_PASS_SYSTEM_PROMPT}\n\nProvided tables:\n{tables}"}
+
+
+def build_income_statement_messages(income_statement_dfs: List[str], unit_scale: str, year_ended: str) -> List[dict]:
+    """
+    Builds the messages asking for the entire income statement as a single JSON object.
+
+    Args:
+        income_statement_dfs (List[str]): List of income statement tables as strings.
+        unit_scale (str): The unit scale for the values (e.g., 'Millions').
+        year_ended (str): The fiscal year ended date.
+
+    Returns:
+        List[dict]: The system and user messages.
+    """
+    schema = {
+        key: {"items": [{"item": "string", "value": "number"}], subtotal: "number"}
+        for key, subtotal, _ in SECTIONS
+    }
+    user_prompt = (
+        f"Extract all sections of the income statement. Return a JSON object with this structure:\n{json.dumps(schema)}\n\n"
+        f"Year ended: {year_ended}\nUnit scale: {unit_scale}"
+    )
+    return [build_system_message(income_statement_dfs, year_ended), {"role": "user", "content": user_prompt}]
+
+
+def build_section_messages(
+    section: str,
+    previous_subtotal: Optional[float],
+    error: str,
+    income_statement_dfs: List[str],
+    unit_scale: str,
+    year_ended: str
+) -> List[dict]:
+    """
+    Builds the messages re-requesting a single section whose arithmetic did not verify.
+
+    Args:
+        section (str): The section key, e.g. 'operating_income'.
+        previous_subtotal (Optional[float]): The verified subtotal the section starts from, if any.
+        error (str): Description of the failed check.
+        income_statement_dfs (List[str]): List of income statement tables as strings.
+        unit_scale (str): The unit scale for the values.
+        year_ended (str): The fiscal year ended date.
+
+    Returns:
+        List[dict]: The system and user messages.
+    """
+    key, subtotal, _ = next(s for s in SECTIONS if s[0] == section)
+    values = [f"Year ended: {year_ended}", f"Unit scale: {unit_scale}"]
+    if previous_subtotal is not None:
+        values.append(f"Previous subtotal: {previous_subtotal:,.2f} ({unit_scale})")
+    user_prompt = (
+        f"Extract only the {key} section: {SECTION_DESCRIPTIONS[key]}. "
+        f'Return a JSON object: {{"items": [{{"item": "string", "value": "number"}}], "{subtotal}": "number"}}\n\n'
+        f"A previous answer failed this check: {error}\n" + "\n".join(values)
+    )
+    return [build_system_message(income_statement_dfs, year_ended), {"role": "user", "content": user_prompt}]
+
+
+def parse_section(data: Any, subtotal: str) -> Tuple[List[Tuple[str, float]], float]:
+    """
+    Reads the items and subtotal of a section from the JSON response.
+
+    Args:
+        data (Any): The section object.
+        subtotal (str): The subtotal key of the section.
+
+    Returns:
+        Tuple[List[Tuple[str, float]], float]: The (item, value) pairs and the subtotal.
+
+    Raises:
+        ValueError: If the section is missing or its values are not numbers.
+    """
+    if not isinstance(data, dict) or subtotal not in data:
+        raise ValueError(f"Section is missing or has no '{subtotal}' value.")
+
+    items = []
+    for entry in data.get("items") or []:
+        if not isinstance(entry, dict):
+            raise ValueError(f"Invalid item: {entry!r}")
+        value = parse_number(entry.get("value"))
+        if value != value:
+            raise ValueError(f"Item {entry.get('item')!r} has a non-numeric value {entry.get('value')!r}.")
+        items.append((str(entry.get("item", "")).strip(), value))
+
+    total = parse_number(data[subtotal])
+    if total != total:
+        raise ValueError(f"'{subtotal}' is not a number: {data[subtotal]!r}.")
+    return items, total
+
+
+def verify_section(
+    items: List[Tuple[str, float]],
+    total: float,
+    previous_subtotal: Optional[float],
+    label: str
+) -> None:
+    """
+    Verifies that a section's items, starting from the previous subtotal, add up to its subtotal.
+    A revenue section with no items, only a total, is accepted as is.
+
+    Args:
+        items (List[Tuple[str, float]]): The (item, value) pairs of the section.
+        total (float): The section's subtotal.
+        previous_subtotal (Optional[float]): The preceding subtotal; None for the revenue section.
+        label (str): The subtotal's row label, used in the error message.
+
+    Raises:
+        ValueError: If the arithmetic does not hold within rounding tolerance.
+    """
+    if previous_subtotal is None and not items:
+        # Revenue reported as a single total row has nothing to sum
+        return
+    expected = (previous_subtotal or 0.0) + sum(value for _, value in items)
+    if abs(expected - total) > max(ABSOLUTE_TOLERANCE, RELATIVE_TOLERANCE * abs(total)):
+        start = f"{previous_subtotal:,.2f} plus " if previous_subtotal is not None else ""
+        raise ValueError(f"{start}the items sum to {expected:,.2f}, but {label} is {total:,.2f}.")
+
+
+def section_to_dataframe(
+    items: List[Tuple[str, float]],
+    total: float,
+    previous_subtotal: Optional[float],
+    previous_label: Optional[str],
+    label: str
+) -> pd.DataFrame:
+    """
+    Builds the DataFrame of a section in the layout produced by the sequential engine.
+
+    Args:
+        items (List[Tuple[str, float]]): The (item, value) pairs of the section.
+        total (float): The section's subtotal.
+        previous_subtotal (Optional[float]): The preceding subtotal; None for the revenue section.
+        previous_label (Optional[str]): The preceding subtotal's row label.
+        label (str): The subtotal's row label.
+
+    Returns:
+        pd.DataFrame: Columns 'Segment'/'Revenue' for the revenue section, 'Item'/'Value' otherwise,
+        starting with the previous subtotal and ending with the section's subtotal.
+    """
+    rows = ([(previous_label, previous_subtotal)] if previous_subtotal is not None else []) + items + [(label, total)]
+    columns = ["Item", "Value"] if previous_subtotal is not None else ["Segment", "Revenue"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def generate_income_statement_single_pass(
+    income_statement_dfs: List[str],
+    unit_scale: str,
+    year_ended: str,
+    openai_service: Optional[AzureOpenAIService] = None,
+    max_section_retries: int = 2
+) -> Tuple[List[pd.DataFrame], List[float]]:
+    """
+    Generates the income statement from a single JSON response instead of five sequential queries.
+
+    Every subtotal is verified locally against its items and the preceding subtotal. Only a section
+    that fails its check is re-requested, up to `max_section_retries` times, before the sections
+    after it are verified against its corrected subtotal.
+
+    Args:
+        income_statement_dfs (List[str]): List of income statement tables as strings.
+        unit_scale (str): The unit scale for the values (e.g., 'Millions').
+        year_ended (str): The fiscal year ended date.
+        openai_service (AzureOpenAIService, optional): The service to query. Defaults to a new instance.
+        max_section_retries (int): Maximum re-requests per failing section. Defaults to 2.
+
+    Returns:
+        Tuple[List[pd.DataFrame], List[float]]: The same (dataframes, amounts) as `generate_income_statement`:
+        revenue, gross profit, operating income, pre-tax income and net income.
+
+    Raises:
+        ValueError: If a section still fails verification after its retries.
+    """
+    openai_service = openai_service or AzureOpenAIService()
+    messages = build_income_statement_messages(income_statement_dfs, unit_scale, year_ended)
+    try:
+        statement: Dict[str, Any] = json.loads(openai_service.query_messages(messages, response_format="json_object"))
+    except json.JSONDecodeError:
+        statement = {}
+
+    dataframes, amounts = [], []
+    previous_subtotal, previous_label = None, None
+    for key, subtotal, label in SECTIONS:
+        data = statement.get(key) if isinstance(statement, dict) else None
+        for attempt in range(max_section_retries + 1):
+            try:
+                items, total = parse_section(data, subtotal)
+                verify_section(items, total, previous_subtotal, label)
+                break
+            except ValueError as e:
+                if attempt == max_section_retries:
+                    raise ValueError(f"Failed to extract {label}: {e}")
+                print(f"Section {key} failed verification ({e}). Re-requesting the section...")
+                section_messages = build_section_messages(
+                    key, previous_subtotal, str(e), income_statement_dfs, unit_scale, year_ended
+                )
+                try:
+                    data = json.loads(openai_service.query_messages(section_messages, response_format="json_object"))
+                except json.JSONDecodeError:
+                    data = None
+
+        dataframes.append(section_to_dataframe(items, total, previous_subtotal, previous_label, label))
+        amounts.append(total)
+        previous_subtotal, previous_label = total, label
+
+    return dataframes, amounts
@@ -0,0 +1,263 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Sessions kept in memory; the least recently used are dropped first (and reloaded from SQLite, if any)
+MAX_SESSIONS = 1000
+# Tokens of conversation a session may hold; the oldest turns are dropped beyond it
+SESSION_TOKEN_LIMIT = 2000
+# Share of the token limit from which the older turns of a session are summarized
+SUMMARY_THRESHOLD_RATIO = 0.75
+# Most recent turns kept verbatim when a session is summarized
+RECENT_TURNS = 2
+# Seconds of inactivity after which a session is evicted
+SESSION_IDLE_SECONDS = 1800.0
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+# Summarizes a conversation: (previous summary, messages to fold in) -> new summary
+Summarizer = Callable[[str, List[dict]], str]
+
+
+class Session:
+    """
+    The conversation of a session: a summary of its older turns and its recent messages.
+    """
+
+    def __init__(
+        self,
+        summary: str = "",
+        messages: Optional[List[dict]] = None,
+        last_access: Optional[float] = None
+    ) -> None:
+        self.summary = summary
+        self.messages = messages or []
+        self.last_access = last_access if last_access is not None else time.time()
+
+    def tokens(self) -> int:
+        """
+        Returns the tokens of the session's summary and messages.
+        """
+        return count_tokens(self.summary) + sum(count_tokens(message["content"]) for message in self.messages)
+
+    def prompt_messages(self) -> List[dict]:
+        """
+        Returns the conversation as chat messages: the summary as a system message, then the recent messages.
+        """
+        summary = [{"role": "system", "content": SUMMARY_PREFIX + self.summary}] if self.summary else []
+        return summary + [dict(message) for message in self.messages]
+
+
+class SessionStore:
+    """
+    Conversation memory keyed by session id, bounded in sessions and in tokens per session.
+
+    Without a database, sessions live in an in-memory LRU. With a SQLite database, the database is
+    the source of truth: every access reloads the session from it inside an immediate transaction,
+    so that workers sharing the database see and extend each other's turns instead of overwriting them.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        summarizer: Optional[Summarizer] = None,
+        max_sessions: int = MAX_SESSIONS,
+        token_limit: int = SESSION_TOKEN_LIMIT,
+        summary_threshold: Optional[int] = None,
+        idle_seconds: float = SESSION_IDLE_SECONDS
+    ) -> None:
+        """
+        Initializes the store.
+
+        Args:
+            db_path (str, optional): The SQLite database persisting the sessions. Defaults to memory only.
+            summarizer (Summarizer, optional): Folds older turns into the session summary. Without it,
+                older turns are dropped instead.
+            max_sessions (int): Sessions kept in memory. Defaults to MAX_SESSIONS.
+            token_limit (int): Tokens a session may hold. Defaults to SESSION_TOKEN_LIMIT.
+            summary_threshold (int, optional): Tokens from which older turns are summarized. Defaults to
+                SUMMARY_THRESHOLD_RATIO of the token limit.
+            idle_seconds (float): Inactivity after which a session is evicted. Defaults to SESSION_IDLE_SECONDS.
+        """
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.token_limit = token_limit
+        self.summary_threshold = summary_threshold if summary_threshold is not None else \
+            int(token_limit * SUMMARY_THRESHOLD_RATIO)
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            # Autocommit mode: transactions are opened explicitly by `_transaction`
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(session_id TEXT PRIMARY KEY, summary TEXT, messages TEXT, last_access REAL)"
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """
+        Holds the lock and, with a database, an immediate transaction, so that a read-modify-write
+        of a session is atomic across threads and workers.
+        """
+        with self._lock:
+            if self._db is None:
+                yield
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _evict_idle(self, now: float) -> None:
+        """
+        Evicts the sessions idle for longer than `idle_seconds`. Must be in a transaction.
+        """
+        cutoff = now - self.idle_seconds
+        for session_id in [key for key, session in self._sessions.items() if session.last_access < cutoff]:
+            del self._sessions[session_id]
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,))
+
+    def _get(self, session_id: str, create: bool) -> Optional[Session]:
+        """
+        Returns a session, reloaded from the database if any, marking it as the most recently used.
+        Must be in a transaction.
+        """
+        now = time.time()
+        self._evict_idle(now)
+
+        if self._db is None:
+            session = self._sessions.get(session_id)
+        else:
+            # The in-memory copy may be stale if another worker added turns meanwhile
+            row = self._db.execute(
+                "SELECT summary, messages, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            session = Session(row[0], json.loads(row[1]), row[2]) if row is not None else None
+            if session is None:
+                self._sessions.pop(session_id, None)
+        if session is None:
+            if not create:
+                return None
+            session = Session()
+
+        session.last_access = now
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def _save(self, session_id: str, session: Session) -> None:
+        """
+        Persists a session to the database, if any. Must be in the transaction that loaded it.
+        """
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, summary, messages, last_access) VALUES (?, ?, ?, ?)",
+            (session_id, session.summary, json.dumps(session.messages), session.last_access)
+        )
+
+    def get_messages(self, session_id: str) -> List[dict]:
+        """
+        Returns the conversation of a session as chat messages to send before a new query.
+
+        Args:
+            session_id (str): The session id.
+
+        Returns:
+            List[dict]: The summary of the older turns as a system message, then the recent messages;
+            empty for a new or evicted session.
+        """
+        with self._transaction():
+            session = self._get(session_id, create=False)
+            if session is not None:
+                self._save(session_id, session)
+            return session.prompt_messages() if session is not None else []
+
+    def append_turn(self, session_id: str, user_message: str, assistant_message: str) -> None:
+        """
+        Adds a turn to a session, summarizing its older turns once it passes `summary_threshold`
+        tokens and dropping the oldest turns beyond `token_limit` tokens.
+
+        Args:
+            session_id (str): The session id.
+            user_message (str): The user's message.
+            assistant_message (str): The assistant's answer.
+        """
+        with self._transaction():
+            session = self._get(session_id, create=True)
+            session.messages += [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": assistant_message}
+            ]
+            older = session.messages[:-2 * RECENT_TURNS]
+            summary = session.summary
+            summarize = self.summarizer is not None and older and session.tokens() > self.summary_threshold
+            if not summarize:
+                self._trim(session)
+                self._save(session_id, session)
+                return
+
+        # Summarize outside the lock so other sessions are not held up by the LLM call
+        try:
+            new_summary = self.summarizer(summary, older)
+        except Exception as e:
+            logger.warning(f"Could not summarize session {session_id}: {e}")
+            new_summary = None
+
+        with self._transaction():
+            session = self._get(session_id, create=True)
+            # Fold the turns in unless the session changed meanwhile
+            if new_summary and session.summary == summary and session.messages[:len(older)] == older:
+                session.summary = new_summary
+                session.messages = session.messages[len(older):]
+                logger.info(f"Summarized {len(older) // 2} turns of session {session_id}.")
+            self._trim(session)
+            self._save(session_id, session)
+
+    def _trim(self, session: Session) -> None:
+        """
+        Drops the oldest turns of a session until it fits `token_limit`, keeping at least the last turn.
+        """
+        while len(session.messages) > 2 and session.tokens() > self.token_limit:
+            session.messages = session.messages[2:]
+
+    def clear(self, session_id: str) -> None:
+        """
+        Deletes a session.
+
+        Args:
+            session_id (str): The session id.
+        """
+        with self._transaction():
+            self._sessions.pop(session_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of sessions in memory and their total tokens.
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "tokens": sum(session.tokens() for session in self._sessions.values())
+            }
@@ -1,7 +1,10 @@
+import json
 import logging
-from flask import Blueprint, jsonify, request
+import time
+from typing import Any, Dict, Optional
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from werkzeug.exceptions import BadRequest
-from app.controllers.azure_controllers.rag_controller import RAGController
+from app.controllers.azure_controllers.rag_controller import RAGController, build_search_filter
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -12,6 +15,59 @@ chatbot_blueprint = Blueprint("chatbot", __name__, url_prefix="/api/chatbot")
 # Initialize the RAG Controller
 rag_controller = RAGController()
 
+# Maximum queries of a batch request
+MAX_BATCH_QUERIES = 50
+
+def format_sse_event(event: str, data: Dict[str, Any]) -> str:
+    """
+    Formats an event for a Server-Sent Events stream.
+
+    Args:
+        event (str): The event name.
+        data (Dict[str, Any]): The event data, sent as JSON.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def parse_search_filter(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Validates the optional search filters of a RAG request and builds their OData filter.
+
+    Args:
+        data (Dict[str, Any]): The request JSON, with optional 'company_name' (string or list of
+            strings), 'fiscal_year' (string, integer or list of these), 'blob_names' (list of strings)
+            and 'is_table' (bool).
+
+    Returns:
+        Optional[str]: The OData filter, or None if no filter is given.
+
+    Raises:
+        BadRequest: If a filter has the wrong type.
+    """
+    def is_list_of(value: Any, types: tuple) -> bool:
+        return isinstance(value, list) and all(isinstance(item, types) and not isinstance(item, bool) for item in value)
+
+    company_name = data.get("company_name")
+    if company_name is not None and not (isinstance(company_name, str) or is_list_of(company_name, (str,))):
+        raise BadRequest("'company_name' must be a string or a list of strings.")
+
+    fiscal_year = data.get("fiscal_year")
+    is_year = isinstance(fiscal_year, (str, int)) and not isinstance(fiscal_year, bool)
+    if fiscal_year is not None and not (is_year or is_list_of(fiscal_year, (str, int))):
+        raise BadRequest("'fiscal_year' must be a string, an integer or a list of these.")
+
+    blob_names = data.get("blob_names")
+    if blob_names is not None and not is_list_of(blob_names, (str,)):
+        raise BadRequest("'blob_names' must be a list of strings.")
+
+    is_table = data.get("is_table")
+    if is_table is not None and not isinstance(is_table, bool):
+        raise BadRequest("'is_table' must be a boolean.")
+
+    return build_search_filter(company_name, fiscal_year, blob_names, is_table)
+
 @chatbot_blueprint.route("/rag_query", methods=["POST"])
 def rag_query():
     """
@@ -21,9 +77,16 @@ def rag_query():
         - 'query' in the request JSON (string): The user's query.
         - Optional 'top' (int): The number of documents to retrieve.
         - Optional 'semantic_config' (string): The semantic configuration name.
+        - Optional 'stream' (bool): Stream the answer as Server-Sent Events: a 'retrieval' event with
+          the sources, 'token' events as the answer is generated, and a final 'done' or 'error' event.
+        - Optional 'company_name', 'fiscal_year', 'blob_names' and 'is_table': Search only the matching
+          segments (see `parse_search_filter`).
+        - Optional 'token_budget' (int): Maximum tokens of retrieved context in the prompt.
+        - Optional 'session_id' (string): The conversation the query belongs to; its earlier turns are
+          sent with the query.
 
     Returns:
-        JSON response with the generated answer.
+        JSON response with the generated answer, or a text/event-stream response when streaming.
     """
     try:
         # Parse request JSON
@@ -35,11 +98,43 @@ def rag_query():
         top = data.get("top", 5)  # Default to 3 documents
         semantic_config = data.get("semantic_config", "test")  # Default semantic config
 
+        stream = data.get("stream", False)
+        if not isinstance(stream, bool):
+            raise BadRequest("'stream' must be a boolean.")
+
+        search_filter = parse_search_filter(data)
+
+        token_budget = data.get("token_budget")
+        is_positive_int = isinstance(token_budget, int) and not isinstance(token_budget, bool) and token_budget > 0
+        if token_budget is not None and not is_positive_int:
+            raise BadRequest("'token_budget' must be a positive integer.")
+
+        session_id = data.get("session_id")
+        if session_id is not None and (not isinstance(session_id, str) or not session_id):
+            raise BadRequest("'session_id' must be a non-empty string.")
+
         # Log incoming request
-        logger.info(f"Received RAG query: {user_query}, top={top}, semantic_config={semantic_config}")
+        logger.info(
+            f"Received RAG query: {user_query}, top={top}, semantic_config={semantic_config}, "
+            f"filter={search_filter}, token_budget={token_budget}, session_id={session_id}, stream={stream}"
+        )
+
+        if stream:
+            events = rag_controller.execute_rag_flow_stream(
+                user_query, top=top, semantic_config=semantic_config,
+                search_filter=search_filter, token_budget=token_budget, session_id=session_id
+            )
+            return Response(
+                stream_with_context(format_sse_event(event, event_data) for event, event_data in events),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
 
         # Execute the RAG flow using the controller
-        response = rag_controller.execute_rag_flow(user_query, top=top, semantic_config=semantic_config)
+        response = rag_controller.execute_rag_flow(
+            user_query, top=top, semantic_config=semantic_config,
+            search_filter=search_filter, token_budget=token_budget, session_id=session_id
+        )
 
         # Return the response
         return jsonify({"answer": response}), 200
@@ -51,3 +146,78 @@ def rag_query():
     except Exception as e:
         logger.error(f"Unexpected error occurred: {str(e)}")
         return jsonify({"error": "An unexpected error occurred.", "details": str(e)}), 500
+
+@chatbot_blueprint.route("/rag_batch", methods=["POST"])
+def rag_batch():
+    """
+    Endpoint to answer a batch of RAG queries, e.g. a checklist of questions against the same filings.
+
+    Expects:
+        - 'queries' in the request JSON (list of strings): The user's queries, at most MAX_BATCH_QUERIES.
+        - Optional 'top' (int): The number of documents to retrieve per query.
+        - Optional 'semantic_config' (string): The semantic configuration name.
+        - Optional 'grouped' (bool): Answer groups of queries with overlapping sources in shared prompts
+          instead of one completion per query.
+        - Optional 'company_name', 'fiscal_year', 'blob_names', 'is_table' and 'token_budget', as for
+          '/rag_query'.
+
+    Returns:
+        JSON response with the query, answer, sources and latency of each query in order, and the total time.
+    """
+    try:
+        start = time.perf_counter()
+        data = request.get_json()
+        if not data or "queries" not in data:
+            raise BadRequest("Request must include a 'queries' field in the JSON body.")
+
+        queries = data["queries"]
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(query, str) and query for query in queries):
+            raise BadRequest("'queries' must be a non-empty list of non-empty strings.")
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise BadRequest(f"'queries' must hold at most {MAX_BATCH_QUERIES} queries.")
+
+        top = data.get("top", 5)
+        semantic_config = data.get("semantic_config", "test")
+
+        grouped = data.get("grouped", False)
+        if not isinstance(grouped, bool):
+            raise BadRequest("'grouped' must be a boolean.")
+
+        search_filter = parse_search_filter(data)
+
+        token_budget = data.get("token_budget")
+        is_positive_int = isinstance(token_budget, int) and not isinstance(token_budget, bool) and token_budget > 0
+        if token_budget is not None and not is_positive_int:
+            raise BadRequest("'token_budget' must be a positive integer.")
+
+        logger.info(
+            f"Received RAG batch of {len(queries)} queries, top={top}, semantic_config={semantic_config}, "
+            f"filter={search_filter}, grouped={grouped}"
+        )
+
+        results = rag_controller.execute_rag_batch(
+            queries, top=top, semantic_config=semantic_config, search_filter=search_filter,
+            token_budget=token_budget, grouped=grouped
+        )
+        return jsonify({"results": results, "total_time": time.perf_counter() - start}), 200
+
+    except BadRequest as e:
+        logger.error(f"Bad request: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+    except Exception as e:
+        logger.error(f"Unexpected error occurred: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred.", "details": str(e)}), 500
+
+@chatbot_blueprint.route("/sessions/<session_id>", methods=["DELETE"])
+def clear_session(session_id: str):
+    """
+    Endpoint to delete the conversation memory of a session.
+
+    Returns:
+        JSON response confirming the deletion.
+    """
+    rag_controller.sessions.clear(session_id)
+    logger.info(f"Cleared session {session_id}.")
+    return jsonify({"message": f"Session '{session_id}' cleared."}), 200
@@ -3,6 +3,7 @@ from flask import Blueprint, jsonify, request
 from werkzeug.exceptions import BadRequest
 from typing import List
 from app.controllers.document_processing.document_processing import process_documents
+from app.services.azure_services import usage_tracker
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -17,9 +18,14 @@ def process_blobs():
 
     Expects:
         - JSON body with a 'blob_names' key containing a list of blob names.
+        - Optional 'stream' (bool): Index and classify each document while it is being structured.
+        - Optional 'target_pages' (bool): Analyze only the pages likely to hold the financial statements.
+        - Optional 'single_pass' (bool): Extract each income statement from one verified JSON response.
+        - Optional 'hedged' (bool): Send the metadata queries of increasing context concurrently.
 
     Returns:
-        JSON response with the SAS URL of the processed file.
+        JSON response with the SAS URL of the processed file, the run id and the Azure OpenAI usage
+        of each stage (see `get_run_usage`).
     """
     try:
         # Parse request JSON
@@ -31,14 +37,37 @@ def process_blobs():
         if not isinstance(blob_names, list) or not all(isinstance(name, str) for name in blob_names):
             raise BadRequest("'blob_names' must be a list of strings.")
 
+        stream = data.get("stream", False)
+        if not isinstance(stream, bool):
+            raise BadRequest("'stream' must be a boolean.")
+
+        target_pages = data.get("target_pages", False)
+        if not isinstance(target_pages, bool):
+            raise BadRequest("'target_pages' must be a boolean.")
+
+        single_pass = data.get("single_pass", False)
+        if not isinstance(single_pass, bool):
+            raise BadRequest("'single_pass' must be a boolean.")
+
+        hedged = data.get("hedged", False)
+        if not isinstance(hedged, bool):
+            raise BadRequest("'hedged' must be a boolean.")
+
         # Log received blob names
-        logger.info(f"Received blob names for processing: {blob_names}")
+        logger.info(
+            f"Received blob names for processing: {blob_names}, stream={stream}, "
+            f"target_pages={target_pages}, single_pass={single_pass}, hedged={hedged}"
+        )
 
         # Process documents and get the SAS URL
-        sas_url = process_documents(blob_names)
+        run_id = usage_tracker.new_run_id()
+        sas_url = process_documents(
+            blob_names, stream=stream, target_pages=target_pages, single_pass=single_pass, hedged=hedged,
+            run_id=run_id
+        )
 
-        # Return the SAS URL in the response
-        return jsonify({"sas_url": sas_url}), 200
+        # Return the SAS URL in the response, with the usage of the run
+        return jsonify({"sas_url": sas_url, "run_id": run_id, "usage": usage_tracker.get_run_usage(run_id)}), 200
 
     except BadRequest as e:
         logger.error(f"BadRequest: {e}")
@@ -47,3 +76,22 @@ def process_blobs():
     except Exception as e:
         logger.exception("An error occurred while processing documents.")
         return jsonify({"error": "An internal server error occurred.", "details": str(e)}), 500
+
+@document_processing_blueprint.route("/usage/<run_id>", methods=["GET"])
+def get_run_usage(run_id: str):
+    """
+    Endpoint to report the Azure OpenAI usage of a processing run.
+
+    Expects:
+        - Optional 'blob_name' query parameter: Report only this filing.
+
+    Returns:
+        JSON response with the requests, tokens, latency, retries, wall time and estimated cost of
+        each stage, per filing and in total.
+    """
+    blob_name = request.args.get("blob_name")
+    usage = usage_tracker.get_run_usage(run_id, filing=blob_name)
+    if usage is None:
+        target = f"filing '{blob_name}' of run '{run_id}'" if blob_name else f"run '{run_id}'"
+        return jsonify({"error": f"No usage recorded for {target}."}), 404
+    return jsonify(usage), 200
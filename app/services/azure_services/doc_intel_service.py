@@ -1,4 +1,5 @@
 import logging
+from typing import Optional
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, AnalyzeResult
@@ -30,38 +31,45 @@ class AzureDocIntelService:
         )
         logger.info(f"AzureDocIntelService initialized with model ID '{self.model_id}'.")
 
-    def analyze_document_from_url(self, document_url: str) -> dict:
+    def analyze_document_from_url(self, document_url: str, pages: Optional[str] = None) -> dict:
         """
         Analyzes a document from a URL using the specified model.
 
         Args:
             document_url (str): The URL of the document to analyze.
+            pages (Optional[str]): 1-based page ranges to analyze, e.g. '1-3,5'. Defaults to all pages.
 
         Returns:
             LROPoller: A poller to track the analysis operation.
         """
         poller: LROPoller = self.client.begin_analyze_document(
             model_id=self.model_id,
-            analyze_request=AnalyzeDocumentRequest(url_source=document_url)
+            analyze_request=AnalyzeDocumentRequest(url_source=document_url),
+            pages=pages
+        )
+        logger.info(
+            f"Started analysis for document at URL '{document_url}' with model ID '{self.model_id}'"
+            f" (pages: {pages or 'all'})."
         )
-        logger.info(f"Started analysis for document at URL '{document_url}' with model ID '{self.model_id}'.")
         result: AnalyzeResult = poller.result()
         return result.as_dict()
 
-    def analyze_document_from_binary(self, document_bytes: bytes) -> dict:
+    def analyze_document_from_binary(self, document_bytes: bytes, pages: Optional[str] = None) -> dict:
         """
         Analyzes a document from binary data using the specified model.
 
         Args:
             document_bytes (bytes): The binary content of the document to analyze.
+            pages (Optional[str]): 1-based page ranges to analyze, e.g. '1-3,5'. Defaults to all pages.
 
         Returns:
             LROPoller: A poller to track the analysis operation.
         """
         poller: LROPoller = self.client.begin_analyze_document(
             model_id=self.model_id,
-            analyze_request=AnalyzeDocumentRequest(bytes_source=document_bytes)
+            analyze_request=AnalyzeDocumentRequest(bytes_source=document_bytes),
+            pages=pages
         )
-        logger.info(f"Started analysis for binary document with model ID '{self.model_id}'.")
+        logger.info(f"Started analysis for binary document with model ID '{self.model_id}' (pages: {pages or 'all'}).")
         result: AnalyzeResult = poller.result()
         return result.as_dict()
\ No newline at end of file
@@ -0,0 +1,352 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+from openai import AzureOpenAI
+from app.config import Config
+from app.services.azure_services import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest request in the latency and error rate moving averages
+EWMA_ALPHA = 0.3
+# Seconds an endpoint is left out of rotation after a throttled or failed request, unless the
+# service asks for longer with a Retry-After header
+EJECTION_SECONDS = 30.0
+# Remaining requests or tokens under which an endpoint is considered close to its quota
+LOW_QUOTA_REQUESTS = 5
+LOW_QUOTA_TOKENS = 5000
+# Score multipliers for an endpoint close to its quota, and per unit of recent error rate
+LOW_QUOTA_PENALTY = 4.0
+ERROR_RATE_PENALTY = 10.0
+
+# Errors retried on another endpoint: throttling (429), server errors (5xx), connection errors and timeouts
+FAILOVER_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+def _header_number(headers: Any, name: str) -> Optional[float]:
+    """
+    Reads a numeric response header, returning None when it is missing or malformed.
+    """
+    try:
+        value = headers.get(name) if headers is not None else None
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenAIEndpoint:
+    """
+    An Azure OpenAI endpoint in a router's pool, with its deployment of each model it serves and
+    its live health statistics.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        deployments: Optional[Dict[str, str]] = None,
+        api_version: Optional[str] = None,
+        max_retries: int = 2,
+        client: Optional[Any] = None
+    ) -> None:
+        """
+        Initializes the endpoint and its client.
+
+        Args:
+            endpoint (str): The Azure OpenAI endpoint URL.
+            api_key (str): The endpoint's API key.
+            deployments (Dict[str, str], optional): The deployment of each model served by the endpoint,
+                e.g. {"gpt-4o": "gpt-4o-east"}. The endpoint then only serves these models. Defaults to
+                serving every model from a deployment named after it.
+            api_version (str, optional): The API version. Defaults to AZURE_OPENAI_API_VERSION.
+            max_retries (int): Retries made by the client itself before the router fails over. Defaults to 2.
+            client (Any, optional): A preconfigured client. Defaults to a new AzureOpenAI client.
+        """
+        self.endpoint = endpoint
+        self.deployments = deployments
+        self.client = client or AzureOpenAI(
+            api_key=api_key,
+            api_version=api_version or Config.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=endpoint,
+            max_retries=max_retries
+        )
+        self.latency: Optional[float] = None  # EWMA of the seconds to the response headers
+        self.error_rate = 0.0  # EWMA of failed requests
+        self.remaining_requests: Optional[float] = None
+        self.remaining_tokens: Optional[float] = None
+        self.ejected_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.requests_by_deployment: Dict[str, int] = {}
+
+    def deployment_for(self, model: Optional[str]) -> Optional[str]:
+        """
+        The deployment serving a model on this endpoint, or None if the endpoint does not serve it.
+        """
+        if self.deployments is None or model is None:
+            return model
+        return self.deployments.get(model)
+
+    def is_available(self, now: float) -> bool:
+        """
+        Whether the endpoint is in rotation, i.e. not ejected.
+        """
+        return now >= self.ejected_until
+
+    def score(self) -> float:
+        """
+        The expected cost of sending a request to the endpoint; lower is better.
+
+        Returns:
+            float: The latency average, raised by the recent error rate, a low remaining quota and
+            the requests already in flight. Endpoints without a latency sample score 0 so that they
+            are tried first.
+        """
+        if self.latency is None:
+            return 0.0
+        score = self.latency * (1 + ERROR_RATE_PENALTY * self.error_rate) * (1 + self.in_flight)
+        if (self.remaining_requests is not None and self.remaining_requests < LOW_QUOTA_REQUESTS) or \
+                (self.remaining_tokens is not None and self.remaining_tokens < LOW_QUOTA_TOKENS):
+            score *= LOW_QUOTA_PENALTY
+        return score
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the endpoint's health statistics.
+        """
+        return {
+            "endpoint": self.endpoint,
+            "deployments": self.deployments,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+            "ejected": not self.is_available(time.monotonic()),
+            "requests": self.requests,
+            "failures": self.failures,
+            "requests_by_deployment": dict(self.requests_by_deployment)
+        }
+
+
+class OpenAIRouter:
+    """
+    Routes chat completions across a pool of Azure OpenAI endpoints: each request goes to the
+    healthiest endpoint, and throttled or failing requests fail over to the next one.
+    """
+
+    def __init__(self, endpoints: List[OpenAIEndpoint], ejection_seconds: float = EJECTION_SECONDS) -> None:
+        """
+        Initializes the router.
+
+        Args:
+            endpoints (List[OpenAIEndpoint]): The endpoint pool.
+            ejection_seconds (float): Seconds a failing endpoint is left out of rotation. Defaults to EJECTION_SECONDS.
+        """
+        if not endpoints:
+            raise ValueError("The router needs at least one endpoint.")
+        self.endpoints = endpoints
+        self.ejection_seconds = ejection_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "OpenAIRouter":
+        """
+        Builds a router from AZURE_OPENAI_ENDPOINTS, a JSON list of objects with an 'endpoint', an
+        'api_key' and optionally 'deployments', mapping each model served to its deployment on the
+        endpoint, and an 'api_version'. Falls back to the single AZURE_OPENAI_ENDPOINT when it is not set.
+
+        Returns:
+            OpenAIRouter: The router.
+
+        Raises:
+            ValueError: If an entry still uses the former single 'deployment' key.
+        """
+        pool = json.loads(Config.AZURE_OPENAI_ENDPOINTS) if Config.AZURE_OPENAI_ENDPOINTS else []
+        if not pool:
+            return cls([OpenAIEndpoint(Config.AZURE_OPENAI_ENDPOINT, Config.AZURE_OPENAI_API_KEY)])
+
+        for entry in pool:
+            if "deployment" in entry:
+                # Ignoring it would route every model to a deployment named after the model
+                raise ValueError(
+                    f"AZURE_OPENAI_ENDPOINTS entry {entry.get('endpoint')} has a 'deployment' key; replace it "
+                    f"with 'deployments', mapping each model to its deployment, e.g. {{\"gpt-4o\": \"{entry['deployment']}\"}}."
+                )
+
+        # Fail over to the next endpoint instead of retrying the same one
+        endpoints = [
+            OpenAIEndpoint(
+                entry["endpoint"],
+                entry["api_key"],
+                deployments=entry.get("deployments"),
+                api_version=entry.get("api_version"),
+                max_retries=0 if len(pool) > 1 else 2
+            )
+            for entry in pool
+        ]
+        logger.info(f"Routing Azure OpenAI requests across {len(endpoints)} endpoints.")
+        return cls(endpoints)
+
+    def select(
+        self,
+        model: Optional[str] = None,
+        exclude: Optional[List[OpenAIEndpoint]] = None
+    ) -> Optional[OpenAIEndpoint]:
+        """
+        Selects the endpoint for the next request and counts the request as in flight on it.
+
+        Args:
+            model (str, optional): The requested model; only endpoints serving it are considered. Defaults
+                to every endpoint.
+            exclude (List[OpenAIEndpoint], optional): Endpoints already tried for this request.
+
+        Returns:
+            Optional[OpenAIEndpoint]: The available endpoint with the lowest score, or the endpoint whose
+            ejection ends first if all are ejected; None if every endpoint serving the model was excluded.
+        """
+        exclude = exclude or []
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                endpoint for endpoint in self.endpoints
+                if endpoint not in exclude and (model is None or endpoint.deployment_for(model) is not None)
+            ]
+            if not candidates:
+                return None
+            available = [endpoint for endpoint in candidates if endpoint.is_available(now)]
+            if available:
+                endpoint = min(available, key=lambda e: e.score())
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _record_success(self, endpoint: OpenAIEndpoint, deployment: str, latency: float, headers: Any) -> None:
+        """
+        Updates an endpoint's statistics after a successful request on one of its deployments.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.requests_by_deployment[deployment] = endpoint.requests_by_deployment.get(deployment, 0) + 1
+            endpoint.latency = latency if endpoint.latency is None else \
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * endpoint.latency
+            endpoint.error_rate *= 1 - EWMA_ALPHA
+            endpoint.remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+            endpoint.remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+
+    def _record_failure(self, endpoint: OpenAIEndpoint, error: Optional[Exception]) -> None:
+        """
+        Updates an endpoint's statistics after a failed request, ejecting it if the request may
+        succeed elsewhere.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if not isinstance(error, FAILOVER_ERRORS):
+                return
+            endpoint.failures += 1
+            endpoint.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * endpoint.error_rate
+            cooldown = self.ejection_seconds
+            if isinstance(error, openai.RateLimitError):
+                endpoint.remaining_requests = 0
+                headers = getattr(error.response, "headers", None)
+                retry_after = _header_number(headers, "retry-after")
+                if retry_after is not None:
+                    cooldown = max(cooldown, retry_after)
+            endpoint.ejected_until = time.monotonic() + cooldown
+        logger.warning(f"Ejected Azure OpenAI endpoint {endpoint.endpoint} for {cooldown:.0f}s: {error}")
+
+    def create_chat_completion(self, model: Optional[str] = None, **kwargs: Any) -> Any:
+        """
+        Creates a chat completion on the best endpoint, failing over to the others on throttling,
+        server errors, connection errors and timeouts.
+
+        Args:
+            model (str, optional): The requested model, sent to each endpoint as its deployment of it.
+            **kwargs: The arguments of `chat.completions.create`.
+
+        Returns:
+            Any: The chat completion, or the completion stream if `stream` is set.
+
+        Raises:
+            ValueError: If no endpoint of the pool serves the model.
+            openai.OpenAIError: The error of the last endpoint tried if all of them fail, or the first
+                error that another endpoint would not fix (e.g. a bad request).
+        """
+        tried: List[OpenAIEndpoint] = []
+        last_error: Optional[Exception] = None
+        while True:
+            endpoint = self.select(model, exclude=tried)
+            if endpoint is None:
+                if last_error is None:
+                    raise ValueError(f"No Azure OpenAI endpoint serves the model '{model}'.")
+                raise last_error
+            tried.append(endpoint)
+            deployment = endpoint.deployment_for(model)
+
+            start = time.perf_counter()
+            try:
+                raw = endpoint.client.chat.completions.with_raw_response.create(model=deployment, **kwargs)
+                completion = raw.parse()
+            except Exception as e:
+                self._record_failure(endpoint, e)
+                if not isinstance(e, FAILOVER_ERRORS):
+                    raise
+                last_error = e
+                usage_tracker.record_retry()
+                continue
+
+            # For streams this is the time to the response headers
+            self._record_success(endpoint, deployment, time.perf_counter() - start, getattr(raw, "headers", None))
+            return completion
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Returns the health statistics of every endpoint in the pool.
+        """
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+
+class _RoutedCompletions:
+    def __init__(self, router: OpenAIRouter) -> None:
+        self.create = router.create_chat_completion
+
+
+class _RoutedChat:
+    def __init__(self, router: OpenAIRouter) -> None:
+        self.completions = _RoutedCompletions(router)
+
+
+class RoutedOpenAIClient:
+    """
+    Exposes a router with the `chat.completions.create` interface of an AzureOpenAI client.
+    """
+
+    def __init__(self, router: OpenAIRouter) -> None:
+        self.router = router
+        self.chat = _RoutedChat(router)
+
+
+_default_router: Optional[OpenAIRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_default_router() -> OpenAIRouter:
+    """
+    Returns the router shared by every AzureOpenAIService, so that endpoint health is tracked across
+    all requests of the process. It is built from the configuration on first use.
+
+    Returns:
+        OpenAIRouter: The shared router.
+    """
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = OpenAIRouter.from_config()
+        return _default_router
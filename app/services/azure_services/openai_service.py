@@ -1,7 +1,8 @@
 import logging
-from openai import AzureOpenAI
-from app.config import Config
-from typing import List
+import time
+from app.services.azure_services import usage_tracker
+from app.services.azure_services.openai_router import RoutedOpenAIClient, get_default_router
+from typing import Any, Dict, Iterator, List, Optional
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -19,12 +20,35 @@ class AzureOpenAIService:
             deployment (str): The Azure OpenAI deployment name. Defaults to 'gpt-4o'.
         """
         self.deployment = deployment
-        self.client = AzureOpenAI(
-            api_key=Config.AZURE_OPENAI_API_KEY,
-            api_version=Config.AZURE_OPENAI_API_VERSION,
-            azure_endpoint=Config.AZURE_OPENAI_ENDPOINT
-        )
+        # Requests are routed across the configured endpoint pool
+        self.client = RoutedOpenAIClient(get_default_router())
         self.messages: List[dict] = []  # Stores conversation history
+        self.last_usage: Optional[Dict[str, int]] = None  # Token usage of the latest completion
+
+    def _record_usage(self, completion: Any, latency: float = 0.0) -> None:
+        """
+        Records the token usage of a completion, including prompt tokens served from the prompt cache,
+        and attributes it to the current run and stage (see `usage_tracker`).
+
+        Args:
+            completion (Any): The chat completion returned by the API.
+            latency (float): Seconds the completion took. Defaults to 0.
+        """
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            usage_tracker.record_call(self.deployment, 0, 0, latency=latency)
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.last_usage = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": cached_tokens
+        }
+        usage_tracker.record_call(
+            self.deployment, usage.prompt_tokens, usage.completion_tokens, cached_tokens, latency
+        )
+        logger.info(f"Completion used {usage.prompt_tokens} prompt tokens ({cached_tokens} cached).")
 
     def clear_memory(self) -> None:
         """
@@ -61,11 +85,13 @@ class AzureOpenAIService:
         messages.append({"role": "user", "content": prompt})
 
         logger.info("Sending JSON query to Azure OpenAI.")
+        start = time.perf_counter()
         completion = self.client.chat.completions.create(
             model=self.deployment,
             response_format={"type": response_format},
             messages=messages
         )
+        self._record_usage(completion, time.perf_counter() - start)
         response = completion.choices[0].message.content.strip()
         logger.info("JSON query successful.")
         return response
@@ -87,14 +113,99 @@ class AzureOpenAIService:
         ]
 
         logger.info("Sending query to Azure OpenAI.")
+        start = time.perf_counter()
         completion = self.client.chat.completions.create(
             model=self.deployment,
             messages=messages
         )
+        self._record_usage(completion, time.perf_counter() - start)
         response = completion.choices[0].message.content.strip()
         logger.info("Query executed successfully.")
         return response
 
+    def query_messages(self, messages: List[dict], response_format: Optional[str] = None) -> str:
+        """
+        Sends a prepared list of messages to Azure OpenAI.
+
+        Lets callers order messages so that content shared between calls forms a stable prefix,
+        which the service can serve from its prompt cache.
+
+        Args:
+            messages (List[dict]): The chat messages to send.
+            response_format (Optional[str]): The response format, e.g. 'json_object'. Defaults to text.
+
+        Returns:
+            str: The model's response.
+        """
+        kwargs = {"response_format": {"type": response_format}} if response_format else {}
+
+        logger.info("Sending messages to Azure OpenAI.")
+        start = time.perf_counter()
+        completion = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=messages,
+            **kwargs
+        )
+        self._record_usage(completion, time.perf_counter() - start)
+        response = completion.choices[0].message.content.strip()
+        logger.info("Messages query successful.")
+        return response
+
+    def query_stream(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        history: Optional[List[dict]] = None,
+        stats: Optional[Dict[str, float]] = None
+    ) -> Iterator[str]:
+        """
+        Sends a system prompt and user prompt to Azure OpenAI and yields the response as it is generated.
+
+        The time to the first token is logged and stored in `stats`, which belongs to the caller so
+        that concurrent streams do not overwrite each other's timings; the token usage is recorded
+        once the stream ends.
+
+        Args:
+            system_prompt (str): The system-level prompt for context.
+            user_prompt (str): The user-level input prompt.
+            history (Optional[List[dict]]): Earlier messages of the conversation, sent between the two prompts.
+            stats (Optional[Dict[str, float]]): Receives the seconds to the first token under 'ttft'.
+
+        Yields:
+            str: The text of each response chunk.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            *(history or []),
+            {"role": "user", "content": user_prompt}
+        ]
+
+        logger.info("Sending streaming query to Azure OpenAI.")
+        ttft = None
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            # The final chunk carries the usage and no choices
+            if chunk.usage is not None:
+                self._record_usage(chunk, time.perf_counter() - start)
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+                if stats is not None:
+                    stats["ttft"] = ttft
+                logger.info(f"Time to first token: {ttft:.3f}s")
+            yield content
+        logger.info(f"Streaming query completed in {time.perf_counter() - start:.3f}s.")
+
     def query_with_image_url(self, prompt: str, image_urls: List[str]) -> str:
         """
         Sends a query along with one or more image URLs to Azure OpenAI.
@@ -110,10 +221,12 @@ class AzureOpenAIService:
                     [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]}]
 
         logger.info("Sending query with image URLs to Azure OpenAI.")
+        start = time.perf_counter()
         completion = self.client.chat.completions.create(
             model=self.deployment,
             messages=messages
         )
+        self._record_usage(completion, time.perf_counter() - start)
         response = completion.choices[0].message.content.strip()
         logger.info("Query with image URLs successful.")
         return response
@@ -141,11 +254,13 @@ class AzureOpenAIService:
                         [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]})
 
         logger.info("Sending JSON query with image URLs to Azure OpenAI.")
+        start = time.perf_counter()
         completion = self.client.chat.completions.create(
             model=self.deployment,
             messages=messages,
             response_format={"type": "json_object"}
         )
+        self._record_usage(completion, time.perf_counter() - start)
         response = completion.choices[0].message.content.strip()
         logger.info("JSON query with image URLs successful.")
         return response
\ No newline at end of file
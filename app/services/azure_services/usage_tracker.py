@@ -0,0 +1,245 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Price in USD per million prompt, cached prompt and completion tokens of each model
+MODEL_PRICES = {
+    "gpt-4o": {"prompt": 2.50, "cached": 1.25, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "cached": 0.075, "completion": 0.60},
+}
+DEFAULT_MODEL_PRICE = MODEL_PRICES["gpt-4o"]
+
+# Runs whose usage is kept in memory; the oldest are dropped first
+MAX_TRACKED_RUNS = 100
+
+# Separator of nested stage names, e.g. "income_statement/revenue"
+STAGE_SEPARATOR = "/"
+
+_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_run_id", default=None)
+_filing: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_filing", default=None)
+_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("usage_stage", default=None)
+
+# Usage of each run: {run_id: {(filing, stage): counters}}
+_runs: "OrderedDict[str, Dict[tuple, Dict[str, float]]]" = OrderedDict()
+_runs_lock = threading.Lock()
+
+_COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "retries", "wall_time", "cost")
+
+
+def new_run_id() -> str:
+    """
+    Returns a new unique run id.
+    """
+    return uuid.uuid4().hex
+
+
+def call_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Estimates the cost of a completion in USD from MODEL_PRICES.
+
+    Args:
+        model (str, optional): The model, e.g. 'gpt-4o'; unknown models use DEFAULT_MODEL_PRICE.
+        prompt_tokens (int): Prompt tokens, including cached ones.
+        completion_tokens (int): Completion tokens.
+        cached_tokens (int): Prompt tokens served from the prompt cache.
+
+    Returns:
+        float: The estimated cost.
+    """
+    price = MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+    return (
+        (prompt_tokens - cached_tokens) * price["prompt"]
+        + cached_tokens * price["cached"]
+        + completion_tokens * price["completion"]
+    ) / 1_000_000
+
+
+def _counters(run_id: str, filing: Optional[str], stage: Optional[str]) -> Dict[str, float]:
+    """
+    Returns the counters of a run, filing and stage, creating them if needed. Must hold _runs_lock.
+    """
+    if run_id not in _runs:
+        _runs[run_id] = {}
+        while len(_runs) > MAX_TRACKED_RUNS:
+            _runs.popitem(last=False)
+    return _runs[run_id].setdefault((filing, stage or "other"), dict.fromkeys(_COUNTERS, 0))
+
+
+@contextmanager
+def usage_run(run_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Attributes the Azure OpenAI calls made in the block, including in threads started with
+    `submit_in_context`, to a run.
+
+    Args:
+        run_id (str, optional): The run id. Defaults to a new id.
+
+    Yields:
+        str: The run id.
+    """
+    run_id = run_id or new_run_id()
+    token = _run_id.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _run_id.reset(token)
+
+
+@contextmanager
+def usage_filing(filing: str) -> Iterator[None]:
+    """
+    Attributes the Azure OpenAI calls made in the block to a filing of the current run.
+
+    Args:
+        filing (str): The filing, e.g. its blob name.
+    """
+    token = _filing.set(filing)
+    try:
+        yield
+    finally:
+        _filing.reset(token)
+
+
+@contextmanager
+def usage_stage(stage: str) -> Iterator[None]:
+    """
+    Attributes the Azure OpenAI calls made in the block to a stage, and records the block's wall time.
+    A stage entered within another stage is named after both, e.g. "income_statement/revenue".
+
+    Args:
+        stage (str): The stage name.
+    """
+    parent = _stage.get()
+    name = f"{parent}{STAGE_SEPARATOR}{stage}" if parent else stage
+    token = _stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        run_id = _run_id.get()
+        if run_id is not None:
+            with _runs_lock:
+                _counters(run_id, _filing.get(), name)["wall_time"] += time.perf_counter() - start
+
+
+def submit_in_context(executor: Executor, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """
+    Submits a function to an executor so that it runs with the caller's run, filing and stage.
+
+    Args:
+        executor (Executor): The executor.
+        fn (Callable[..., Any]): The function.
+        *args, **kwargs: Its arguments.
+
+    Returns:
+        Future: The future of the call.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def record_call(
+    model: Optional[str],
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int = 0,
+    latency: float = 0.0
+) -> None:
+    """
+    Records an Azure OpenAI call under the current run, filing and stage. Calls made outside a run are not recorded.
+
+    Args:
+        model (str, optional): The model requested; the router sends it to each endpoint's deployment of it.
+        prompt_tokens (int): Prompt tokens, including cached ones.
+        completion_tokens (int): Completion tokens.
+        cached_tokens (int): Prompt tokens served from the prompt cache.
+        latency (float): Seconds the call took.
+    """
+    run_id = _run_id.get()
+    if run_id is None:
+        return
+    with _runs_lock:
+        counters = _counters(run_id, _filing.get(), _stage.get())
+        counters["requests"] += 1
+        counters["prompt_tokens"] += prompt_tokens
+        counters["completion_tokens"] += completion_tokens
+        counters["cached_tokens"] += cached_tokens
+        counters["latency"] += latency
+        counters["cost"] += call_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+
+
+def record_retry() -> None:
+    """
+    Records a retried Azure OpenAI call (a failover, a backoff retry or a correction) under the
+    current run, filing and stage.
+    """
+    run_id = _run_id.get()
+    if run_id is None:
+        return
+    with _runs_lock:
+        _counters(run_id, _filing.get(), _stage.get())["retries"] += 1
+
+
+def record_counts(**counts: float) -> None:
+    """
+    Adds named counts, e.g. the table tokens trimmed from a prompt, to the current run, filing and
+    stage. They are reported next to the usage counters. Counts outside a run are not recorded.
+
+    Args:
+        **counts: The counts to add, by name.
+    """
+    run_id = _run_id.get()
+    if run_id is None:
+        return
+    with _runs_lock:
+        counters = _counters(run_id, _filing.get(), _stage.get())
+        for key, value in counts.items():
+            counters[key] = counters.get(key, 0) + value
+
+
+def _add(total: Dict[str, float], counters: Dict[str, float], wall_time: bool = True) -> None:
+    for key, value in counters.items():
+        if key != "wall_time" or wall_time:
+            total[key] = total.get(key, 0) + value
+
+
+def get_run_usage(run_id: str, filing: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Returns the usage of a run: the requests, tokens, call latency, retries, wall time and
+    estimated cost of each stage, per filing and in total, with the counts added by `record_counts`.
+
+    The wall time of nested stages is included in their parent stage, so totals only add up
+    the wall time of top-level stages.
+
+    Args:
+        run_id (str): The run id.
+        filing (str, optional): Report only this filing.
+
+    Returns:
+        Optional[Dict[str, Any]]: The usage report, or None if the run (or the filing) is unknown.
+    """
+    with _runs_lock:
+        if run_id not in _runs:
+            return None
+        entries = {key: dict(counters) for key, counters in _runs[run_id].items()}
+
+    if filing is not None:
+        entries = {key: counters for key, counters in entries.items() if key[0] == filing}
+        if not entries:
+            return None
+
+    report: Dict[str, Any] = {"run_id": run_id, "stages": {}, "filings": {}, "total": dict.fromkeys(_COUNTERS, 0)}
+    for (entry_filing, stage), counters in entries.items():
+        top_level = STAGE_SEPARATOR not in stage
+        _add(report["stages"].setdefault(stage, {}), counters)
+        _add(report["total"], counters, wall_time=top_level)
+        if entry_filing is not None:
+            filing_report = report["filings"].setdefault(entry_filing, {"stages": {}, "total": dict.fromkeys(_COUNTERS, 0)})
+            _add(filing_report["stages"].setdefault(stage, {}), counters)
+            _add(filing_report["total"], counters, wall_time=top_level)
+    return report
@@ -0,0 +1,53 @@
+"""
+Benchmarks the compact markdown table renderer against `DataFrame.to_markdown` (tabulate) on
+tables shaped like 10-K financial statements.
+
+Run from the repository root with the same environment variables as the tests:
+    $ python -m benchmarks.bench_markdown
+"""
+import random
+import time
+from typing import List
+
+import pandas as pd
+
+from app.controllers.document_processing.utils.markdown_utils import render_markdown_table
+
+
+def make_financial_tables(num_tables: int = 300, seed: int = 0) -> List[pd.DataFrame]:
+    """Builds string DataFrames like the ones produced from DocIntel tables."""
+    rng = random.Random(seed)
+    tables = []
+    for _ in range(num_tables):
+        rows, columns = rng.randint(5, 40), rng.randint(3, 8)
+        data = [
+            [f"Line item {r} and related charges"] + [
+                f"({rng.randint(1, 99999):,})" if rng.random() < 0.2 else f"{rng.randint(1, 999999):,}"
+                for _ in range(columns - 1)
+            ]
+            for r in range(rows)
+        ]
+        header = [""] + [f"Year Ended December 31, {2024 - c}" for c in range(columns - 1)]
+        tables.append(pd.DataFrame(data, columns=header))
+    return tables
+
+
+def run() -> None:
+    tables = make_financial_tables()
+
+    start = time.perf_counter()
+    tabulated = [df.to_markdown(index=False) for df in tables]
+    tabulate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compact = [render_markdown_table(df) for df in tables]
+    compact_seconds = time.perf_counter() - start
+
+    print(f"Rendering {len(tables)} tables")
+    print(f"to_markdown:      {tabulate_seconds * 1000:8.1f} ms, {sum(map(len, tabulated)) / 1024:8.0f} KiB")
+    print(f"Compact renderer: {compact_seconds * 1000:8.1f} ms, {sum(map(len, compact)) / 1024:8.0f} KiB")
+    print(f"Speedup:          {tabulate_seconds / compact_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+"""
+Benchmarks the shared markdown-table parser against the per-statement regex parsers it replaced,
+on a synthetic corpus of LLM responses shaped like the income statement prompts' answers
+(explanatory text around the table, alignment markers, bold headers, negatives in parentheses).
+
+Run from the repository root with the same environment variables as the tests:
+    $ python -m benchmarks.bench_parsing
+"""
+import random
+import re
+import time
+from typing import List
+
+import pandas as pd
+
+from app.controllers.document_processing.utils.markdown_utils import parse_statement_table
+
+
+def make_responses(num_responses: int = 2000, seed: int = 0) -> List[str]:
+    """Builds statement responses with a two-column Item/Value table."""
+    rng = random.Random(seed)
+    responses = []
+    for _ in range(num_responses):
+        rows = []
+        for r in range(rng.randint(4, 25)):
+            value = rng.randint(1, 9_999_999)
+            cell = f"({value:,})" if rng.random() < 0.3 else f"{value:,}"
+            rows.append(f"| Line item {r} | {cell} |")
+        if rng.random() < 0.3:
+            rows.insert(1, "| **Operating expenses** | |")
+        separator = "|:---|---:|" if rng.random() < 0.5 else "|-----------------------|---------------|"
+        responses.append(
+            "Based on the provided tables, the breakdown is as follows:\n\n"
+            "| Item | Value |\n" + separator + "\n" + "\n".join(rows) +
+            "\n\nAll amounts are in thousands. Let me know if you need anything else."
+        )
+    return responses
+
+
+def legacy_parse_item_table(response: str) -> pd.DataFrame:
+    """Reference find/rfind + findall parser previously copied into each statement step."""
+    table_start = response.find("| Item")
+    table_end = response.rfind("|")
+    if table_start == -1 or table_end == -1:
+        raise ValueError("Table format not found in the response.")
+
+    table_text = response[table_start:table_end + 1]
+    rows = re.findall(r"\| (.+?)\s+\| ([\d,().-]+)\s+\|", table_text)
+    df = pd.DataFrame(rows, columns=["Item", "Value"])
+    df["Value"] = (
+        df["Value"]
+        .str.replace(",", "")
+        .str.replace(r"\(([\d.]+)\)", r"-\1", regex=True)
+        .astype(float)
+    )
+    return df
+
+
+def run() -> None:
+    responses = make_responses()
+
+    start = time.perf_counter()
+    legacy_failures = 0
+    for response in responses:
+        try:
+            legacy_parse_item_table(response)
+        except ValueError:
+            legacy_failures += 1
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = [parse_statement_table(response, "Item", "Value") for response in responses]
+    shared_seconds = time.perf_counter() - start
+
+    print(f"Parsing {len(responses)} synthetic statement responses")
+    print(f"Per-parser regexes: {legacy_seconds * 1000:8.1f} ms, {legacy_failures} failures")
+    print(f"Shared parser:      {shared_seconds * 1000:8.1f} ms, {sum(len(df) for df in parsed)} rows")
+    print(f"Speedup:            {legacy_seconds / shared_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    run()
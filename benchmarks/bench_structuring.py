@@ -0,0 +1,241 @@
+"""
+Benchmarks table context extraction, paragraph/table overlap filtering and bounding box
+aggregation on a synthetic AnalyzeResult shaped like a large 10-K (thousands of paragraphs,
+hundreds of tables).
+
+Run from the repository root with the same environment variables as the tests:
+    $ python -m benchmarks.bench_structuring
+"""
+import gc
+import json
+import random
+import time
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+from app.controllers.document_processing.utils.general_utils import (
+    collect_table_polygons,
+    convert_analyze_document_to_structured_data,
+    create_page_bounding_boxes,
+    extract_context_for_table,
+    extract_table_details,
+    filter_paragraphs_without_overlap,
+    paragraph_end_offsets,
+    paragraph_page_bounding_boxes
+)
+from app.controllers.document_processing.utils.segment_utils import bounds_to_bounding_boxes
+
+
+def make_cells(rows: int, columns: int, page: int) -> List[Dict[str, Any]]:
+    """Builds the DocIntel cells of a simple numeric table."""
+    return [
+        {
+            "kind": "columnHeader" if r == 0 else "content",
+            "rowIndex": r,
+            "columnIndex": c,
+            "content": f"Line item {r}" if c == 0 else f"{r * 1000 + c:,}",
+            "boundingRegions": [{"pageNumber": page, "polygon": [c, r, c + 1, r, c + 1, r + 1, c, r + 1]}],
+            "spans": [{"offset": 0, "length": 5}]
+        }
+        for r in range(rows) for c in range(columns)
+    ]
+
+
+def make_synthetic_result(
+    num_paragraphs: int = 6000,
+    num_tables: int = 400,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Builds a synthetic AnalyzeResult with paragraphs and tables interleaved in document order.
+    """
+    rng = random.Random(seed)
+    table_positions = set(rng.sample(range(num_paragraphs), num_tables))
+
+    paragraphs, tables = [], []
+    offset = 0
+    for i in range(num_paragraphs):
+        if i in table_positions:
+            length = rng.randint(200, 2000)
+            tables.append({
+                "rowCount": 12,
+                "columnCount": 4,
+                "cells": make_cells(12, 4, i // 20 + 1),
+                "spans": [{"offset": offset, "length": length}]
+            })
+            # DocIntel also emits paragraphs for the text inside a table
+            paragraphs.append({
+                "content": f"Cell {i}",
+                "role": None,
+                "spans": [{"offset": offset + 1, "length": 10}],
+                "boundingRegions": [{"pageNumber": i // 20 + 1, "polygon": [1, 1, 2, 1, 2, 2, 1, 2]}]
+            })
+            offset += length + 1
+
+        length = rng.randint(20, 400)
+        paragraphs.append({
+            "content": f"Paragraph {i}",
+            "role": "sectionHeading" if rng.random() < 0.1 else None,
+            "spans": [{"offset": offset, "length": length}],
+            "boundingRegions": [{"pageNumber": i // 20 + 1, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}]
+        })
+        offset += length + 1
+
+    return {"paragraphs": paragraphs, "tables": tables}
+
+
+def naive_previous_paragraphs(paragraphs: List[Dict[str, Any]], table_start: int) -> List[int]:
+    """Reference O(P) per-table scan the sorted version replaced."""
+    return [
+        idx for idx, p in enumerate(paragraphs)
+        if p["spans"][0]["offset"] + p["spans"][0]["length"] <= table_start
+    ][-3:]
+
+
+def naive_filter(paragraphs: List[Dict[str, Any]], table_spans: List[Dict[str, Any]]) -> List[int]:
+    """Reference O(P x T) overlap filter the merge-and-bisect version replaced."""
+    kept = []
+    for paragraph in paragraphs:
+        start = paragraph["spans"][0]["offset"]
+        end = start + paragraph["spans"][0]["length"]
+        if not any(t["offset"] <= end and start <= t["offset"] + t["length"] for t in table_spans):
+            kept.append(start)
+    return kept
+
+
+def naive_page_bounding_boxes(all_polygons: Dict[int, List[List[float]]]) -> List[Dict[str, Any]]:
+    """Reference generator-based bounding boxes the NumPy reductions replaced."""
+    boxes = []
+    for page, polygons in all_polygons.items():
+        min_x = min(point[0] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
+        min_y = min(point[1] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
+        max_x = max(point[0] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
+        max_y = max(point[1] for polygon in polygons for point in zip(polygon[::2], polygon[1::2]))
+        boxes.append({"pageNumber": page, "boundingBox": [min_x, min_y, max_x, min_y, max_x, max_y, min_x, max_y]})
+    return boxes
+
+
+def make_cell_sources(rows: int = 60, columns: int = 8, seed: int = 0) -> List[List[Dict[str, Any]]]:
+    """Builds the cell bounding regions of a large table spanning two pages."""
+    rng = random.Random(seed)
+    sources = []
+    for r in range(rows):
+        row = []
+        for c in range(columns):
+            x, y = c + rng.random(), r * 0.1 + rng.random()
+            row.append({"pageNumber": 1 + r // 40, "polygon": [x, y, x + 1, y, x + 1, y + 0.1, x, y + 0.1]})
+        sources.append(row)
+    return sources
+
+
+def run_bounding_boxes(num_tables: int = 400) -> None:
+    tables = [make_cell_sources(seed=i) for i in range(num_tables)]
+
+    start = time.perf_counter()
+    for sources in tables:
+        polygons = {}
+        for row in sources:
+            for region in row:
+                polygons.setdefault(region["pageNumber"], []).append(region["polygon"])
+        naive_page_bounding_boxes(polygons)
+    naive_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for sources in tables:
+        create_page_bounding_boxes(collect_table_polygons({}, sources, []))
+    numpy_seconds = time.perf_counter() - start
+
+    print(f"Bounding boxes for {num_tables} tables of {len(tables[0]) * len(tables[0][0])} cells")
+    print(f"Generator scans:  {naive_seconds * 1000:8.1f} ms")
+    print(f"NumPy reductions: {numpy_seconds * 1000:8.1f} ms")
+    print(f"Speedup:          {naive_seconds / numpy_seconds:8.1f}x")
+
+
+def run_index_payload(result: Dict[str, Any]) -> None:
+    paragraphs = result["paragraphs"]
+    raw_bytes = sum(len(json.dumps(p)) for p in paragraphs)
+    compact_bytes = sum(
+        len(json.dumps(paragraph_page_bounding_boxes(p), separators=(",", ":"))) for p in paragraphs
+    )
+    print(f"Paragraph bounding_regions: {raw_bytes / 1024:.0f} KiB raw -> {compact_bytes / 1024:.0f} KiB compact")
+
+
+def legacy_structured_data(result: Dict[str, Any]) -> Tuple[List[str], List[Any], List[int], List[Any]]:
+    """Rebuilds the four parallel lists the segment model replaced."""
+    paragraphs, tables = result["paragraphs"], result["tables"]
+    dfs, dfs_sources = [], []
+    tables_info = [extract_table_details(t, paragraphs, dfs, dfs_sources) for t in tables]
+    kept = filter_paragraphs_without_overlap(paragraphs, [t["spans"][0] for t in tables])
+
+    text = [p["content"] for _, p in kept] + [t["render_text"]() for t in tables_info]
+    text_sources = [p for _, p in kept] + [bounds_to_bounding_boxes(t["page_bounds"]) for t in tables_info]
+    table_indicator = [0] * len(kept) + [1] * len(tables_info)
+    table_sources = [[] for _ in kept] + [[list(row) for row in source] for source in dfs_sources]
+    return text, text_sources, table_indicator, table_sources
+
+
+def rendered_segments(result: Dict[str, Any]) -> List[Any]:
+    """Structures a document and renders every table, as process_documents does."""
+    segments = convert_analyze_document_to_structured_data(result)
+    for segment in segments:
+        segment.text
+    return segments
+
+
+def retained_bytes(structure) -> int:
+    """Memory still held by a structuring function's output once the AnalyzeResult is released."""
+    gc.collect()
+    tracemalloc.start()
+    result = make_synthetic_result()
+    output = structure(result)
+    del result
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del output
+    return current
+
+
+def run_memory() -> None:
+    legacy = retained_bytes(legacy_structured_data)
+    segments = retained_bytes(rendered_segments)
+    print("Memory retained after releasing the AnalyzeResult")
+    print(f"Parallel lists:   {legacy / 2 ** 20:8.1f} MiB")
+    print(f"Segments:         {segments / 2 ** 20:8.1f} MiB")
+
+
+def run() -> None:
+    result = make_synthetic_result()
+    paragraphs, tables = result["paragraphs"], result["tables"]
+    table_spans = [t["spans"][0] for t in tables]
+    table_starts = [s["offset"] for s in table_spans]
+    print(f"Synthetic document: {len(paragraphs)} paragraphs, {len(tables)} tables")
+
+    start = time.perf_counter()
+    for table_start in table_starts:
+        naive_previous_paragraphs(paragraphs, table_start)
+    naive_filter(paragraphs, table_spans)
+    naive_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    paragraph_ends = paragraph_end_offsets(paragraphs)
+    for table_start in table_starts:
+        extract_context_for_table(paragraphs, table_start, paragraph_ends)
+    filtered = filter_paragraphs_without_overlap(paragraphs, table_spans)
+    sorted_seconds = time.perf_counter() - start
+
+    assert [off for off, _ in filtered] == naive_filter(paragraphs, table_spans)
+
+    print(f"Linear scans:     {naive_seconds * 1000:8.1f} ms")
+    print(f"Sorted + bisect:  {sorted_seconds * 1000:8.1f} ms")
+    print(f"Speedup:          {naive_seconds / sorted_seconds:8.1f}x")
+    print()
+    run_bounding_boxes()
+    print()
+    run_index_payload(result)
+    print()
+    run_memory()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,49 @@
+import unittest
+from app.controllers.document_processing.utils.context_utils import (
+    estimate_similarity, minhash_signature, pack_context
+)
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+PARAGRAPH = (
+    "Net sales increased during fiscal 2023 compared to fiscal 2022 due primarily to higher net sales "
+    "of services, partially offset by lower net sales of Mac and iPad across all reportable segments."
+)
+
+class TestContextPacking(unittest.TestCase):
+
+    def test_minhash_similarity(self):
+        near = PARAGRAPH.replace("primarily", "mainly")
+        other = "The Company's effective tax rate was lower than the statutory federal income tax rate of 21%."
+        signature = minhash_signature(PARAGRAPH)
+        self.assertEqual(estimate_similarity(signature, minhash_signature(PARAGRAPH)), 1.0)
+        self.assertGreater(estimate_similarity(signature, minhash_signature(near)), 0.6)
+        self.assertLess(estimate_similarity(signature, minhash_signature(other)), 0.2)
+
+    def test_orders_by_reranker_score_and_drops_duplicates(self):
+        results = [
+            {"text": "Low relevance paragraph about leases.", "@search.score": 9.0, "@search.reranker_score": 1.0},
+            {"text": PARAGRAPH, "@search.score": 1.0, "@search.reranker_score": 3.0},
+            {"text": PARAGRAPH + "  ", "@search.score": 2.0, "@search.reranker_score": 2.5},
+            {"text": "", "@search.reranker_score": 4.0},
+        ]
+        context, report = pack_context(results, token_budget=1000)
+        self.assertEqual(context, PARAGRAPH + "\n\nLow relevance paragraph about leases.")
+        self.assertEqual(report["duplicates"], 1)
+        self.assertEqual(report["packed"], 2)
+        self.assertEqual(report["tokens"], count_tokens(context))
+
+    def test_fills_token_budget(self):
+        table = "Table:\n|   Item    |   2023   |\n|-----------|----------|\n|  Revenue  |  1,000   |"
+        results = [
+            {"text": PARAGRAPH * 3, "@search.score": 3.0},
+            {"text": "Gross margin was 44%.", "@search.score": 2.0},
+            {"text": table, "@search.score": 1.0},
+        ]
+        budget = count_tokens(PARAGRAPH)
+        context, report = pack_context(results, token_budget=budget)
+        self.assertLessEqual(report["tokens"], budget)
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(context, "Gross margin was 44%.\n\nTable:\n| Item | 2023 |\n|---|---|\n| Revenue | 1,000 |")
+
+if __name__ == '__main__':
+    unittest.main()
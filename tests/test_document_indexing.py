@@ -0,0 +1,70 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+import numpy as np
+from app.controllers.document_processing.utils.cog_search_utils import SegmentStreamUploader
+from app.controllers.document_processing.utils.segment_utils import Segment
+
+class TestSegmentStreamUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = MagicMock()
+        self.controller.search_documents.return_value = {"results": []}
+        self.controller.get_max_id.return_value = 10
+        regions = np.array([[3, 0, 0, 1, 1]], dtype=np.float32)
+        self.segments = [
+            Segment(i, 3, Segment.TABLE if i % 2 else Segment.PARAGRAPH, f"Segment {i}", regions)
+            for i in range(5)
+        ]
+
+    def uploaded_documents(self):
+        return [call.args[0]["documents"] for call in self.controller.add_documents.call_args_list]
+
+    def test_buffers_until_metadata_is_set(self):
+        uploader = SegmentStreamUploader("report.pdf", self.controller, batch_size=2)
+        for segment in self.segments[:3]:
+            uploader.add(segment)
+        self.controller.add_documents.assert_not_called()
+
+        uploader.set_metadata("Acme Corp", "December 31, 2023")
+        self.assertEqual([len(batch) for batch in self.uploaded_documents()], [2])
+
+        for segment in self.segments[3:]:
+            uploader.add(segment)
+        uploader.close()
+
+        batches = self.uploaded_documents()
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        documents = [document for batch in batches for document in batch]
+        self.assertEqual([document["id"] for document in documents], ["11", "12", "13", "14", "15"])
+        self.assertEqual(documents[1]["is_table"], "1")
+        self.assertEqual(documents[4]["company_name"], "Acme Corp")
+        self.assertEqual(json.loads(documents[0]["bounding_regions"])[0]["pageNumber"], 3)
+
+    def test_skips_existing_blob(self):
+        self.controller.search_documents.return_value = {"results": [{"blob_name": "report.pdf"}]}
+        uploader = SegmentStreamUploader("report.pdf", self.controller)
+        uploader.add(self.segments[0])
+        uploader.set_metadata("Acme Corp", "December 31, 2023")
+        uploader.close()
+        self.controller.add_documents.assert_not_called()
+
+    def test_upload_errors_do_not_propagate(self):
+        self.controller.add_documents.side_effect = RuntimeError("index unavailable")
+        uploader = SegmentStreamUploader("report.pdf", self.controller, batch_size=2)
+        uploader.set_metadata("Acme Corp", "December 31, 2023")
+        for segment in self.segments:
+            uploader.add(segment)
+        uploader.close()
+        self.assertEqual(self.controller.add_documents.call_count, 1)
+        self.assertEqual(uploader.buffer, [])
+
+        self.controller.get_max_id.side_effect = RuntimeError("index unavailable")
+        uploader = SegmentStreamUploader("report.pdf", self.controller)
+        uploader.add(self.segments[0])
+        uploader.set_metadata("Acme Corp", "December 31, 2023")
+        uploader.close()
+        self.assertEqual(self.controller.add_documents.call_count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
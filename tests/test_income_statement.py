@@ -1,12 +1,21 @@
+import json
 import unittest
+from unittest.mock import MagicMock, patch
+import httpx
+import openai
 import pandas as pd
+from app.services.azure_services import usage_tracker
 from app.core.fs_generators.income_statement_gen import (
     parse_revenue_table, extract_total_revenue,
     parse_gross_profit_table, calculate_gross_profit,
     parse_operating_income_table, calculate_operating_income,
     parse_pre_tax_income_table, calculate_pre_tax_income,
-    parse_net_income_table, calculate_net_income
+    parse_net_income_table, calculate_net_income,
+    build_statement_messages, GROSS_PROFIT_INSTRUCTIONS, NET_INCOME_INSTRUCTIONS,
+    reconcile_statement_table, generate_income_statement
 )
+from app.controllers.document_processing.utils.openai_utils import retry_with_exponential_backoff
+from app.core.fs_generators.income_statement_json_gen import generate_income_statement_single_pass
 
 class TestIncomeStatementFunctions(unittest.TestCase):
     def setUp(self):
@@ -116,5 +125,161 @@ class TestIncomeStatementFunctions(unittest.TestCase):
         net_income = calculate_net_income(df)
         self.assertEqual(net_income, 750000.0)
 
+    def test_statement_messages_share_prefix(self):
+        tables = ["Context:\nIncome statement\n\nTable:\n| Item | 2023 |\n|---|---|\n| Revenue | 100 |"]
+        gross = build_statement_messages(tables, GROSS_PROFIT_INSTRUCTIONS, "millions", "2023", ("Total revenue", 100))
+        net = build_statement_messages(tables, NET_INCOME_INSTRUCTIONS, "millions", "2023", ("Pre-tax income", 20))
+        self.assertEqual(gross[0], net[0])
+        self.assertIn("| Revenue | 100 |", gross[0]["content"])
+        self.assertTrue(net[1]["content"].endswith("Unit scale: millions\nPre-tax income: 20.00 (millions)"))
+
+class TestArithmeticFeedback(unittest.TestCase):
+    def setUp(self):
+        self.responses = [
+            "| Segment | Revenue |\n|---|---|\n| Segment A | 1,000 |\n| Segment B | 2,000 |\n| Total Revenue | 3,000 |",
+            "| Item | Value |\n|---|---|\n| Total Revenue | 3,000 |\n| Cost of Goods Sold | (1,500) |\n| Gross Profit | 1,500 |",
+            "| Item | Value |\n|---|---|\n| Gross Profit | 1,500 |\n| Operating Expenses | (500) |\n| Operating Income | 1,000 |",
+            "| Item | Value |\n|---|---|\n| Operating Income | 1,000 |\n| Interest Expense | (50) |\n| Pre-Tax Income | 950 |",
+            "| Item | Value |\n|---|---|\n| Pre-Tax Income | 950 |\n| Income Tax Expense | (200) |\n| Net Income | 750 |",
+        ]
+
+    def test_reconcile_statement_table(self):
+        revenue = parse_revenue_table(self.responses[0])
+        self.assertIsNone(reconcile_statement_table(revenue, "Total Revenue"))
+        gross = parse_gross_profit_table(self.responses[1])
+        self.assertIsNone(reconcile_statement_table(gross, "Gross Profit", "Total Revenue", 3000))
+        self.assertIn("must be 3,100.00", reconcile_statement_table(gross, "Gross Profit", "Total Revenue", 3100))
+
+        wrong = parse_revenue_table(self.responses[0].replace("| 2,000 |", "| 2,500 |"))
+        self.assertIn("sum to 3,500.00, but 'Total Revenue' is 3,000.00", reconcile_statement_table(wrong, "Total Revenue"))
+        self.assertIn("no 'Gross Profit' row", reconcile_statement_table(revenue, "Gross Profit"))
+
+    def test_reconcile_total_only_revenue_table(self):
+        revenue = parse_revenue_table("| Segment | Revenue |\n|---|---|\n| Total Revenue | 3,000 |")
+        self.assertIsNone(reconcile_statement_table(revenue, "Total Revenue"))
+        self.assertEqual(extract_total_revenue(revenue), 3000)
+
+    def test_corrective_follow_up(self):
+        responses = list(self.responses)
+        responses.insert(2, responses[2].replace("| (500) |", "| (400) |"))
+        service = MagicMock()
+        service.query_messages.side_effect = responses
+
+        with usage_tracker.usage_run() as run_id:
+            dataframes, amounts = generate_income_statement(["table"], "Thousands", "2023", service)
+        self.assertEqual(amounts, [3000, 1500, 1000, 950, 750])
+        self.assertEqual(len(dataframes), 5)
+
+        # The correction continues the conversation of the failed step
+        messages = service.query_messages.call_args_list[3][0][0]
+        self.assertEqual(messages[:2], service.query_messages.call_args_list[2][0][0])
+        self.assertEqual(messages[2], {"role": "assistant", "content": responses[2]})
+        self.assertIn("sum to 1,100.00, but 'Operating Income' is 1,000.00", messages[3]["content"])
+
+        stages = usage_tracker.get_run_usage(run_id)["stages"]
+        self.assertEqual(stages["operating_income"]["step_corrections"], 1)
+        self.assertEqual(stages["revenue"]["step_attempts"], 1)
+
+    def test_corrections_are_bounded(self):
+        wrong = self.responses[0].replace("| 2,000 |", "| 2,500 |")
+        service = MagicMock()
+        service.query_messages.return_value = wrong
+        with usage_tracker.usage_run() as run_id, self.assertRaises(ValueError):
+            generate_income_statement(["table"], "Thousands", "2023", service, max_corrections=1)
+        self.assertEqual(service.query_messages.call_count, 2)
+        self.assertEqual(usage_tracker.get_run_usage(run_id)["stages"]["revenue"]["step_failures"], 1)
+
+    @patch("app.controllers.document_processing.utils.openai_utils.time.sleep")
+    def test_transport_errors_are_retried(self, sleep):
+        error = openai.APIConnectionError(request=httpx.Request("POST", "https://example.com"))
+        service = MagicMock()
+        service.query_messages.side_effect = [error] + list(self.responses)
+
+        with usage_tracker.usage_run() as run_id:
+            _, amounts = generate_income_statement(["table"], "Thousands", "2023", service)
+        self.assertEqual(amounts, [3000, 1500, 1000, 950, 750])
+        revenue = usage_tracker.get_run_usage(run_id)["stages"]["revenue"]
+        self.assertEqual((revenue["retries"], revenue["step_attempts"], revenue["step_corrections"]), (1, 1, 0))
+
+        # Other errors are not retried
+        service.query_messages.side_effect = openai.BadRequestError(
+            "bad request", response=httpx.Response(400, request=httpx.Request("POST", "https://example.com")), body=None
+        )
+        with self.assertRaises(openai.BadRequestError):
+            generate_income_statement(["table"], "Thousands", "2023", service)
+
+    @patch("app.controllers.document_processing.utils.openai_utils.time.sleep")
+    def test_retry_with_exponential_backoff(self, sleep):
+        calls = []
+
+        @retry_with_exponential_backoff(max_retries=2)
+        def flaky():
+            calls.append(1)
+            if len(calls) < 2:
+                raise ValueError("invalid response")
+            return "Income Statement"
+        self.assertEqual(flaky(), "Income Statement")
+
+        @retry_with_exponential_backoff(max_retries=2, reraise=True)
+        def failing():
+            raise ValueError("invalid response")
+        with self.assertRaises(ValueError):
+            failing()
+        self.assertEqual(sleep.call_count, 2)
+
+class TestSinglePassIncomeStatement(unittest.TestCase):
+    def setUp(self):
+        self.statement = {
+            "revenue": {"items": [{"item": "Segment A", "value": 1000000}, {"item": "Segment B", "value": "2,000,000"}],
+                        "total_revenue": 3000000},
+            "gross_profit": {"items": [{"item": "Cost of Goods Sold", "value": -1500000}], "gross_profit": 1500000},
+            "operating_income": {"items": [{"item": "Operating Expenses", "value": "(500,000)"}],
+                                 "operating_income": 1000000},
+            "pre_tax_income": {"items": [{"item": "Interest Expense", "value": -50000}], "pre_tax_income": 950000},
+            "net_income": {"items": [{"item": "Income Tax Expense", "value": -200000}], "net_income": 750000}
+        }
+
+    def test_single_pass_matches_sequential_contract(self):
+        service = MagicMock()
+        service.query_messages.return_value = json.dumps(self.statement)
+        dataframes, amounts = generate_income_statement_single_pass(["table"], "Thousands", "2023", service)
+
+        self.assertEqual(amounts, [3000000, 1500000, 1000000, 950000, 750000])
+        self.assertEqual(calculate_gross_profit(dataframes[1]), 1500000)
+        self.assertEqual(list(dataframes[0].columns), ["Segment", "Revenue"])
+        self.assertEqual(extract_total_revenue(dataframes[0]), 3000000)
+        self.assertEqual(dataframes[2]["Item"].tolist(), ["Gross Profit", "Operating Expenses", "Operating Income"])
+        service.query_messages.assert_called_once()
+
+    def test_single_pass_re_requests_failing_section_only(self):
+        self.statement["operating_income"]["operating_income"] = 900000
+        fixed_section = {"items": [{"item": "Operating Expenses", "value": -500000}], "operating_income": 1000000}
+        service = MagicMock()
+        service.query_messages.side_effect = [json.dumps(self.statement), json.dumps(fixed_section)]
+
+        _, amounts = generate_income_statement_single_pass(["table"], "Thousands", "2023", service)
+        self.assertEqual(amounts[2], 1000000)
+        self.assertEqual(service.query_messages.call_count, 2)
+        system, user = service.query_messages.call_args[0][0]
+        self.assertEqual(system, service.query_messages.call_args_list[0][0][0][0])
+        self.assertIn("but Operating Income is 900,000.00", user["content"])
+
+    def test_single_pass_accepts_total_only_revenue(self):
+        self.statement["revenue"] = {"items": [], "total_revenue": 3000000}
+        service = MagicMock()
+        service.query_messages.return_value = json.dumps(self.statement)
+        dataframes, amounts = generate_income_statement_single_pass(["table"], "Thousands", "2023", service)
+
+        self.assertEqual(amounts[0], 3000000)
+        self.assertEqual(dataframes[0]["Segment"].tolist(), ["Total Revenue"])
+        service.query_messages.assert_called_once()
+
+    def test_single_pass_raises_after_retries(self):
+        self.statement["net_income"]["net_income"] = 1
+        service = MagicMock()
+        service.query_messages.side_effect = [json.dumps(self.statement)] + [json.dumps(self.statement["net_income"])] * 2
+        with self.assertRaises(ValueError):
+            generate_income_statement_single_pass(["table"], "Thousands", "2023", service)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
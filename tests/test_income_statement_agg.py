@@ -0,0 +1,83 @@
+import json
+import math
+import unittest
+from unittest.mock import MagicMock
+from app.core.fs_generators.income_statement_json_gen import SECTIONS, section_to_dataframe
+from app.core.fs_generators.income_statement_agg import (
+    aggregate_income_statements, align_items, label_category, normalize_label
+)
+
+def build_statement(sections):
+    """
+    Builds the (dataframes, amounts) of one year from the items and subtotal of every section.
+    """
+    dataframes, amounts = [], []
+    previous_total, previous_label = None, None
+    for (items, total), (_, _, label) in zip(sections, SECTIONS):
+        dataframes.append(section_to_dataframe(items, total, previous_total, previous_label, label))
+        amounts.append(total)
+        previous_total, previous_label = total, label
+    return dataframes, amounts
+
+class TestIncomeStatementAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.results = {
+            "December 31, 2023": build_statement([
+                ([("Products", 600.0), ("Services", 400.0)], 1000.0),
+                ([("Cost of sales", -600.0)], 400.0),
+                ([("Selling, general & administrative expenses", -150.0), ("Research and development", -50.0)], 200.0),
+                ([("Interest expense", -20.0)], 180.0),
+                ([("Provision for income taxes", -40.0)], 140.0),
+            ]),
+            "December 31, 2022": build_statement([
+                ([("Product", 500.0), ("Services", 300.0)], 800.0),
+                ([("Cost of goods sold", -500.0)], 300.0),
+                ([("Selling, general and administrative", -120.0), ("Restructuring charges", -10.0),
+                  ("Research & development", -40.0)], 130.0),
+                ([("Interest expense", -15.0)], 115.0),
+                ([("Income tax expense", -30.0)], 85.0),
+            ]),
+        }
+
+    def test_labels(self):
+        self.assertEqual(normalize_label("Selling, General & Administrative Expenses"), "selling general administrative")
+        self.assertEqual(label_category("Cost of goods sold"), "cost_of_revenue")
+        self.assertEqual(label_category("Provision for income taxes"), "income_tax")
+        self.assertIsNone(label_category("Products"))
+
+    def test_aggregate_income_statements(self):
+        service = MagicMock()
+        service.query_json.return_value = json.dumps({"matches": [{"id": 0, "same": True}]})
+        df = aggregate_income_statements(self.results, service)
+
+        self.assertEqual(list(df.columns), ["", "December 31, 2022", "December 31, 2023"])
+        self.assertEqual(df[""].tolist(), [
+            "Products", "Services", "Total Revenue",
+            "Cost of sales", "Gross Profit",
+            "Selling, general & administrative expenses", "Restructuring charges", "Research and development",
+            "Operating Income",
+            "Interest expense", "Pre-Tax Income",
+            "Provision for income taxes", "Net Income",
+        ])
+        self.assertEqual(df.iloc[0].tolist()[1:], [500.0, 600.0])
+        self.assertEqual(df.iloc[3].tolist()[1:], [-500.0, -600.0])
+        self.assertTrue(math.isnan(df.iloc[6, 2]))
+        self.assertEqual(df.iloc[-1].tolist()[1:], [85.0, 140.0])
+
+        # Only the 'Product' / 'Products' pair is sent to the LLM
+        service.query_json.assert_called_once()
+        self.assertIn('"Product" / "Products"', service.query_json.call_args[0][0])
+
+    def test_ambiguous_labels_kept_apart_without_llm(self):
+        df = aggregate_income_statements(self.results, resolve_ambiguous=False)
+        self.assertEqual(df[""].tolist()[:4], ["Product", "Products", "Services", "Total Revenue"])
+
+    def test_align_items_never_merges_categories(self):
+        rows = [{"label": "Interest expense", "category": "interest_expense", "values": {"2023": -1.0}}]
+        matches, ambiguous = align_items(["Interest income"], rows, "2022")
+        self.assertEqual(matches, [None])
+        self.assertEqual(ambiguous, [])
+
+if __name__ == '__main__':
+    unittest.main()
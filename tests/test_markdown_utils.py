@@ -0,0 +1,103 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app.controllers.document_processing.utils.markdown_utils import (
+    render_markdown_table, parse_markdown_table, parse_statement_table, to_numeric, parse_number,
+    compact_markdown_whitespace
+)
+from app.controllers.document_processing.utils.segment_utils import Segment
+
+class TestMarkdownRendering(unittest.TestCase):
+
+    def test_render_markdown_table(self):
+        df = pd.DataFrame([["Revenue", "1,000"], ["Cost | other", None]], columns=[None, "2023"])
+        self.assertEqual(
+            render_markdown_table(df),
+            "|  | 2023 |\n"
+            "|---|---|\n"
+            "| Revenue | 1,000 |\n"
+            "| Cost \\| other |  |"
+        )
+
+    def test_compact_markdown_whitespace(self):
+        text = (
+            "Context:\n  Consolidated   Statements of Operations  \n\n\n\nTable:\n"
+            "|   Item      |    2023     |\n"
+            "| :---------- | ----------: |\n"
+            "|  Revenue    |   1,000     |\n"
+            "|  A \\| B    |             |"
+        )
+        self.assertEqual(
+            compact_markdown_whitespace(text),
+            "Context:\nConsolidated Statements of Operations\n\nTable:\n"
+            "| Item | 2023 |\n|---|---|\n| Revenue | 1,000 |\n| A \\| B |  |"
+        )
+
+    def test_render_empty_table(self):
+        self.assertEqual(render_markdown_table(pd.DataFrame()), "")
+
+    def test_segment_text_is_rendered_once(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            return "Table text"
+
+        segment = Segment(0, 1, Segment.TABLE, render, np.empty((0, 5), dtype=np.float32))
+        self.assertEqual(calls, [])
+        self.assertEqual(segment.text, "Table text")
+        self.assertEqual(segment.text, "Table text")
+        self.assertEqual(calls, [1])
+
+class TestMarkdownParsing(unittest.TestCase):
+
+    def test_to_numeric(self):
+        values = pd.Series(["1,000", "(1,500)", "$ 2,000.5", "-300", "—", "12%", "1.5M", "n/a", ""])
+        result = to_numeric(values)
+        np.testing.assert_array_equal(result.to_numpy()[:7], [1000, -1500, 2000.5, -300, 0, 12, 1.5])
+        self.assertTrue(result.iloc[7:].isna().all())
+
+    def test_to_numeric_mixed_cells(self):
+        result = to_numeric(pd.Series([None, 5, 2.5, "(7)", "1e3"], index=[10, 11, 12, 13, 14]))
+        self.assertEqual(list(result.index), [10, 11, 12, 13, 14])
+        self.assertTrue(np.isnan(result.iloc[0]))
+        np.testing.assert_array_equal(result.to_numpy()[1:], [5, 2.5, -7, 1000])
+
+    def test_to_numeric_scales_suffixes(self):
+        result = to_numeric(pd.Series(["1.5M", "US$3bn", "(2k)"]), scale_suffixes=True)
+        np.testing.assert_array_equal(result.to_numpy(), [1.5e6, 3e9, -2e3])
+
+    def test_parse_number_matches_to_numeric(self):
+        cells = [None, True, 5, "1e5", "(1,234)", "—", "US$3bn", "n/a", ""]
+        for scale_suffixes in (False, True):
+            expected = to_numeric(pd.Series(cells, dtype=object), scale_suffixes=scale_suffixes)
+            actual = [parse_number(cell, scale_suffixes=scale_suffixes) for cell in cells]
+            np.testing.assert_array_equal(actual, expected.to_numpy())
+        self.assertTrue(np.isnan(parse_number(True)))
+
+    def test_parse_markdown_table_prefers_header(self):
+        response = (
+            "Here is a summary:\n"
+            "| Note | Text |\n|---|---|\n| 1 | Restated |\n\n"
+            "| Item | Value |\n| :--- | ---: |\n| Revenue | 100 |\n| Cost | (40) | extra |\n"
+            "Let me know if you need more."
+        )
+        df = parse_markdown_table(response, header="item")
+        self.assertEqual(list(df.columns), ["Item", "Value"])
+        self.assertEqual(df.values.tolist(), [["Revenue", "100"], ["Cost", "(40)"]])
+        self.assertEqual(list(parse_markdown_table(response).columns), ["Note", "Text"])
+
+    def test_parse_markdown_table_without_table(self):
+        with self.assertRaises(ValueError):
+            parse_markdown_table("No table here.")
+
+    def test_parse_statement_table_drops_non_numeric_rows(self):
+        response = (
+            "| Item | Value |\n|---|---|\n| **Expenses** | |\n| Tax | (200) |\n| Other | 1e2 |\n| Net Income | 750 |"
+        )
+        df = parse_statement_table(response, "Item", "Value")
+        self.assertEqual(df["Item"].tolist(), ["Tax", "Other", "Net Income"])
+        self.assertEqual(df["Value"].tolist(), [-200.0, 100.0, 750.0])
+
+if __name__ == "__main__":
+    unittest.main()
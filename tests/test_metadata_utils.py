@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from app.services.azure_services import usage_tracker
+from app.controllers.document_processing.utils import openai_utils
+from app.controllers.document_processing.utils.openai_utils import query_first_answer, observed_hedge_delay
+from app.controllers.document_processing.utils.metadata_utils import (
+    find_fiscal_year_end, find_company_name, find_unit_scale, record_metadata_path, get_metadata_hit_rates
+)
+
+class TestMetadataUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.cover = [
+            "UNITED STATES SECURITIES AND EXCHANGE COMMISSION\nWashington, D.C. 20549",
+            "FORM 10-K",
+            "ANNUAL REPORT PURSUANT TO SECTION 13 OR 15(d) OF THE SECURITIES EXCHANGE ACT OF 1934\n"
+            "For the fiscal year ended\nSept. 30, 2023",
+            "Commission File Number: 001-36743",
+            "Apple Inc.",
+            "(Exact name of Registrant as specified in its charter)",
+        ]
+
+    def test_find_fiscal_year_end(self):
+        self.assertEqual(find_fiscal_year_end(self.cover), "September 30, 2023")
+        self.assertEqual(
+            find_fiscal_year_end(["For the quarterly period ended June 29, 2024"]), "June 29, 2024"
+        )
+        self.assertIsNone(find_fiscal_year_end(["Risk factors", "Our fiscal year is the 52 weeks ending in September."]))
+
+    def test_find_company_name(self):
+        self.assertEqual(find_company_name(self.cover), "Apple Inc.")
+        # Name and caption in the same paragraph
+        self.assertEqual(
+            find_company_name(["MICROSOFT CORPORATION\n(Exact name of registrant as specified in its charter)"]),
+            "MICROSOFT CORPORATION"
+        )
+        self.assertIsNone(find_company_name(["Commission File Number: 001-36743", "(Exact name of registrant as specified in its charter)"]))
+        self.assertIsNone(find_company_name(self.cover[:4]))
+
+    def test_find_unit_scale(self):
+        tables = (
+            "Context:\nCONSOLIDATED STATEMENTS OF OPERATIONS\n(In millions, except per share amounts)\n\nTable:\n| a | b |\n"
+            "Context:\nCONSOLIDATED BALANCE SHEETS\n(in millions)\n\nTable:\n| a | b |\n"
+            "Context:\nSegment information (Dollars in thousands)\n\nTable:\n| a | b |\n"
+        )
+        self.assertEqual(find_unit_scale(tables), "millions")
+        # No scale clearly dominates
+        self.assertIsNone(find_unit_scale("(in millions) (in thousands)"))
+        self.assertIsNone(find_unit_scale("| Revenue | 100 |"))
+
+    def test_record_metadata_path(self):
+        with usage_tracker.usage_run() as run_id:
+            record_metadata_path("test_field", "rules")
+            record_metadata_path("test_field", "rules")
+            record_metadata_path("test_field", "llm")
+        rates = get_metadata_hit_rates(usage_tracker.get_run_usage(run_id)["total"])
+        self.assertEqual(rates, {"test_field": {"rules": 2, "llm": 1, "miss": 0}})
+
+class TestHedgedContextExpansion(unittest.TestCase):
+
+    def setUp(self):
+        openai_utils._query_latencies.clear()
+
+    def service(self, answers, delay=0.0):
+        """
+        A service answering each prompt after `delay` seconds, recording the prompts it received.
+        """
+        service = MagicMock()
+        service.prompts = []
+        lock = threading.Lock()
+
+        def query(system_prompt, user_prompt):
+            with lock:
+                service.prompts.append(user_prompt)
+            time.sleep(delay)
+            return answers[user_prompt]
+        service.query.side_effect = query
+        return service
+
+    def test_sequential(self):
+        service = self.service({"short": "Not Found", "medium": "Acme Corp", "long": "Acme Corporation"})
+        self.assertEqual(query_first_answer("system", ["short", "medium", "long"], service), "Acme Corp")
+        self.assertEqual(service.prompts, ["short", "medium"])
+
+    def test_hedged_prefers_smallest_context(self):
+        service = self.service({"short": "Not Found", "medium": "Acme Corp", "long": "Acme Corporation"}, delay=0.2)
+        start = time.perf_counter()
+        answer = query_first_answer("system", ["short", "medium", "long"], service, hedged=True, hedge_delay=0.0)
+        self.assertEqual(answer, "Acme Corp")
+        # About one round trip instead of two
+        self.assertLess(time.perf_counter() - start, 0.35)
+
+    def test_hedged_cancels_unsent_requests(self):
+        service = self.service({"short": "Acme Corp", "medium": "Acme", "long": "Acme"}, delay=0.05)
+        answer = query_first_answer("system", ["short", "medium", "long"], service, hedged=True, hedge_delay=0.5)
+        self.assertEqual(answer, "Acme Corp")
+        self.assertEqual(service.prompts, ["short"])
+
+    def test_hedged_not_found(self):
+        service = self.service({"short": "Not Found", "long": "not found"})
+        self.assertIsNone(query_first_answer("system", ["short", "long"], service, hedged=True, hedge_delay=0.0))
+
+    def test_hedge_delay_follows_observed_latency(self):
+        self.assertEqual(observed_hedge_delay(), openai_utils.HEDGE_DELAY_SECONDS)
+        service = self.service({"prompt": "Not Found"}, delay=0.02)
+        for _ in range(openai_utils.HEDGE_MIN_SAMPLES):
+            query_first_answer("system", ["prompt"], service)
+        delay = observed_hedge_delay()
+        self.assertGreaterEqual(delay, 0.02)
+        self.assertLess(delay, openai_utils.HEDGE_DELAY_SECONDS)
+
+if __name__ == '__main__':
+    unittest.main()
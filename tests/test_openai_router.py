@@ -0,0 +1,114 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+from app.services.azure_services.openai_router import OpenAIEndpoint, OpenAIRouter, RoutedOpenAIClient
+
+def status_error(error_class, status, headers=None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://example.com"))
+    return error_class("error", response=response, body=None)
+
+def endpoint(name, deployments=None):
+    client = MagicMock()
+    raw = client.chat.completions.with_raw_response.create.return_value
+    raw.parse.return_value = f"completion from {name}"
+    raw.headers = {"x-ratelimit-remaining-requests": "100", "x-ratelimit-remaining-tokens": "50000"}
+    return OpenAIEndpoint(name, "key", deployments=deployments, client=client)
+
+def create_calls(e):
+    return e.client.chat.completions.with_raw_response.create.call_args_list
+
+class TestOpenAIRouter(unittest.TestCase):
+
+    def test_prefers_lowest_latency(self):
+        fast, slow = endpoint("fast"), endpoint("slow")
+        fast.latency, slow.latency = 0.5, 2.0
+        router = OpenAIRouter([slow, fast])
+
+        self.assertEqual(router.create_chat_completion(model="gpt-4o", messages=[]), "completion from fast")
+        self.assertEqual(create_calls(fast)[0].kwargs["model"], "gpt-4o")
+        self.assertEqual(fast.remaining_requests, 100)
+        self.assertEqual(fast.in_flight, 0)
+        self.assertLess(fast.latency, 0.5)
+
+    def test_error_rate_and_low_quota_penalties(self):
+        a, b = endpoint("a"), endpoint("b")
+        a.latency, b.latency = 1.0, 2.0
+        a.error_rate = 0.5
+        self.assertIs(OpenAIRouter([a, b]).select(), b)
+
+        a.error_rate, a.remaining_requests = 0.0, 1
+        b.in_flight = 0  # Released by the previous select
+        self.assertIs(OpenAIRouter([a, b]).select(), b)
+
+    def test_fails_over_on_throttling_and_ejects(self):
+        throttled = endpoint("throttled", {"gpt-4o": "gpt-4o-east"})
+        healthy = endpoint("healthy", {"gpt-4o": "gpt-4o-west"})
+        throttled.latency, healthy.latency = 0.1, 1.0
+        throttled.client.chat.completions.with_raw_response.create.side_effect = status_error(
+            openai.RateLimitError, 429, {"retry-after": "60"}
+        )
+        router = OpenAIRouter([throttled, healthy], ejection_seconds=5)
+
+        self.assertEqual(router.create_chat_completion(model="gpt-4o", messages=[]), "completion from healthy")
+        self.assertEqual(create_calls(healthy)[0].kwargs["model"], "gpt-4o-west")
+        self.assertGreater(throttled.ejected_until - time.monotonic(), 50)
+        self.assertEqual(throttled.failures, 1)
+
+        # The ejected endpoint is skipped despite its lower latency
+        router.create_chat_completion(model="gpt-4o", messages=[])
+        self.assertEqual(len(create_calls(throttled)), 1)
+        self.assertEqual(len(create_calls(healthy)), 2)
+
+    def test_routes_by_requested_model(self):
+        east = endpoint("east", {"gpt-4o": "gpt-4o-east"})
+        west = endpoint("west", {"gpt-4o": "gpt-4o-west", "gpt-4o-mini": "mini-west"})
+        east.latency, west.latency = 0.1, 1.0
+        router = OpenAIRouter([east, west])
+
+        # A gpt-4o-mini request is never served by a gpt-4o deployment
+        self.assertEqual(router.create_chat_completion(model="gpt-4o-mini", messages=[]), "completion from west")
+        self.assertEqual(create_calls(west)[0].kwargs["model"], "mini-west")
+        self.assertEqual(len(create_calls(east)), 0)
+        self.assertEqual(west.stats()["requests_by_deployment"], {"mini-west": 1})
+
+        router.create_chat_completion(model="gpt-4o", messages=[])
+        self.assertEqual(create_calls(east)[0].kwargs["model"], "gpt-4o-east")
+        with self.assertRaises(ValueError):
+            router.create_chat_completion(model="gpt-35-turbo", messages=[])
+
+    def test_raises_when_all_endpoints_fail(self):
+        a, b = endpoint("a"), endpoint("b")
+        for e in (a, b):
+            e.client.chat.completions.with_raw_response.create.side_effect = status_error(
+                openai.InternalServerError, 503
+            )
+        with self.assertRaises(openai.InternalServerError):
+            OpenAIRouter([a, b]).create_chat_completion(model="gpt-4o", messages=[])
+        self.assertEqual((a.failures, b.failures), (1, 1))
+
+    def test_does_not_fail_over_on_bad_request(self):
+        a, b = endpoint("a"), endpoint("b")
+        a.latency, b.latency = 0.1, 1.0
+        a.client.chat.completions.with_raw_response.create.side_effect = status_error(openai.BadRequestError, 400)
+        router = OpenAIRouter([a, b])
+
+        with self.assertRaises(openai.BadRequestError):
+            router.create_chat_completion(model="gpt-4o", messages=[])
+        self.assertEqual(len(create_calls(b)), 0)
+        self.assertTrue(a.is_available(time.monotonic()))
+
+    def test_routed_client(self):
+        client = RoutedOpenAIClient(OpenAIRouter([endpoint("a")]))
+        self.assertEqual(client.chat.completions.create(model="gpt-4o", messages=[]), "completion from a")
+
+    def test_from_config_rejects_legacy_deployment_key(self):
+        pool = '[{"endpoint": "https://east.openai.azure.com", "api_key": "key", "deployment": "gpt-4o-east"}]'
+        with patch("app.services.azure_services.openai_router.Config.AZURE_OPENAI_ENDPOINTS", pool):
+            with self.assertRaisesRegex(ValueError, "'deployments'"):
+                OpenAIRouter.from_config()
+
+if __name__ == '__main__':
+    unittest.main()
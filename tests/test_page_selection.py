@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from app.controllers.document_processing.utils import doc_intel_utils
+from app.controllers.document_processing.utils.page_selection_utils import (
+    score_pages, select_pages, format_page_ranges
+)
+
+class TestPageSelection(unittest.TestCase):
+
+    def setUp(self):
+        self.page_texts = [
+            "Annual Report on Form 10-K for the fiscal year ended December 31, 2023",
+            "Risk factors. Our business depends on customers and suppliers.",
+            "Consolidated Statements of Operations Total revenue 12,345 10,234 Cost of revenue (4,321) (3,210) "
+            "Gross profit 8,024 7,024 Operating income 3,100 2,900 Net income 2,400 2,100",
+            "Notes to consolidated financial statements continued",
+            "Item 9. Controls and procedures",
+        ]
+
+    def test_score_pages(self):
+        scores = score_pages(self.page_texts)
+        self.assertEqual(int(np.argmax(scores)), 2)
+        self.assertGreaterEqual(scores[2], 6.0)
+        self.assertLess(scores[1], 1.0)
+
+    def test_select_pages(self):
+        pages = select_pages(score_pages(self.page_texts))
+        # Cover pages, the statement page and the page that follows it
+        self.assertEqual(pages, [1, 2, 3, 4])
+        self.assertEqual(select_pages(np.zeros(5)), [])
+
+    def test_format_page_ranges(self):
+        self.assertEqual(format_page_ranges([1, 2, 3, 7, 9, 10]), "1-3,7,9-10")
+        self.assertEqual(format_page_ranges([4]), "4")
+
+    @patch.object(doc_intel_utils, "is_page_selection_available", return_value=False)
+    @patch.object(doc_intel_utils, "AzureDocIntelService")
+    @patch.object(doc_intel_utils, "AzureBlobStorageService")
+    def test_targeted_analysis_warns_without_pypdf(self, blob_service, doc_intel_service, available):
+        blob_service.return_value.get_blob_content.return_value = b"%PDF"
+        doc_intel_service.return_value.analyze_document_from_binary.return_value = {"pages": [{}, {}], "tables": []}
+        with patch.object(doc_intel_utils, "plan_page_selection", return_value={
+            "total_pages": None, "pages": [], "page_ranges": None
+        }), self.assertLogs(level="WARNING") as logs:
+            _, report = doc_intel_utils.process_blob_document_targeted("missing.pdf", cache_dir="/nonexistent/")
+        self.assertTrue(report["fallback"])
+        self.assertEqual(report["fallback_reason"], "pypdf is not installed")
+        self.assertIn("fell back to all pages", "\n".join(logs.output))
+
+if __name__ == "__main__":
+    unittest.main()
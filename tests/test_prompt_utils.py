@@ -0,0 +1,81 @@
+import unittest
+from types import SimpleNamespace
+from app.services.azure_services import usage_tracker
+from app.services.azure_services.openai_service import AzureOpenAIService
+from app.controllers.document_processing.utils.prompt_utils import build_tables_prompt, split_table_text
+from app.controllers.document_processing.utils.token_utils import count_tokens
+
+STATEMENT = (
+    "Context:\nCONSOLIDATED STATEMENTS OF OPERATIONS\n(in millions, except per share data)\n\nTable:\n"
+    "|  | Year Ended December 31, 2023 |  | 2022 | % Change |\n|---|---|---|---|---|\n"
+    "| Revenue | 1,000 | $ | 900 | 11% |\n| Cost of revenue | (400) |  | (350) | 14% |\n"
+    "| Gross profit | 600 |  | 550 | 9% |\n| Selling and admin | (200) |  | (180) |  |\n"
+    "| Operating income | 400 |  | 370 |  |\n| Interest expense | (20) |  | (25) |  |\n"
+    "| Income before income taxes | 380 |  | 345 |  |\n| Provision for income taxes | (80) |  | (70) |  |\n"
+    "| Net income | 300 |  | 275 |  |\n| Earnings per share | 1.50 |  | 1.30 |  |\n\n"
+    "Footnotes:\n(1) Restated."
+)
+SEGMENTS = "Context:\nRevenue by segment\n\nTable:\n| Segment | 2023 | 2022 |\n|---|---|---|\n| A | 600 | 500 |\n| B | 400 | 400 |"
+
+class TestPromptBuilder(unittest.TestCase):
+
+    def test_split_table_text(self):
+        context, table, footnotes = split_table_text(STATEMENT)
+        self.assertTrue(context.startswith("CONSOLIDATED"))
+        self.assertTrue(table.startswith("|  | Year Ended"))
+        self.assertEqual(footnotes, "(1) Restated.")
+
+    def test_drops_comparative_and_empty_columns(self):
+        prompt = build_tables_prompt([STATEMENT, SEGMENTS], "income_statement", "December 31, 2023")
+        self.assertIn("|  | Year Ended December 31, 2023 |\n|---|---|\n| Revenue | 1,000 |", prompt)
+        self.assertIn("| Segment | 2023 |\n|---|---|\n| A | 600 |", prompt)
+        self.assertNotIn("Earnings per share", prompt)
+        self.assertNotIn("900", prompt)
+
+    def test_unit_scale_keeps_leading_rows(self):
+        prompt = build_tables_prompt([STATEMENT], "unit_scale", "December 31, 2023")
+        self.assertIn("(in millions", prompt)
+        self.assertIn("| Gross profit | 600 |", prompt)
+        self.assertNotIn("Operating income", prompt)
+        self.assertNotIn("Restated", prompt)
+
+    def test_truncates_top_table_and_warns_on_dropped_tables(self):
+        full = build_tables_prompt([STATEMENT], "income_statement", "2023", token_budget=100000)
+        budget = count_tokens(full.split("\n\nFootnotes:\n")[0]) - 10
+        with self.assertLogs(level="WARNING") as logs:
+            prompt = build_tables_prompt([STATEMENT, SEGMENTS], "income_statement", "2023", token_budget=budget)
+        self.assertLessEqual(count_tokens(prompt), budget)
+        self.assertIn("CONSOLIDATED STATEMENTS OF OPERATIONS", prompt)
+        self.assertIn("| Revenue | 1,000 |", prompt)
+        self.assertNotIn("Net income", prompt)
+        self.assertNotIn("Revenue by segment", prompt)
+        self.assertIn("truncated table 'CONSOLIDATED STATEMENTS OF OPERATIONS'", logs.output[0])
+        self.assertIn("dropped table 'Revenue by segment'", logs.output[1])
+
+    def test_records_token_savings_per_run(self):
+        with usage_tracker.usage_run() as run_id:
+            with usage_tracker.usage_stage("income_statement"):
+                build_tables_prompt([STATEMENT], "income_statement", "2023")
+            with usage_tracker.usage_stage("unit_scale"):
+                build_tables_prompt([STATEMENT], "unit_scale", "2023", token_budget=1)
+        stages = usage_tracker.get_run_usage(run_id)["stages"]
+        for stage in ("income_statement", "unit_scale"):
+            self.assertLess(stages[stage]["table_tokens_sent"], stages[stage]["table_tokens"])
+        # Prompts built outside a run are not kept
+        build_tables_prompt([STATEMENT], "income_statement", "2023")
+
+class TestPromptCacheStats(unittest.TestCase):
+
+    def test_records_cached_tokens_per_run(self):
+        service = AzureOpenAIService()
+        usage = SimpleNamespace(
+            prompt_tokens=2000, completion_tokens=50, prompt_tokens_details=SimpleNamespace(cached_tokens=1536)
+        )
+        with usage_tracker.usage_run() as run_id:
+            service._record_usage(SimpleNamespace(usage=usage))
+        self.assertEqual(service.last_usage, {"prompt_tokens": 2000, "completion_tokens": 50, "cached_tokens": 1536})
+        total = usage_tracker.get_run_usage(run_id)["total"]
+        self.assertEqual((total["requests"], total["prompt_tokens"], total["cached_tokens"]), (1, 2000, 1536))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+from app.controllers.azure_controllers.rag_controller import RAGController
+
+SEGMENTS = {
+    "gross profit": [{"id": "1", "text": "Gross profit was $10.", "@search.reranker_score": 3.0},
+                     {"id": "2", "text": "Revenue was $30.", "@search.reranker_score": 2.0}],
+    "revenue": [{"id": "2", "text": "Revenue was $30.", "@search.reranker_score": 3.0},
+                {"id": "1", "text": "Gross profit was $10.", "@search.reranker_score": 1.0}],
+    "leases": [{"id": "9", "text": "Lease costs were $2.", "@search.reranker_score": 2.0}],
+}
+
+class TestRAGBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = RAGController.__new__(RAGController)
+        self.controller.search_service = MagicMock()
+
+        def search(search_text, **kwargs):
+            if search_text == "broken":
+                raise RuntimeError("search unavailable")
+            return SEGMENTS[search_text]
+        self.controller.search_service.search_documents.side_effect = search
+        self.controller.openai_service = MagicMock()
+        self.controller.openai_service.query_messages.side_effect = lambda messages: "single answer"
+
+    def test_group_queries(self):
+        groups = RAGController.group_queries([{"1", "2"}, {"2", "1"}, {"9"}, {"1", "2", "3"}], group_size=2)
+        self.assertEqual(groups, [[0, 1], [2], [3]])
+
+    def test_concurrent_batch(self):
+        results = self.controller.execute_rag_batch(["gross profit", "broken", "leases"])
+        self.assertEqual([result["query"] for result in results], ["gross profit", "broken", "leases"])
+        self.assertEqual(results[0]["answer"], "single answer")
+        self.assertEqual(results[1]["answer"], "An error occurred: search unavailable")
+        self.assertEqual([source["id"] for source in results[0]["sources"]], ["1", "2"])
+        self.assertTrue(all(result["latency"] >= 0 for result in results))
+        self.assertEqual(self.controller.openai_service.query_messages.call_count, 2)
+
+    def test_grouped_batch(self):
+        self.controller.openai_service.query_json.return_value = json.dumps(
+            {"answers": [{"id": 1, "answer": "$10"}, {"id": 2, "answer": "$30"}]}
+        )
+        results = self.controller.execute_rag_batch(["gross profit", "revenue", "leases"], grouped=True)
+
+        self.assertEqual([result["answer"] for result in results], ["$10", "$30", "$10"])
+        # Queries with overlapping segments share one prompt, with each segment once
+        prompts = [call.args[0] for call in self.controller.openai_service.query_json.call_args_list]
+        shared = next(prompt for prompt in prompts if "2. revenue" in prompt)
+        self.assertEqual(shared.count("Revenue was $30."), 1)
+        self.assertEqual(self.controller.openai_service.query_json.call_count, 2)
+
+    def test_grouped_batch_falls_back_to_single_answers(self):
+        self.controller.openai_service.query_json.return_value = json.dumps({"answers": [{"id": 1, "answer": "$10"}]})
+        results = self.controller.execute_rag_batch(["gross profit", "revenue"], grouped=True)
+        self.assertEqual([result["answer"] for result in results], ["$10", "single answer"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from unittest.mock import MagicMock
+from app.controllers.azure_controllers.rag_controller import RAGController, SELECT_FIELDS, build_search_filter
+
+class TestRAGFilters(unittest.TestCase):
+
+    def test_build_search_filter(self):
+        self.assertIsNone(build_search_filter())
+        self.assertEqual(build_search_filter(company_name="Apple Inc."), "company_name eq 'Apple Inc.'")
+        self.assertEqual(
+            build_search_filter(company_name=["Apple Inc.", "Macy's, Inc."]),
+            "search.in(company_name, 'Apple Inc.|Macy''s, Inc.', '|')"
+        )
+        self.assertEqual(
+            build_search_filter(company_name=["A|B", "C"]), "(company_name eq 'A|B' or company_name eq 'C')"
+        )
+        self.assertEqual(
+            build_search_filter(fiscal_year=[2023, "September 30, 2022"]),
+            "(search.ismatch('2023', 'fiscal_year') or fiscal_year eq 'September 30, 2022')"
+        )
+        self.assertEqual(
+            build_search_filter(company_name="Apple Inc.", blob_names=["a.pdf"], is_table=True),
+            "company_name eq 'Apple Inc.' and blob_name eq 'a.pdf' and is_table eq '1'"
+        )
+
+    def test_retrieve_filters_and_projects(self):
+        controller = RAGController.__new__(RAGController)
+        controller.search_service = MagicMock()
+        controller.search_service.search_documents.return_value = []
+
+        controller.retrieve("What was revenue?", search_filter="company_name eq 'Apple Inc.'")
+        kwargs = controller.search_service.search_documents.call_args.kwargs
+        self.assertEqual(kwargs["filter"], "company_name eq 'Apple Inc.'")
+        self.assertEqual(kwargs["select"], SELECT_FIELDS)
+        self.assertNotIn("bounding_regions", kwargs["select"])
+
+if __name__ == '__main__':
+    unittest.main()
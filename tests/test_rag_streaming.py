@@ -0,0 +1,56 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from app.controllers.azure_controllers.rag_controller import RAGController
+from app.services.azure_services.openai_service import AzureOpenAIService
+
+def chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if usage is None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+class TestRAGStreaming(unittest.TestCase):
+
+    def test_query_stream(self):
+        service = AzureOpenAIService()
+        service.client = MagicMock()
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=3, prompt_tokens_details=None)
+        service.client.chat.completions.create.return_value = iter(
+            [chunk(""), chunk("Gross"), chunk(" profit"), chunk("."), chunk(usage=usage)]
+        )
+
+        stats = {}
+        self.assertEqual(list(service.query_stream("system", "user", stats=stats)), ["Gross", " profit", "."])
+        self.assertGreaterEqual(stats["ttft"], 0)
+        self.assertEqual(service.last_usage["completion_tokens"], 3)
+        self.assertTrue(service.client.chat.completions.create.call_args.kwargs["stream"])
+
+    def test_execute_rag_flow_stream(self):
+        controller = RAGController.__new__(RAGController)
+        controller.search_service = MagicMock()
+        controller.search_service.search_documents.return_value = [
+            {"id": "1", "text": "Gross profit was $10.", "blob_name": "report.pdf", "@search.score": 2.5}
+        ]
+        controller.openai_service = MagicMock()
+
+        def query_stream(system_prompt, user_prompt, history=None, stats=None):
+            stats["ttft"] = 0.2
+            yield from ["It was", " $10."]
+
+        controller.openai_service.query_stream.side_effect = query_stream
+
+        events = list(controller.execute_rag_flow_stream("What was gross profit?"))
+        self.assertEqual([event for event, _ in events], ["retrieval", "token", "token", "done"])
+        self.assertEqual(events[0][1]["sources"], [{"id": "1", "blob_name": "report.pdf", "score": 2.5}])
+        self.assertEqual("".join(data["text"] for event, data in events if event == "token"), "It was $10.")
+        self.assertEqual(events[-1][1]["ttft"], 0.2)
+
+    def test_execute_rag_flow_stream_error(self):
+        controller = RAGController.__new__(RAGController)
+        controller.search_service = MagicMock()
+        controller.search_service.search_documents.side_effect = RuntimeError("search unavailable")
+
+        events = list(controller.execute_rag_flow_stream("What was gross profit?"))
+        self.assertEqual(events, [("error", {"error": "An error occurred: search unavailable"})])
+
+if __name__ == '__main__':
+    unittest.main()
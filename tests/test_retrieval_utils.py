@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+from app.controllers.document_processing.utils.retrieval_utils import (
+    DocumentIndex, build_document_index, INCOME_STATEMENT_QUERY
+)
+
+class TestDocumentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.texts = [
+            "Annual report for the fiscal year ended December 31, 2023",
+            "Risk factors: competition and regulation may affect our business.",
+            "Context:\nConsolidated Balance Sheets\n\nTable:\n| Item | 2023 |\n| Total assets | 100 |",
+            "Context:\nConsolidated Statements of Operations\n\nTable:\n| Item | 2023 |\n| Revenue | 50 |\n| Net income | 5 |",
+            "Our fiscal year end is the last day of December.",
+        ]
+        self.is_table = [False, False, True, True, False]
+
+    def test_search(self):
+        index = DocumentIndex.build(self.texts, self.is_table)
+        self.assertEqual(index.search("fiscal year end", top_k=2), [4, 0])
+        self.assertEqual(index.search(INCOME_STATEMENT_QUERY, top_k=1, tables_only=True), [3])
+        self.assertEqual(index.search("unrelated query words", top_k=3), [])
+        self.assertEqual(index.top_segments("fiscal year end", top_k=2, in_order=True), [self.texts[0], self.texts[4]])
+
+    def test_empty_document(self):
+        index = DocumentIndex.build([])
+        self.assertEqual(index.search("fiscal year end"), [])
+
+    def test_cache_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            built = build_document_index(self.texts, self.is_table, "report.pdf", cache_dir)
+            loaded = build_document_index(self.texts, self.is_table, "report.pdf", cache_dir)
+            # Read-only views of the memory-mapped arrays
+            self.assertFalse(loaded.matrix.data.flags.writeable)
+            self.assertEqual(loaded.search("fiscal year end"), built.search("fiscal year end"))
+
+            self.assertIs(loaded.texts, self.texts)
+
+            # Different segments under the same key are re-indexed
+            self.assertIsNone(DocumentIndex.load(f"{cache_dir}/report.pdf.index", self.texts[:2]))
+            rebuilt = build_document_index(self.texts[:2], cache_key="report.pdf", cache_dir=cache_dir)
+            self.assertEqual(rebuilt.texts, self.texts[:2])
+            self.assertEqual(rebuilt.matrix.shape[0], 2)
+
+if __name__ == '__main__':
+    unittest.main()
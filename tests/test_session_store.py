@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock
+from app.core.memory.session_store import SUMMARY_PREFIX, SessionStore
+from app.controllers.azure_controllers.rag_controller import RAGController
+
+ANSWER = "Revenue was $383.3 billion in fiscal 2023, down 3% from fiscal 2022. " * 5
+
+class TestSessionStore(unittest.TestCase):
+
+    def test_turns_are_kept_per_session(self):
+        store = SessionStore()
+        store.append_turn("a", "What was revenue?", "$10.")
+        store.append_turn("b", "What was net income?", "$2.")
+        self.assertEqual(
+            store.get_messages("a"),
+            [{"role": "user", "content": "What was revenue?"}, {"role": "assistant", "content": "$10."}]
+        )
+        self.assertEqual(store.get_messages("b")[0]["content"], "What was net income?")
+        self.assertEqual(store.get_messages("c"), [])
+
+    def test_summarizes_older_turns(self):
+        summarizer = MagicMock(return_value="The user asked about revenue.")
+        store = SessionStore(summarizer=summarizer, token_limit=400)
+        for i in range(4):
+            store.append_turn("a", f"Question {i}?", ANSWER)
+
+        summarizer.assert_called()
+        summary, older = summarizer.call_args.args
+        self.assertEqual(older[0]["content"], "Question 0?")
+        messages = store.get_messages("a")
+        self.assertEqual(messages[0], {"role": "system", "content": SUMMARY_PREFIX + "The user asked about revenue."})
+        self.assertEqual(messages[-2]["content"], "Question 3?")
+        self.assertLessEqual(store.stats()["tokens"], 400)
+
+    def test_drops_oldest_turns_without_summarizer(self):
+        store = SessionStore(token_limit=150)
+        for i in range(4):
+            store.append_turn("a", f"Question {i}?", ANSWER)
+        messages = store.get_messages("a")
+        self.assertEqual(messages[0]["content"], "Question 3?")
+        self.assertEqual(len(messages), 2)
+
+    def test_lru_and_idle_eviction(self):
+        store = SessionStore(max_sessions=2, idle_seconds=0.2)
+        store.append_turn("a", "Q", "A")
+        store.append_turn("b", "Q", "A")
+        store.get_messages("a")
+        store.append_turn("c", "Q", "A")
+        self.assertEqual(store.get_messages("b"), [])
+        self.assertNotEqual(store.get_messages("a"), [])
+
+        time.sleep(0.3)
+        self.assertEqual(store.get_messages("a"), [])
+        self.assertEqual(store.stats()["sessions"], 0)
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.db")
+            SessionStore(db_path=path).append_turn("a", "What was revenue?", "$10.")
+            # A new store, e.g. in another worker, reloads the session
+            store = SessionStore(db_path=path)
+            self.assertEqual(store.get_messages("a")[1]["content"], "$10.")
+            store.clear("a")
+            self.assertEqual(SessionStore(db_path=path).get_messages("a"), [])
+
+    def test_sqlite_backend_shared_between_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.db")
+            worker_a, worker_b = SessionStore(db_path=path), SessionStore(db_path=path)
+            worker_a.append_turn("s", "q1", "a1")
+            worker_b.append_turn("s", "q2", "a2")
+            worker_a.append_turn("s", "q3", "a3")
+            contents = [message["content"] for message in SessionStore(db_path=path).get_messages("s")]
+            self.assertEqual(contents, ["q1", "a1", "q2", "a2", "q3", "a3"])
+
+            worker_b.clear("s")
+            self.assertEqual(worker_a.get_messages("s"), [])
+
+    def test_rag_flow_uses_session(self):
+        controller = RAGController.__new__(RAGController)
+        controller.search_service = MagicMock()
+        controller.search_service.search_documents.return_value = [{"id": "1", "text": "Revenue was $10."}]
+        controller.openai_service = MagicMock()
+        controller.openai_service.query_messages.return_value = "It was $10."
+        controller.sessions = SessionStore()
+
+        controller.execute_rag_flow("What was revenue?", session_id="a")
+        controller.execute_rag_flow("And the year before?", session_id="a")
+        messages = controller.openai_service.query_messages.call_args.args[0]
+        self.assertEqual([message["role"] for message in messages], ["system", "user", "assistant", "user"])
+        # Earlier turns are kept without their retrieved context
+        self.assertEqual(messages[1]["content"], "What was revenue?")
+        self.assertEqual(len(controller.sessions.get_messages("a")), 4)
+
+if __name__ == '__main__':
+    unittest.main()
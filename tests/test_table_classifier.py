@@ -0,0 +1,93 @@
+import os
+import tempfile
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from app.core.classifiers.table_classifier import (
+    TablePreClassifier, table_features, log_classifications, train_pre_classifier
+)
+from app.controllers.document_processing.utils.openai_utils import (
+    classify_multiple_tables, pack_table_batches, classify_table_batch, classify_tables_batched
+)
+
+INCOME_TABLE = (
+    "CONSOLIDATED STATEMENTS OF OPERATIONS\n"
+    "| | 2023 | 2022 |\n|---|---|---|\n"
+    "| Total revenue | 1,000 | 900 |\n| Cost of revenue | (400) | (350) |\n"
+    "| Gross profit | 600 | 550 |\n| Operating income | 200 | 180 |\n| Net income | 150 | 120 |"
+)
+EXHIBIT_TABLE = (
+    "EXHIBIT INDEX\n"
+    "| Exhibit | Description |\n|---|---|\n"
+    "| 3.1 | Certificate of incorporation |\n| 10.1 | Employment agreement |\n"
+    "| 31.1 | Certification of chief executive officer |\n| 32.1 | Section 906 certification |"
+)
+
+class TestTablePreClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.texts = [INCOME_TABLE, EXHIBIT_TABLE] * 10
+        self.labels = ["Income Statement", "None"] * 10
+
+    def test_table_features(self):
+        features = table_features(INCOME_TABLE)
+        self.assertEqual(features.splitlines()[0], "CONSOLIDATED STATEMENTS OF OPERATIONS")
+        self.assertIn("Gross profit", features)
+        self.assertNotIn("1,000", features)
+
+    def test_decide_confident_tables(self):
+        classifier = TablePreClassifier(confidence_threshold=0.6).fit(self.texts, self.labels)
+        self.assertEqual(classifier.decide([INCOME_TABLE, EXHIBIT_TABLE]), ["Income Statement", "None"])
+        classifier.confidence_threshold = 1.0
+        self.assertEqual(classifier.decide([INCOME_TABLE]), [None])
+
+    def test_train_from_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path, model_path = os.path.join(tmp, "log.jsonl"), os.path.join(tmp, "model.pkl")
+            log_classifications(self.texts, self.labels, path=log_path)
+            counts = train_pre_classifier(log_path, model_path, confidence_threshold=0.6)
+            self.assertEqual(counts, {"Income Statement": 10, "None": 10})
+            classifier = TablePreClassifier.load(model_path)
+            self.assertEqual(classifier.decide([EXHIBIT_TABLE]), ["None"])
+
+    def test_classify_multiple_tables_skips_confident_tables(self):
+        classifier = TablePreClassifier(confidence_threshold=0.6).fit(self.texts, self.labels)
+        uncertain = "| Item | Amount |\n|---|---|\n| Something else | 1 |"
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("app.core.classifiers.table_classifier.Config.TABLE_CLASSIFICATION_LOG", os.path.join(tmp, "log.jsonl")), \
+                patch("app.controllers.document_processing.utils.openai_utils.classify_table", return_value="Balance Sheet") as llm:
+            classifier.decide = lambda texts: ["Income Statement", "None", None]
+            result = classify_multiple_tables([INCOME_TABLE, EXHIBIT_TABLE, uncertain], pre_classifier=classifier)
+        self.assertEqual(result, ["Income Statement", "None", "Balance Sheet"])
+        llm.assert_called_once_with(uncertain)
+
+class TestBatchedClassification(unittest.TestCase):
+
+    def test_pack_table_batches(self):
+        tables = ["a" * 400, "b" * 400, "c" * 400, "d" * 2000]
+        # 100 estimated tokens per short table, 500 for the long one
+        self.assertEqual(pack_table_batches(tables, token_budget=250), [[0, 1], [2], [3]])
+
+    def test_classify_table_batch_drops_invalid_labels(self):
+        service = MagicMock()
+        service.query_json.return_value = json.dumps({"classifications": [
+            {"index": 0, "statement": "Income Statement"},
+            {"index": 1, "statement": "Footnote"},
+            {"index": 7, "statement": "None"},
+            {"index": "2", "statement": "[balance sheet]"}
+        ]})
+        result = classify_table_batch({0: "t0", 1: "t1", 2: "t2", 3: "t3"}, service)
+        self.assertEqual(result, {0: "Income Statement", 2: "Balance Sheet"})
+
+    def test_classify_tables_batched_falls_back_per_table(self):
+        with patch("app.controllers.document_processing.utils.openai_utils.classify_table_batch",
+                   side_effect=lambda tables: {i: "None" for i in tables if i != 1}) as batch, \
+                patch("app.controllers.document_processing.utils.openai_utils.classify_table",
+                      return_value="Income Statement") as single:
+            result = classify_tables_batched(["t0", "t1", "t2"])
+        self.assertEqual(result, ["None", "Income Statement", "None"])
+        batch.assert_called_once()
+        single.assert_called_once_with("t1")
+
+if __name__ == "__main__":
+    unittest.main()
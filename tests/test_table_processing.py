@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import MagicMock
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 from app.controllers.document_processing.utils.doc_intel_utils import analyze_result_dict_to_df
 from app.controllers.document_processing.utils.general_utils import (
@@ -8,7 +9,12 @@ from app.controllers.document_processing.utils.general_utils import (
     extract_context_for_table,
     collect_table_polygons,
     create_page_bounding_boxes,
+    polygons_to_bounds,
+    paragraph_page_bounding_boxes,
     filter_paragraphs_without_overlap,
+    paragraph_end_offsets,
+    convert_analyze_document_to_structured_data,
+    iter_structured_segments,
     parse_table_from_response
 )
 
@@ -32,6 +38,22 @@ class TestTableProcessing(unittest.TestCase):
         self.assertEqual(context_content[0], "Heading")
         self.assertEqual(context_indices, [0, 1, 2])
 
+    def test_extract_context_for_table_unsorted_paragraphs(self):
+        paragraphs = [self.mock_paragraphs[2], self.mock_paragraphs[0], self.mock_paragraphs[1]]
+        self.assertIsNone(paragraph_end_offsets(paragraphs))
+        context_content, _, context_indices = extract_context_for_table(paragraphs, 100)
+        self.assertEqual(context_content, ["Heading", "Paragraph 1"])
+        self.assertEqual(context_indices, [1, 2])
+
+    def test_filter_paragraphs_without_overlap(self):
+        paragraphs = self.mock_paragraphs + [
+            {"content": "Inside table", "spans": [{"offset": 105, "length": 5}]},
+            {"content": "After tables", "spans": [{"offset": 200, "length": 5}]},
+        ]
+        table_spans = [{"offset": 150, "length": 20}, {"offset": 100, "length": 30}, {"offset": 120, "length": 5}]
+        kept = filter_paragraphs_without_overlap(paragraphs, table_spans)
+        self.assertEqual([offset for offset, _ in kept], [50, 60, 200])
+
     def test_collect_table_polygons(self):
         context_polygons = {1: [[0, 0, 1, 1], [2, 2, 3, 3]]}
         source = [{"pageNumber": 1, "polygon": [4, 4, 5, 5]}]
@@ -45,6 +67,109 @@ class TestTableProcessing(unittest.TestCase):
         self.assertEqual(len(bounding_boxes), 1)
         self.assertEqual(bounding_boxes[0]["boundingBox"], [0, 0, 3, 0, 3, 3, 0, 3])
 
+    def test_analyze_result_dict_to_df(self):
+        table = {
+            "rowCount": 4,
+            "columnCount": 3,
+            "cells": [
+                {"rowIndex": 0, "columnIndex": 1, "columnSpan": 2, "kind": "columnHeader", "content": "Year Ended"},
+                {"rowIndex": 1, "columnIndex": 0, "content": "Revenue ", "boundingRegions": [{"pageNumber": 2, "polygon": [0, 0, 1, 1]}]},
+                {"rowIndex": 1, "columnIndex": 1, "content": "100"},
+                {"rowIndex": 1, "columnIndex": 2, "content": "90"},
+                {"rowIndex": 3, "columnIndex": 0, "columnSpan": 3, "content": "Total"},
+            ]
+        }
+        df, sources = analyze_result_dict_to_df(table)
+        self.assertListEqual(list(df.columns), [None, "Year Ended", "Year Ended"])
+        self.assertEqual(len(df), 2)  # Header-only and empty rows are dropped
+        self.assertListEqual(list(df.iloc[0]), ["Revenue", "100", "90"])
+        self.assertListEqual(list(df.iloc[1]), ["Total", "Total", "Total"])
+        self.assertEqual(sources.shape, (2, 3))
+        self.assertEqual(sources[0][0]["pageNumber"], 2)
+        self.assertIsNone(sources[1][1])
+
+    def test_analyze_result_dict_to_df_empty_table(self):
+        for table in ({"rowCount": 0, "columnCount": 0}, {"rowCount": 2, "columnCount": 2, "cells": []}):
+            df, sources = analyze_result_dict_to_df(table)
+            self.assertTrue(df.empty)
+            self.assertIsInstance(sources, np.ndarray)
+            self.assertEqual((sources.dtype, sources.shape), (np.dtype(object), (0, 0)))
+
+    def test_polygons_to_bounds(self):
+        bounds = polygons_to_bounds([[0, 5, 2, 1, 3, 4, 1, 6], [7, 7, 8, 9]])
+        self.assertEqual(bounds.dtype, np.float32)
+        self.assertListEqual(bounds.tolist(), [[0, 1, 3, 6], [7, 7, 8, 9]])
+
+    def test_paragraph_page_bounding_boxes(self):
+        paragraph = {"boundingRegions": [
+            {"pageNumber": 1, "polygon": [0.5, 0.25, 1.5, 0.25, 1.5, 0.75, 0.5, 0.75]},
+            {"pageNumber": 2, "polygon": [1, 1, 2, 1, 2, 2, 1, 2]},
+        ]}
+        bounding_boxes = paragraph_page_bounding_boxes(paragraph)
+        self.assertEqual([box["pageNumber"] for box in bounding_boxes], [1, 2])
+        self.assertEqual(bounding_boxes[0]["boundingBox"], [0.5, 0.25, 1.5, 0.25, 1.5, 0.75, 0.5, 0.75])
+
+    def test_convert_analyze_document_to_structured_data(self):
+        table = {
+            "rowCount": 1,
+            "columnCount": 2,
+            "cells": [
+                {"rowIndex": 0, "columnIndex": 0, "content": "Revenue", "boundingRegions": [{"pageNumber": 2, "polygon": [1, 1, 2, 1, 2, 2, 1, 2]}]},
+                {"rowIndex": 0, "columnIndex": 1, "content": "100", "boundingRegions": [{"pageNumber": 2, "polygon": [2, 1, 3, 1, 3, 2, 2, 2]}]},
+            ],
+            "spans": [{"offset": 100, "length": 20}]
+        }
+        paragraphs = self.mock_paragraphs + [
+            {"content": "Revenue", "spans": [{"offset": 101, "length": 7}], "boundingRegions": [{"pageNumber": 2, "polygon": [1, 1, 2, 1, 2, 2, 1, 2]}]},
+        ]
+        segments = convert_analyze_document_to_structured_data({"paragraphs": paragraphs, "tables": [table]})
+        self.assertEqual([segment.kind for segment in segments], ["paragraph", "paragraph", "table"])
+        self.assertEqual([segment.offset for segment in segments], [50, 60, 100])
+        self.assertTrue(segments[2].is_table)
+        self.assertIn("Revenue", segments[2].text)
+        self.assertEqual(segments[2].page, 1)
+        self.assertEqual([box["pageNumber"] for box in segments[2].bounding_boxes()], [1, 2])
+        with self.assertRaises(AttributeError):
+            segments[0].content = "slots only"
+
+    def test_iter_structured_segments_matches_batch(self):
+        tables = [
+            {"rowCount": 1, "columnCount": 1, "spans": [{"offset": 85, "length": 5}],
+             "cells": [{"rowIndex": 0, "columnIndex": 0, "content": "A"}]},
+            {"rowCount": 1, "columnCount": 1, "spans": [{"offset": 55, "length": 2}],
+             "cells": [{"rowIndex": 0, "columnIndex": 0, "content": "B"}]},
+        ]
+        paragraphs = self.mock_paragraphs + [
+            {"content": "Tail", "spans": [{"offset": 120, "length": 5}], "boundingRegions": []},
+        ]
+        result = {"paragraphs": paragraphs, "tables": tables}
+        streamed = iter_structured_segments(result)
+        self.assertFalse(isinstance(streamed, list))
+        batch = convert_analyze_document_to_structured_data(result)
+        self.assertEqual(
+            [(s.offset, s.kind, s.text) for s in streamed],
+            [(s.offset, s.kind, s.text) for s in batch]
+        )
+
+    def test_iter_structured_segments_duplicate_offsets_match_batch(self):
+        # Two paragraphs share an offset; only the longer one runs into the table
+        tables = [
+            {"rowCount": 1, "columnCount": 1, "spans": [{"offset": 210, "length": 5}],
+             "cells": [{"rowIndex": 0, "columnIndex": 0, "content": "A"}]},
+        ]
+        paragraphs = self.mock_paragraphs + [
+            {"content": "Short", "spans": [{"offset": 200, "length": 3}], "boundingRegions": []},
+            {"content": "Short and into the table", "spans": [{"offset": 200, "length": 20}], "boundingRegions": []},
+            {"content": "Twice", "spans": [{"offset": 300, "length": 5}], "boundingRegions": []},
+            {"content": "Twice again", "spans": [{"offset": 300, "length": 11}], "boundingRegions": []},
+        ]
+        result = {"paragraphs": paragraphs, "tables": tables}
+        streamed = [(s.offset, s.kind, s.text) for s in iter_structured_segments(result)]
+        batch = [(s.offset, s.kind, s.text) for s in convert_analyze_document_to_structured_data(result)]
+        self.assertEqual(streamed, batch)
+        self.assertIn((200, "paragraph", "Short"), streamed)
+        self.assertIn((300, "paragraph", "Twice again"), streamed)
+
     def test_parse_table_from_response(self):
         response = (
             """
@@ -0,0 +1,71 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from app.services.azure_services import usage_tracker
+from app.services.azure_services.openai_service import AzureOpenAIService
+
+def completion(prompt_tokens, completion_tokens, cached_tokens=0):
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens)
+    )
+    message = SimpleNamespace(content="answer")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+class TestUsageTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.service = AzureOpenAIService()
+        self.service.client = MagicMock()
+        self.service.client.chat.completions.create.return_value = completion(1000, 100, cached_tokens=400)
+
+    def test_records_calls_per_filing_and_stage(self):
+        with usage_tracker.usage_run() as run_id:
+            with usage_tracker.usage_filing("a.pdf"):
+                with usage_tracker.usage_stage("metadata"):
+                    self.service.query("system", "user")
+                    self.service.query("system", "user")
+                with usage_tracker.usage_stage("income_statement"):
+                    with usage_tracker.usage_stage("revenue"):
+                        self.service.query_messages([])
+                        usage_tracker.record_retry()
+            with usage_tracker.usage_stage("aggregation"):
+                self.service.query_json("prompt", use_memory=False)
+
+        usage = usage_tracker.get_run_usage(run_id)
+        metadata = usage["stages"]["metadata"]
+        self.assertEqual(metadata["requests"], 2)
+        self.assertEqual(metadata["prompt_tokens"], 2000)
+        self.assertEqual(metadata["cached_tokens"], 800)
+        self.assertAlmostEqual(metadata["cost"], 2 * usage_tracker.call_cost("gpt-4o", 1000, 100, 400))
+        self.assertEqual(usage["stages"]["income_statement/revenue"]["retries"], 1)
+        self.assertEqual(usage["stages"]["income_statement"]["requests"], 0)
+        self.assertGreater(usage["stages"]["income_statement"]["wall_time"], 0)
+
+        self.assertEqual(usage["total"]["requests"], 4)
+        self.assertEqual(usage["filings"]["a.pdf"]["total"]["requests"], 3)
+        self.assertNotIn("aggregation", usage["filings"]["a.pdf"]["stages"])
+        self.assertEqual(usage_tracker.get_run_usage(run_id, filing="a.pdf")["total"]["requests"], 3)
+        self.assertIsNone(usage_tracker.get_run_usage(run_id, filing="b.pdf"))
+
+    def test_submit_in_context(self):
+        with usage_tracker.usage_run() as run_id, usage_tracker.usage_stage("classification"):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [
+                    usage_tracker.submit_in_context(executor, self.service.query, "system", "user") for _ in range(3)
+                ]
+                [future.result() for future in futures]
+        self.assertEqual(usage_tracker.get_run_usage(run_id)["stages"]["classification"]["requests"], 3)
+
+    def test_calls_outside_a_run_are_not_recorded(self):
+        self.service.query("system", "user")
+        self.assertIsNone(usage_tracker.get_run_usage("unknown"))
+
+    def test_call_cost(self):
+        self.assertAlmostEqual(usage_tracker.call_cost("gpt-4o", 1_000_000, 0), 2.50)
+        self.assertAlmostEqual(usage_tracker.call_cost("gpt-4o", 1_000_000, 1_000_000, 1_000_000), 11.25)
+
+if __name__ == '__main__':
+    unittest.main()